@@ -7,7 +7,7 @@
 # TODO: Rewrite with camera manager
 
 import logging
-import os
+import queue
 import time
 
 from pxl_camera.capture.frame_muxer import FrameMuxer
@@ -15,6 +15,7 @@ from pxl_camera.capture.raw_capture import RawCapture
 from pxl_camera.detect.device_detector import DeviceDetector
 from pxl_camera.filter.processor import Processor
 from pxl_camera.gui.screen import Screen
+from pxl_camera.sink.frame_sink import FrameSink
 from pxl_camera.util.key import Key
 
 # Set logging level
@@ -23,6 +24,7 @@ logging.basicConfig(
     format="[%(name)s:%(filename)s:%(lineno)d] - [%(funcName)s] - %(asctime)s - %(levelname)s - %(message)s"
 )
 
+
 detector = DeviceDetector()
 devices = detector.get_devices()
 
@@ -43,13 +45,21 @@ muxer = FrameMuxer()
 processor = Processor()
 screen = Screen()
 
+# The sharpest frame of each GOOD window is encoded and written to
+# ./frames/ in the background
+sink = FrameSink('frames')
+
+# State changes are pushed by the processor instead of polled
+events = queue.Queue()
+
 logging.info('Starting...')
 
 try:
     with capture(config=conf), \
             muxer(capture_actor=capture), \
             processor(muxer_actor=muxer), \
-            screen(control_actor=capture):
+            screen(control_actor=capture), \
+            sink:
 
         time.sleep(2)
 
@@ -59,17 +69,22 @@ try:
         processor.set_roi(roi)
 
         processor.set_base_frame(base_frame)
+        processor.add_sink(sink, best=1)
+        processor.subscribe(callback=events.put)
         screen.update_image(base_frame)
         screen.wait(1)
 
-        index = 1
-
-        os.makedirs('frames', exist_ok=True)
+        frame = base_frame
+        state = Processor.State.NONE
 
         while True:
-            frame = muxer.get_frame()
+            frame = muxer.get_frame(after_seq=frame.seq if frame else None, timeout=1.)
+            if frame is None:
+                continue
             diff_frame = processor.get_diff_frame()
-            state = processor.get_state()
+
+            while not events.empty():
+                state = events.get_nowait().state
 
             # Reload base from screen command
             if screen.get_update_base():
@@ -84,10 +99,8 @@ try:
             if screen.get_running():
                 if state == Processor.State.GOOD:
                     screen.set_status('GOOD', color='green')
-                    with open(f'frames/{frame.get_timestamp()}.jpeg', 'wb') as image_file:
-                        image_file.write(frame.get_jpeg())
-                        screen.set_index(index)
-                        index += 1
+                    # Saved by the sink in the background
+                    screen.set_index(sink.get_stats()['written'])
                 elif state == Processor.State.BASE:
                     screen.set_status('BASE', color='blue')
                 elif state == Processor.State.MOVE:
@@ -29,6 +29,9 @@ cm.set_config({
     )
 })
 
+# State changes of all cameras are pushed as they happen
+cm.subscribe(callback=print)
+
 while True:
     print(cm.get_devices())
     print(cm.get_status())
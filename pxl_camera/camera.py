@@ -3,6 +3,9 @@
 
     Manages a single camera through /dev/videoX node and allows control over
     resolution, focus and preprocessing.
+
+    If Config.source is set, frames are replayed from that source instead
+    (see ReplayCapture) and no hardware is needed.
 """
 
 import dataclasses
@@ -11,12 +14,18 @@ from pxl_actor.actor import Actor
 
 from pxl_camera.capture.frame_muxer import FrameMuxer
 from pxl_camera.capture.raw_capture import RawCapture
+from pxl_camera.capture.replay_capture import ReplayCapture
 
 from pxl_camera.filter.processor import Processor
+from pxl_camera.filter.worker_pool import WorkerPool
+from pxl_camera.sink.frame_history import FrameHistory
 
 
 class Camera(Actor):
 
+    ANALYSIS_STREAM = 'analysis'
+    HISTORY_STREAM = 'history'
+
     @dataclasses.dataclass
     class Config:
         device: str = None
@@ -25,15 +34,28 @@ class Camera(Actor):
         autofocus: bool = None
         focus: int = None
         filter: bool = None
+        source: str = None
+        analysis_scale: float = None    # Processor works on a downscaled luma stream
+        analysis_rate: float = None     # Maximum analysed frames per second
+        history: float = None           # Seconds of pre-trigger history, see FrameHistory
+        history_scale: float = 0.5
 
-    def __init__(self, config: Config = None):
+    def __init__(self, config: Config = None, worker_pool: WorkerPool = None, name: str = None):
+        """
+        :param worker_pool: Shared pool the processor's analyses run on (opt.)
+        :param name: Name of the camera in the pool and in its events
+                     (e.g. its serial).
+        """
         super(Camera, self).__init__()
 
         self.config = config
 
         self.capture = RawCapture()
         self.muxer = FrameMuxer()
-        self.processor = Processor()
+        self.processor = Processor(worker_pool=worker_pool, name=name)
+        self.history = None
+        self.history_subscription = None
+        self.history_output = {'triggers': (Processor.State.GOOD, Processor.State.MOVE)}
 
         if config is not None:
             self.start(config)
@@ -56,17 +78,45 @@ class Camera(Actor):
 
         self.config = config
 
-        capture_config = RawCapture.Config(
-            device=config.device,
-            frame_width=config.width,
-            frame_height=config.height,
-            focus=config.focus,
-            autofocus=config.autofocus
-        )
+        if config.source is not None:
+            capture_class = ReplayCapture
+            capture_config = ReplayCapture.Config(
+                source=config.source,
+                frame_width=config.width,
+                frame_height=config.height,
+                focus=config.focus,
+                autofocus=config.autofocus,
+            )
+        else:
+            capture_class = RawCapture
+            capture_config = RawCapture.Config(
+                device=config.device,
+                frame_width=config.width,
+                frame_height=config.height,
+                focus=config.focus,
+                autofocus=config.autofocus
+            )
+
+        if not isinstance(self.capture, capture_class):
+            self.capture.kill()
+            self.capture = capture_class()
 
         self.capture.start(config=capture_config)
         self.muxer.start(capture_actor=self.capture)
 
+        if config.analysis_scale is not None:
+            self.muxer.add_stream(Camera.ANALYSIS_STREAM, FrameMuxer.Stream(
+                colorspace='GRAY',
+                scale=config.analysis_scale,
+                roi=True,
+            ))
+            self.processor.set_stream(Camera.ANALYSIS_STREAM)
+        else:
+            self.processor.set_stream(None)
+
+        self.set_history(config.history)
+        self.processor.set_target_rate(config.analysis_rate)
+
         if config.filter:
             self.processor.start(muxer_actor=self.muxer)
 
@@ -90,6 +140,18 @@ class Camera(Actor):
 
         self.config.filter = filter
 
+    #
+    def get_analysis_rate(self):
+        return self.config.analysis_rate
+
+    def set_analysis_rate(self, rate: float = None):
+        """
+            Sets the maximum number of analysed frames per second, see
+            Processor.set_target_rate().
+        """
+        self.processor.set_target_rate(rate)
+        self.config.analysis_rate = rate
+
     #
     def get_autofocus(self):
         return self.config.autofocus
@@ -124,6 +186,105 @@ class Camera(Actor):
         """
         self.set_base_frame(self.muxer.get_frame())
 
+    #
+    def add_sink(self, sink, states: tuple = (Processor.State.GOOD,), stream: str = None, best: int = None):
+        """
+            Saves/forwards frames of the given processor states (or only the
+            'best' sharpest ones of each window of those states), see
+            Processor.add_sink() and pxl_camera.sink.frame_sink.
+        """
+        self.processor.add_sink(sink, states, stream, best)
+
+    def remove_sink(self, sink):
+        self.processor.remove_sink(sink)
+
+    #
+    def set_recorder(self, recorder, name: str = None):
+        """
+            Records raw frames with recorder (e.g. RawRecorder) under the given
+            name; None stops recording. See FrameMuxer.set_recorder().
+        """
+        self.muxer.set_recorder(recorder, name)
+
+    #
+    def get_history(self):
+        return self.history
+
+    def set_history(self, seconds: float = None):
+        """
+            Keeps the last 'seconds' of (downscaled, compressed) frames and
+            flushes them on state changes, see set_history_output().
+            None disables the history.
+        """
+        if self.config is not None:
+            self.config.history = seconds
+
+        if seconds is None:
+            if self.history is not None:
+                self.processor.unsubscribe(self.history_subscription)
+                self.processor.remove_sink(self.history)
+                self.muxer.unsubscribe(Camera.HISTORY_STREAM)
+                self.muxer.remove_stream(Camera.HISTORY_STREAM)
+                self.history = None
+                self.history_subscription = None
+            return
+
+        if self.history is not None:
+            self.history.set_seconds(seconds)
+            return
+
+        self.history = FrameHistory(seconds)
+        self.history.set_output(**self.history_output)
+
+        self.muxer.add_stream(Camera.HISTORY_STREAM, FrameMuxer.Stream(
+            colorspace='BGR',
+            scale=self.config.history_scale if self.config is not None else 0.5,
+        ))
+        # Converted for every grabbed frame while the history is enabled
+        self.muxer.subscribe(Camera.HISTORY_STREAM)
+        self.processor.add_sink(self.history, tuple(Processor.State), Camera.HISTORY_STREAM)
+        self.history_subscription = self.processor.subscribe(callback=self.history.handle_event)
+
+    def set_history_output(self, triggers: tuple = None, directory: str = None, callback=None):
+        """
+            Sets where the history goes when the state changes to one of
+            the triggers: JPEG files in a directory per event and/or
+            callback(trigger frame, frames). See FrameHistory.
+        """
+        self.history_output = {
+            'triggers': triggers if triggers is not None else self.history_output['triggers'],
+            'directory': directory,
+            'callback': callback,
+        }
+
+        if self.history is not None:
+            self.history.set_output(**self.history_output)
+
+    def get_history_memory(self) -> int:
+        return self.history.get_memory() if self.history is not None else 0
+
+    #
+    def subscribe(self, actor: Actor = None, method: str = None, callback=None, states: tuple = None) -> int:
+        """
+            Subscribes to the processor's state change events, see
+            Processor.subscribe().
+        """
+        return self.processor.subscribe(actor, method, callback, states)
+
+    def unsubscribe(self, subscription: int):
+        self.processor.unsubscribe(subscription)
+
+    #
+    def set_detectors(self, move: list = None, base: list = None):
+        """
+            Sets the processor's movement and/or base detector stages, see
+            Processor.set_detectors().
+        """
+        self.processor.set_detectors(move, base)
+
+    def get_detector_stats(self):
+        return self.processor.get_detector_stats()
+
     #
     def get_diff_frame(self):
         return self.processor.get_diff_frame()
@@ -143,6 +304,7 @@ class Camera(Actor):
     def get_frame(self):
         frame = self.muxer.get_frame()
         if frame:
-            frame.state = self.processor.get_state()
+            # Muxer frames are shared and immutable; this shares the pixels too
+            frame = frame.replace(state=self.processor.get_state())
 
         return frame
@@ -3,15 +3,24 @@
     cameras.
 
     Manages multiple cameras by serial number.
+
+    Cameras configured with a replay 'source' are virtual: they are started
+    on set_config() without waiting for a device to be plugged in.
 """
 import dataclasses
 import enum
+import functools
+import os
 from typing import Dict, Tuple, Any
 
 from pxl_actor.actor import Actor
 
 from pxl_camera.camera import Camera
 from pxl_camera.detect.device_detector import DeviceDetector
+from pxl_camera.filter.processor import Processor
+from pxl_camera.filter.worker_pool import WorkerPool
+from pxl_camera.util.events import Subscribers
+from pxl_camera.util.frame_pool import FramePool, get_pool
 
 
 class CameraManager(Actor):
@@ -32,6 +41,10 @@ class CameraManager(Actor):
         focus: int
         filter: bool
         roi: Tuple[int, int, int, int]
+        source: str = None
+        analysis_scale: float = None
+        analysis_rate: float = None     # Maximum analysed frames per second per camera
+        history: float = None   # Seconds of pre-trigger history per camera
 
     def _to_camera_config(self, serial: str, manager_config: Config, device: str = None) -> Camera.Config:
         if device is None:
@@ -47,13 +60,36 @@ class CameraManager(Actor):
             autofocus=manager_config.autofocus,
             focus=manager_config.focus,
             filter=manager_config.filter,
+            source=manager_config.source,
+            analysis_scale=manager_config.analysis_scale,
+            analysis_rate=manager_config.analysis_rate,
+            history=manager_config.history,
         )
 
-    def __init__(self):
+    def __init__(self, memory_budget: int = None, pool_policy: str = FramePool.Policy.DROP_OLDEST,
+                 workers: int = None):
+        """
+        :param memory_budget: Total bytes of pooled frame buffers shared by
+                              all cameras (None for unlimited).
+        :param pool_policy: What happens when the budget is exhausted, see
+                            pxl_camera.util.frame_pool.
+        :param workers: Number of analysis threads shared by all cameras
+                        (None for a worker per camera), see
+                        pxl_camera.filter.worker_pool.
+        """
         super(CameraManager, self).__init__()
 
+        self.set_memory_budget(memory_budget, pool_policy)
+
+        self.worker_pool = WorkerPool(workers) if workers else None
+
         self.config: Dict[str, CameraManager.Config] = dict()
         self.camera: Dict[str, Camera] = dict()
+        self.sinks: Dict[str, list] = dict()    # serial -> [(sink, states, best)], kept across replugs
+        self.recorders: Dict[str, Any] = dict()  # serial -> raw recorder, kept across replugs
+        self.history_output = None              # See set_history_output()
+        self.detectors: Dict[str, tuple] = dict()   # serial -> (move, base) detector stages, kept across replugs
+        self.subscribers = Subscribers()            # State change events of all cameras, see subscribe()
 
         self.device_detector = DeviceDetector()
         self.device_detector.start(actor=self, method='handle_device_event')
@@ -70,13 +106,166 @@ class CameraManager(Actor):
             manager_config = self.config.get(serial, None)
             camera_config = self._to_camera_config(serial, manager_config, device)
 
-            self.camera[serial] = Camera(camera_config)
+            self.camera[serial] = self._new_camera(serial, camera_config)
 
         if action == 'remove':
             self.camera[serial].stop()
             self.camera[serial].kill()
             del self.camera[serial]
 
+    #
+    def get_memory_budget(self):
+        return get_pool().max_bytes
+
+    def set_memory_budget(self, memory_budget: int = None, pool_policy: str = None):
+        get_pool().configure(memory_budget, pool_policy)
+
+    def get_pool_stats(self):
+        """
+            Returns frame pool statistics, see FramePool.get_stats().
+        """
+        return get_pool().get_stats()
+
+    #
+    def get_priority(self, serial: str):
+        return self.worker_pool.get_priority(serial) if self.worker_pool is not None else None
+
+    def set_priority(self, serial: str, priority: float):
+        """
+            Sets the camera's share of the shared analysis threads relative
+            to other cameras (default 1), see WorkerPool. Kept across
+            replugs. Requires 'workers'.
+        """
+        if self.worker_pool is None:
+            raise RuntimeError('Camera Manager has no shared worker pool')
+
+        self.worker_pool.set_priority(serial, priority)
+
+    def get_worker_stats(self):
+        """
+            Returns per camera statistics of the shared worker pool, see
+            WorkerPool.get_stats().
+        """
+        return self.worker_pool.get_stats() if self.worker_pool is not None else {}
+
+    def _new_camera(self, serial: str, config: Camera.Config) -> Camera:
+        camera = Camera(config, worker_pool=self.worker_pool, name=serial)
+
+        for sink, states, best in self.sinks.get(serial, []):
+            camera.add_sink(sink, states, best=best)
+
+        if serial in self.recorders:
+            camera.set_recorder(self.recorders[serial], serial)
+
+        if self.history_output is not None:
+            camera.set_history_output(**self._camera_history_output(serial))
+
+        if serial in self.detectors:
+            camera.set_detectors(*self.detectors[serial])
+
+        camera.subscribe(actor=self, method='handle_state_event')
+
+        return camera
+
+    #
+    def subscribe(self, actor: Actor = None, method: str = None, callback=None, states: tuple = None) -> int:
+        """
+            Subscribes to state change events of all cameras (Processor.Event,
+            its 'name' is the camera serial), pushed to actor.method(event=...)
+            or callback(event) on the manager's thread. Returns the
+            subscription id, see unsubscribe().
+        """
+        return self.subscribers.add(actor, method, callback, states)
+
+    def unsubscribe(self, subscription: int):
+        self.subscribers.remove(subscription)
+
+    def handle_state_event(self, event: Processor.Event):
+        self.subscribers.publish(event, self.logger)
+
+    #
+    def set_detectors(self, serial: str, move: list = None, base: list = None):
+        """
+            Sets the camera's movement and/or base detector stages, see
+            Processor.set_detectors(). Kept across replugs.
+        """
+        old_move, old_base = self.detectors.get(serial, (None, None))
+        self.detectors[serial] = (move if move is not None else old_move, base if base is not None else old_base)
+
+        if serial in self.camera:
+            self.camera[serial].set_detectors(move, base)
+
+    def get_detector_stats(self):
+        """
+            Returns detector statistics of each camera, see
+            Processor.get_detector_stats().
+        """
+        return {serial: camera.get_detector_stats() for serial, camera in self.camera.items()}
+
+    #
+    def add_sink(self, serial: str, sink, states: tuple = (Processor.State.GOOD,), best: int = None):
+        """
+            Attaches a sink (e.g. FrameSink) to the camera, which gets its
+            frames of the given processor states (only the 'best' sharpest
+            ones per window of those states, if set). The sink stays
+            attached if the camera is unplugged and plugged in again.
+        """
+        self.sinks.setdefault(serial, []).append((sink, states, best))
+
+        if serial in self.camera:
+            self.camera[serial].add_sink(sink, states, best=best)
+
+    def remove_sink(self, serial: str, sink):
+        self.sinks[serial] = [entry for entry in self.sinks.get(serial, []) if entry[0] is not sink]
+
+        if serial in self.camera:
+            self.camera[serial].remove_sink(sink)
+
+    def set_history_output(self, triggers: tuple = None, directory: str = None, callback=None):
+        """
+            Sets where the pre-trigger history of all cameras goes (see
+            Config.history and Camera.set_history_output()). Events of each
+            camera are written to a subdirectory named by its serial and
+            the callback is called as callback(serial, trigger frame, frames).
+        """
+        self.history_output = {'triggers': triggers, 'directory': directory, 'callback': callback}
+
+        for serial, camera in self.camera.items():
+            camera.set_history_output(**self._camera_history_output(serial))
+
+    def _camera_history_output(self, serial: str) -> dict:
+        output = dict(self.history_output)
+        if output['directory'] is not None:
+            output['directory'] = os.path.join(output['directory'], serial)
+        if output['callback'] is not None:
+            output['callback'] = functools.partial(output['callback'], serial)
+        return output
+
+    def get_history_memory(self) -> Dict[str, int]:
+        """
+            Returns bytes held by the history of each camera.
+        """
+        return {serial: camera.get_history_memory() for serial, camera in self.camera.items()}
+
+    def start_recording(self, recorder, *args):
+        """
+            Records raw frames of the given cameras (all configured cameras
+            if none are given) with recorder, e.g. a RawRecorder shared by
+            all of them. Frames are recorded under the camera serial.
+        """
+        for serial in args or self.config.keys():
+            self.recorders[serial] = recorder
+
+            if serial in self.camera:
+                self.camera[serial].set_recorder(recorder, serial)
+
+    def stop_recording(self, *args):
+        for serial in args or list(self.recorders.keys()):
+            self.recorders.pop(serial, None)
+
+            if serial in self.camera:
+                self.camera[serial].set_recorder(None)
+
     #
     def get_config(self):
         return self.config
@@ -99,6 +288,11 @@ class CameraManager(Actor):
 
             self.config[serial] = self._updated_config(old_config, new_config)
 
+            # Virtual (replayed) cameras don't wait for a device event
+            if serial not in self.camera and self.config[serial].source is not None:
+                self.camera[serial] = self._new_camera(serial, self.config[serial])
+                continue
+
             if old_config == new_config or serial not in self.camera:
                 continue
 
@@ -116,6 +310,10 @@ class CameraManager(Actor):
                         self.camera[serial].set_focus(value)
                     elif key == 'filter':
                         self.camera[serial].set_filter(value)
+                    elif key == 'analysis_rate':
+                        self.camera[serial].set_analysis_rate(value)
+                    elif key == 'history':
+                        self.camera[serial].set_history(value)
                     elif key == 'roi':
                         if isinstance(value, tuple) and \
                                 len(value) == 4 and \
@@ -160,6 +358,8 @@ class CameraManager(Actor):
             old_config.device != new_config.device,
             old_config.width != new_config.width,
             old_config.height != new_config.height,
+            new_config.source is not None and old_config.source != new_config.source,
+            new_config.analysis_scale is not None and old_config.analysis_scale != new_config.analysis_scale,
         ])
 
     #
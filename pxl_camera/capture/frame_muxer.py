@@ -7,31 +7,101 @@
     Otherwise returns a Frame object containing the frame
     in RGB format and timestamp of the captured frame.
 
+    The capture queue is drained at sensor rate with grab() only; pixels of
+    the last grabbed frame are retrieved and decoded on the first
+    get_frame() call after it, so idle cameras cost almost no CPU.
+
+    Decoded frames are cached per captured frame, so all consumers of the
+    same frame share a single colour conversion. See get_cache_stats().
+
+    get_gray_frame() returns the Y plane of the raw frame directly, which is
+    all that motion/base detection needs. get_frames() returns several views
+    of the same grabbed frame in one call.
+
+    With a roi set (set_roi()), roi=True requests convert only the roi part
+    of the raw frame; the full frame is converted only if someone asks for it.
+
+    Named streams (add_stream()) publish derived frames of their own size and
+    colour format from the same capture, e.g. full-res BGR for archiving and
+    a 1/4 scale grayscale stream for the processor. Each stream is converted
+    once per frame; while it has subscribers it is converted eagerly for
+    every grabbed frame, otherwise only on request.
+
+    In UMAT execution mode (image_processing.set_mode()) raw frames are
+    uploaded once per retrieve and all views stay device-resident; Frame
+    metadata is computed without reading the images back.
+
+    Converted numpy frames are written to buffers leased from the shared
+    frame pool (pxl_camera.util.frame_pool), which return to the pool once
+    the last consumer drops the frame.
+
     TODO: Make sure errors are well-defined + add exceptions?
 """
 
+import collections
+import dataclasses
 import datetime
-from typing import Union
+import time
+from typing import Dict, Union
 
 import cv2
+import numpy
 
 from pxl_actor.actor import Actor
 
 from pxl_camera.filter.processor import Processor
-from pxl_camera.util import image_processing
+from pxl_camera.util import frame_pool, image_processing
 from pxl_camera.util.frame import Frame
 
 
 class FrameMuxer(Actor):
 
-    def __init__(self, capture_actor: Actor = None):
+    # Stream names of get_frame() and get_gray_frame() in get_dropped_frames()
+    FRAME_STREAM = 'frame'
+    GRAY_STREAM = 'gray_frame'
+
+    @dataclasses.dataclass(frozen=True)
+    class Stream:
+        colorspace: str = 'BGR'     # 'BGR' or 'GRAY' (Y plane)
+        scale: float = 1.0          # Relative to the (roi) frame size
+        roi: bool = False           # Crop to the muxer roi before conversion
+
+    class _Entry:
+        """
+            Ring buffer entry of a single grabbed frame.
+        """
+        def __init__(self, seq: int, timestamp: datetime.datetime):
+            self.seq = seq
+            self.timestamp = timestamp
+            self.views = {}     # Decoded Frames of this entry, by view key
+
+    def __init__(self, capture_actor: Actor = None, ring_size: int = 8):
         super(FrameMuxer, self).__init__()
 
         self.frame = None
+        self.fourcc = None
         self.colorspace = None
         self.timestamp = None
         self.started = None
 
+        self.seq = 0
+        self.dropped: Dict[str, int] = dict()   # Skipped frames per stream, see get_dropped_frames()
+        self.ring = collections.deque(maxlen=ring_size)
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.roi = None
+
+        self.streams: Dict[str, FrameMuxer.Stream] = dict()
+        self.subscribers: Dict[str, int] = dict()
+
+        self.recorder = None        # See set_recorder()
+        self.recorder_name = None
+
+        self._capture = None
+        self._retrieved = False
+
         if capture_actor is not None:
             self.start(capture_actor)
 
@@ -50,10 +120,13 @@ class FrameMuxer(Actor):
 
     def start(self, capture_actor: Actor):
         self.started = True
+        self._capture = capture_actor
         self.ping(capture_actor)
 
     def stop(self):
         self.started = False
+        self._capture = None
+        self.ring.clear()
 
     def on_exit(self):
         self.stop()
@@ -62,43 +135,420 @@ class FrameMuxer(Actor):
         if not self.started:
             return
 
+        if self._grab(capture_actor):
+            self.enqueue(method='ping', kwargs={'capture_actor': capture_actor})
+
+    def _grab(self, capture_actor: Actor) -> bool:
+        """
+            Grabs the next frame into the ring. Returns False on capture failure.
+        """
         try:
-            frame = capture_actor.get_frame()
+            capture_actor.grab()
             timestamp = datetime.datetime.now()
         except RuntimeError:
             self.stop()
-            return
+            return False
 
-        # If RawCapture works by design, this should never happen:
-        if frame is None:
-            self.stop()
-            return
-
-        # Frame is valid
-        self.frame = frame
+        # Frame is grabbed, pixels are retrieved on demand
+        self.frame = None
+        self._retrieved = False
         self.timestamp = timestamp
-        self.colorspace = getattr(cv2, f'COLOR_YUV2BGR_{capture_actor.config.fourcc.upper()}')
+        self.fourcc = capture_actor.config.fourcc.upper()
+        self.colorspace = getattr(cv2, f'COLOR_YUV2BGR_{self.fourcc}')
+
+        self.seq += 1
+        entry = FrameMuxer._Entry(self.seq, timestamp)
+        self.ring.append(entry)
+
+        # Recording needs the raw pixels of every frame
+        if self.recorder is not None and self._retrieve():
+            raw = image_processing.to_host(self.frame)
+            self.recorder.put(self.recorder_name, entry.seq, timestamp, raw, self.fourcc)
 
-        self.enqueue(method='ping', kwargs={'capture_actor': capture_actor})
+        # Subscribed streams are converted for every frame
+        for name, subscribers in self.subscribers.items():
+            if subscribers > 0:
+                stream = self.streams[name]
+                self._get_view(entry, self._view_key(stream), self._converter(stream))
 
-    def get_frame(self) -> Union[None, Frame]:
+        return self.started
+
+    def _wait(self, after_seq: int, timeout: float = None) -> bool:
         """
-            Returns None or a Frame object containing the last frame with timestamp.
+            Grabs frames until one newer than 'after_seq' is available.
+
+            Waiting happens on the muxer's own thread by driving the capture
+            directly, so the capture keeps being drained at sensor rate.
+            Returns False on timeout or capture failure.
         """
-        if not self.started:
-            raise RuntimeError(f'Frame Muxer not started')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        while self.seq <= after_seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if not self.started or not self._grab(self._capture):
+                return False
+
+        return True
+
+    def _next_entry(self, view: tuple, after_seq: int = None, newest: bool = False,
+                    name: str = None) -> Union[None, _Entry]:
+        """
+            Returns the oldest entry newer than 'after_seq' that still has (or
+            can still get) the requested view, counting the skipped ones as
+            dropped for the stream 'name'. Returns the latest entry if 'after_seq' is None, or if
+            'newest' is set (the caller skips frames on purpose, so nothing
+            is counted as dropped).
+        """
+        if not self.ring:
+            return None
+
+        latest = self.ring[-1]
+
+        if after_seq is None:
+            return latest
+
+        if newest:
+            return latest if latest.seq > after_seq else None
 
-        if self.frame is None:
+        for entry in self.ring:
+            if entry.seq > after_seq and (view in entry.views or entry is latest):
+                if entry.seq - after_seq > 1:
+                    self.dropped[name] = self.dropped.get(name, 0) + entry.seq - after_seq - 1
+                return entry
+
+        return None
+
+    def _get_view(self, entry: _Entry, view: tuple, convert) -> Union[None, Frame]:
+        """
+            Returns the cached 'view' of the entry, converting it from the raw
+            frame with convert(raw, entry) on first use.
+
+            Raw pixels exist only for the latest entry, so views of older
+            entries are available only if they were converted back then.
+        """
+        frame = entry.views.get(view, None)
+
+        if frame is not None:
+            self.cache_hits += 1
+            return frame
+
+        if not self.ring or entry is not self.ring[-1] or not self._retrieve():
             return None
 
-        rgb_frame = cv2.cvtColor(self.frame, self.colorspace)
-        width, height, channels = image_processing.image_size(rgb_frame)
+        self.cache_misses += 1
+        frame = convert(self.frame, entry)
+
+        # None if the frame pool is exhausted
+        if frame is not None:
+            entry.views[view] = frame
+
+        return frame
+
+    def _retrieve(self) -> bool:
+        """
+            Retrieves pixels of the last grabbed frame, if not retrieved yet.
+            Returns False if no frame is available.
+        """
+        if self.timestamp is None:
+            return False
+
+        if not self._retrieved:
+            try:
+                self.frame = self._capture.retrieve()
+            except RuntimeError:
+                self.stop()
+                return False
+
+            # If RawCapture works by design, this should never happen:
+            if self.frame is None:
+                self.stop()
+                return False
+
+            # Uploaded (UMAT mode) once here, shared by all conversions
+            self.frame = image_processing.to_device(self.frame)
+
+            self._retrieved = True
+
+        return True
+
+    def get_seq(self) -> int:
+        """
+            Returns sequence number of the last grabbed frame.
+        """
+        return self.seq
+
+    def get_dropped_frames(self, name: str = None):
+        """
+            Returns the number of frames skipped by get_*frame(after_seq=...)
+            callers of the stream 'name' because they were overwritten before
+            being consumed, or a dict of all streams if 'name' is None.
+            get_frame() and get_gray_frame() count as the FRAME_STREAM and
+            GRAY_STREAM streams.
+
+            Callers of the same stream share its count; callers that skip
+            frames on purpose (newest=True) aren't counted.
+        """
+        if name is None:
+            return dict(self.dropped)
+        return self.dropped.get(name, 0)
+
+    def get_cache_stats(self) -> dict:
+        """
+            Returns hit/miss counters of the per-frame conversion cache.
+        """
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+        }
+
+    def get_recorder(self):
+        return self.recorder
+
+    def set_recorder(self, recorder, name: str = None):
+        """
+            Passes raw pixels of every grabbed frame to recorder.put() under
+            the given (camera) name, e.g. a RawRecorder. None stops recording.
+        """
+        self.recorder = recorder
+        self.recorder_name = name
+
+    def get_roi(self):
+        return self.roi
+
+    def set_roi(self, roi: tuple):
+        """
+            Sets the normalized roi (x1, y1, x2, y2) used by get_frame(roi=True)
+            and get_gray_frame(roi=True). None disables cropping.
+        """
+        self.roi = tuple(roi) if roi is not None else None
+
+    def _raw_size(self, raw):
+        if isinstance(raw, numpy.ndarray):
+            return raw.shape[1], raw.shape[0]
+
+        # Avoids downloading UMat frames just to read their size
+        return int(self._capture.config.frame_width), int(self._capture.config.frame_height)
+
+    def _convert(self, raw, entry: _Entry, colorspace: str, roi: tuple = None, scale: float = 1.0) -> Frame:
+        """
+            Converts raw frame to 'BGR' or 'GRAY' (Y plane). If roi is given,
+            only the macropixel-aligned roi region of the raw frame is converted.
+        """
+        width, height = self._raw_size(raw)
+
+        if roi is not None:
+            x1, y1, x2, y2 = image_processing.roi_bounds(width, height, roi, align=2)
+            width, height = x2 - x1, y2 - y1
+
+            if isinstance(raw, numpy.ndarray):
+                raw = raw[y1:y2, x1:x2]
+            else:
+                raw = cv2.UMat(raw, [y1, y2], [x1, x2])
+
+        # Size is tracked here, so UMat images are never downloaded to read it
+        size = width, height, 1 if colorspace == 'GRAY' else 3
+        out_size = image_processing.scaled_size(size, scale) if scale != 1.0 else size
+
+        # Outputs of numpy frames go to pooled buffers, OpenCV allocates UMat
+        dst = tmp = None
+        if isinstance(raw, numpy.ndarray):
+            dst = self._lease(out_size)
+            if dst is None:
+                return None
+            if scale != 1.0 and colorspace != 'GRAY':
+                # Back in the pool right after resizing
+                tmp = self._lease(size)
+
+        if colorspace == 'GRAY':
+            # Copied out of the raw buffer, which is reused by the capture.
+            # No need to copy if it will be resized anyway.
+            image = image_processing.yuv422_luma(
+                raw, self.fourcc, copy=scale == 1.0, dst=dst if scale == 1.0 else None,
+            )
+        else:
+            image = cv2.cvtColor(raw, self.colorspace, dst=dst if scale == 1.0 else tmp)
+
+        if scale != 1.0:
+            image = cv2.resize(image, out_size[:2], dst=dst, interpolation=cv2.INTER_AREA)
+
+        width, height, channels = out_size
 
         return Frame(
             width=width,
             height=height,
             channels=channels,
-            frame=rgb_frame,
-            timestamp=self.timestamp,
-            state=Processor.State.NONE
+            frame=image,
+            timestamp=entry.timestamp,
+            state=Processor.State.NONE,
+            seq=entry.seq,
+            roi=roi,
+        )
+
+    def _lease(self, size: tuple):
+        """
+            Returns a pooled buffer for an image of 'size', or None if the
+            frame pool is exhausted. With the DROP_OLDEST policy cached
+            frames of the oldest ring entries are dropped to make room.
+        """
+        width, height, channels = size
+        shape = (height, width) if channels == 1 else (height, width, channels)
+
+        pool = frame_pool.get_pool()
+        buffer = pool.acquire(shape)
+
+        if pool.policy == frame_pool.FramePool.Policy.DROP_OLDEST:
+            for entry in list(self.ring)[:-1]:
+                if buffer is not None:
+                    break
+                if entry.views:
+                    entry.views.clear()
+                    buffer = pool.acquire(shape)
+
+        return buffer
+
+    def _view_key(self, stream: Stream) -> tuple:
+        return stream.colorspace, self.roi if stream.roi else None, stream.scale
+
+    def _converter(self, stream: Stream):
+        roi = self.roi if stream.roi else None
+        return lambda raw, entry: self._convert(raw, entry, stream.colorspace, roi, stream.scale)
+
+    def _find_entry(self, seq: int) -> Union[None, _Entry]:
+        """
+            Returns the ring entry of the frame 'seq', None if it was
+            overwritten (or not grabbed yet).
+        """
+        if not self.ring:
+            return None
+
+        # Sequence numbers in the ring are consecutive
+        index = seq - self.ring[0].seq
+        return self.ring[index] if 0 <= index < len(self.ring) else None
+
+    def _entry(self, stream: Stream, after_seq: int, timeout: float, newest: bool = False,
+               name: str = None, seq: int = None) -> Union[None, _Entry]:
+        if not self.started:
+            raise RuntimeError(f'Frame Muxer not started')
+
+        if seq is not None:
+            return self._find_entry(seq)
+
+        if after_seq is not None and not self._wait(after_seq, timeout):
+            return None
+
+        return self._next_entry(self._view_key(stream), after_seq, newest, name)
+
+    def _get(self, stream: Stream, after_seq: int, timeout: float, newest: bool = False,
+             name: str = None, seq: int = None) -> Union[None, Frame]:
+        entry = self._entry(stream, after_seq, timeout, newest, name, seq)
+        if entry is None:
+            return None
+
+        return self._get_view(entry, self._view_key(stream), self._converter(stream))
+
+    def get_frame(self, after_seq: int = None, timeout: float = None, roi: bool = False,
+                  newest: bool = False, seq: int = None) -> Union[None, Frame]:
+        """
+            Returns None or a Frame object containing the last frame with timestamp.
+
+            If 'after_seq' is given, returns the next available frame with a
+            sequence number greater than 'after_seq', blocking for up to
+            'timeout' seconds (forever if None) until it is captured.
+            With 'newest' set, the latest such frame is returned instead and
+            the ones in between are skipped.
+
+            If 'seq' is given, returns the frame of that sequence number
+            instead, or None if it is no longer available: it was overwritten,
+            or it isn't the last grabbed frame and the view wasn't converted
+            while it was.
+
+            If 'roi' is True and a roi is set, only the roi region of the raw
+            frame is converted and returned (see Frame.roi).
+        """
+        return self._get(
+            FrameMuxer.Stream('BGR', roi=roi), after_seq, timeout, newest, FrameMuxer.FRAME_STREAM, seq,
         )
+
+    def get_gray_frame(self, after_seq: int = None, timeout: float = None, roi: bool = False,
+                       newest: bool = False, seq: int = None) -> Union[None, Frame]:
+        """
+            Same as get_frame(), except the Frame contains the single channel
+            luma (Y plane) of the raw frame, extracted without colour conversion.
+        """
+        return self._get(
+            FrameMuxer.Stream('GRAY', roi=roi), after_seq, timeout, newest, FrameMuxer.GRAY_STREAM, seq,
+        )
+
+    def get_frames(self, stream: str = None, gray: bool = False, after_seq: int = None, timeout: float = None,
+                   roi: bool = False, newest: bool = False, sinks: tuple = ()) -> tuple:
+        """
+            Returns (frame, {sink stream: Frame}): the frame of the named
+            stream (get_frame() or get_gray_frame() if None, with 'roi'),
+            and the frames of the 'sinks' streams (None for the full BGR
+            frame) of the same grabbed frame.
+
+            All of them are converted in this call, while the muxer still
+            has the raw pixels; a separate get_*frame(seq=...) call later
+            would find them overwritten. Frames that can't be converted
+            (e.g. the frame pool is exhausted) are None.
+        """
+        if stream is None:
+            name = FrameMuxer.GRAY_STREAM if gray else FrameMuxer.FRAME_STREAM
+            main = FrameMuxer.Stream('GRAY' if gray else 'BGR', roi=roi)
+        else:
+            name, main = stream, self._stream(stream)
+
+        entry = self._entry(main, after_seq, timeout, newest, name)
+        if entry is None:
+            return None, {}
+
+        frame = self._get_view(entry, self._view_key(main), self._converter(main))
+
+        frames = {}
+        for sink in sinks:
+            if sink not in frames:
+                sink_stream = self._stream(sink) if sink is not None else FrameMuxer.Stream('BGR')
+                frames[sink] = self._get_view(entry, self._view_key(sink_stream), self._converter(sink_stream))
+
+        return frame, frames
+
+    def _stream(self, name: str) -> Stream:
+        if name not in self.streams:
+            raise KeyError(f'Unknown stream [{name}]')
+        return self.streams[name]
+
+    # Streams
+    def get_streams(self) -> Dict[str, Stream]:
+        return self.streams
+
+    def add_stream(self, name: str, stream: Stream):
+        """
+            Adds (or replaces) a named derived stream.
+        """
+        self.streams[name] = stream
+        self.subscribers.setdefault(name, 0)
+
+    def remove_stream(self, name: str):
+        self.streams.pop(name, None)
+        self.subscribers.pop(name, None)
+
+    def subscribe(self, name: str):
+        """
+            Stream is converted eagerly for every frame while it has subscribers.
+        """
+        if name not in self.streams:
+            raise KeyError(f'Unknown stream [{name}]')
+
+        self.subscribers[name] += 1
+
+    def unsubscribe(self, name: str):
+        if self.subscribers.get(name, 0) > 0:
+            self.subscribers[name] -= 1
+
+    def get_stream_frame(self, name: str, after_seq: int = None, timeout: float = None,
+                         newest: bool = False, seq: int = None) -> Union[None, Frame]:
+        """
+            Same as get_frame(), for the named stream.
+        """
+        return self._get(self._stream(name), after_seq, timeout, newest, name, seq)
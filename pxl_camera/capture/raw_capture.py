@@ -4,18 +4,33 @@
     Captures frame in raw format (usually UYVY or YUYV).
     Use frame muxer for decoding or roll your own.
 
+    Two backends are available through Config.backend:
+      - OPENCV: cv2.VideoCapture (default)
+      - V4L2:   native mmap streaming with 'buffer_count' driver buffers and
+                zero-copy frames (see v4l2_capture.V4L2Capture). A frame is
+                only valid until the next get_frame() call.
+
     TODO: Add exception on device malfunction?
 """
 
 import dataclasses
+import enum
 
 import cv2
+import numpy
 
 from pxl_actor.actor import Actor
 
+from pxl_camera.capture.v4l2_capture import V4L2Capture
+from pxl_camera.util import frame_pool, image_processing
+
 
 class RawCapture(Actor):
 
+    class Backend(str, enum.Enum):
+        OPENCV = 'opencv'
+        V4L2 = 'v4l2'
+
     # CONFIG
     @dataclasses.dataclass
     class Config:
@@ -27,6 +42,8 @@ class RawCapture(Actor):
         convert_rgb: bool = False
         autofocus: bool = None
         focus: int = None
+        backend: str = None         # RawCapture.Backend, OPENCV if unset
+        buffer_count: int = None    # V4L2 backend only
 
         @staticmethod
         def decode_fourcc(fourcc):
@@ -39,8 +56,10 @@ class RawCapture(Actor):
 
         self.open = False
         self.config = RawCapture.Config()
+        self.backend = RawCapture.Backend.OPENCV
         self.capture = cv2.VideoCapture()
         self.frame = None
+        self._buffer = None     # Pooled read buffer, see _pooled()
 
         if config is not None:
             # We can remove the "no_wait" since super().__init__() already started the actor.
@@ -66,7 +85,7 @@ class RawCapture(Actor):
         if self.capture.isOpened():
             self.logger.info(f'Releasing capture {self.config.device}...')
             self.capture.release()
-        self.config = RawCapture.Config()
+        self.config = RawCapture.Config(backend=self.config.backend, buffer_count=self.config.buffer_count)
 
     def get_autofocus(self):
         return self.config.autofocus
@@ -102,6 +121,23 @@ class RawCapture(Actor):
         if self.config.device is None and config.device is None:
             raise RuntimeError('Config capture not set')
 
+        # Backend
+        self.logger.debug('set config - backend...')
+
+        backend = RawCapture.Backend(config.backend) if config.backend is not None else self.backend
+        buffer_count = config.buffer_count if config.buffer_count is not None else self.config.buffer_count
+
+        if backend != self.backend or \
+                (backend == RawCapture.Backend.V4L2 and buffer_count != self.config.buffer_count):
+            if self.capture.isOpened():
+                self.capture.release()
+            self.capture = V4L2Capture(buffer_count) if backend == RawCapture.Backend.V4L2 else cv2.VideoCapture()
+            self.backend = backend
+            self.config.device = None
+
+        self.config.backend = backend.value
+        self.config.buffer_count = buffer_count
+
         # Device
         self.logger.debug('set config - capture...')
 
@@ -109,7 +145,10 @@ class RawCapture(Actor):
             success = self.capture.open(filename=config.device)  # , apiPreference=cv2.CAP_V4L2)  # This should be auto
             if success:
                 self.config.device = config.device
-                self.frame = cv2.UMat(self.get_frame())
+                self.frame = self.get_frame()
+                if self.backend == RawCapture.Backend.OPENCV:
+                    # Read straight into the representation of the execution mode
+                    self.frame = image_processing.to_device(self.frame)
                 self.logger.info(f'Opening capture {config.device} [{self.capture.getBackendName()}] success')
             else:
                 self.config.device = None
@@ -132,7 +171,7 @@ class RawCapture(Actor):
         # Other config
         self.logger.debug('set config - other...')
 
-        skip_keys = {'capture', 'fourcc'}
+        skip_keys = {'capture', 'fourcc', 'backend', 'buffer_count'}
 
         for key, value in dataclasses.asdict(config).items():
             if key in skip_keys:
@@ -169,6 +208,25 @@ class RawCapture(Actor):
 
         return True
 
+    def _pooled(self, frame):
+        """
+            Moves the (reused) read buffer into the frame pool, so it counts
+            towards the pool's memory budget. Leased once the capture returns
+            frames of a new shape (the first ones, or after a config change
+            made OpenCV reallocate), so it always fits the frames read into it.
+        """
+        if self.backend != RawCapture.Backend.OPENCV or not isinstance(frame, numpy.ndarray) \
+                or frame is self._buffer:
+            return frame
+
+        # The old buffer returns to the pool once the last frame read into it is dropped
+        self._buffer = frame_pool.get_pool().acquire(frame.shape, frame.dtype)
+        if self._buffer is None:
+            return frame
+
+        self._buffer[...] = frame
+        return self._buffer
+
     def get_frame(self):
         """
             Retrieves and returns the next frame from capture, if available.
@@ -177,12 +235,40 @@ class RawCapture(Actor):
         if not self.config.device:
             raise RuntimeError(f'Device {self.config.device} not opened')
 
-        success, self.frame = self.capture.read(self.frame)
+        success, frame = self.capture.read(self.frame)
 
         if not success:
             self.capture.release()
             raise RuntimeError(f'Device {self.config.device} malfunctioned')
 
+        self.frame = self._pooled(frame)
+        return self.frame
+
+    def grab(self):
+        """
+            Grabs the next frame from capture without decoding/copying it.
+            Use retrieve() to get the pixels of the last grabbed frame.
+        """
+        if not self.config.device:
+            raise RuntimeError(f'Device {self.config.device} not opened')
+
+        if not self.capture.grab():
+            self.capture.release()
+            raise RuntimeError(f'Device {self.config.device} malfunctioned')
+
+    def retrieve(self):
+        """
+            Returns the last grabbed frame.
+        """
+        if not self.config.device:
+            raise RuntimeError(f'Device {self.config.device} not opened')
+
+        success, frame = self.capture.retrieve(self.frame)
+
+        if not success:
+            raise RuntimeError(f'Device {self.config.device} retrieve failed')
+
+        self.frame = self._pooled(frame)
         return self.frame
 
     def on_exit(self):
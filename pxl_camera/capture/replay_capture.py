@@ -0,0 +1,355 @@
+"""
+    Hardware-free drop-in replacement for RawCapture.
+
+    Replays raw frames from one of the following sources:
+      - raw YUV 4:2:2 dump (*.raw, *.yuv, *.uyvy, *.yuyv) of concatenated
+        frame_width x frame_height frames, memory-mapped (no copies)
+      - video file readable by cv2.VideoCapture
+      - directory of images (replayed in sorted filename order, decoded on
+        demand with a small cache of converted frames)
+      - 'synthetic' procedurally generated scene: static background, moving
+        object and lighting changes
+
+    Frames are returned in the configured fourcc (UYVY or YUYV), exactly like
+    RawCapture, so FrameMuxer and everything after it works unchanged.
+    With realtime=False frames are produced as fast as they are requested.
+"""
+
+import collections
+import dataclasses
+import math
+import os
+import time
+
+import cv2
+import numpy
+
+from pxl_actor.actor import Actor
+
+from pxl_camera.util import image_processing
+
+
+class ReplayCapture(Actor):
+
+    SYNTHETIC = 'synthetic'
+    RAW_EXTENSIONS = {'.raw', '.yuv', '.uyvy', '.yuyv'}
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'}
+    IMAGE_CACHE_SIZE = 8    # Converted image frames kept, e.g. for short loops
+
+    # CONFIG
+    @dataclasses.dataclass
+    class Config:
+        source: str = None
+        fourcc: str = 'UYVY'
+        frame_width: int = None
+        frame_height: int = None
+        fps: int = None
+        realtime: bool = True
+        loop: bool = True
+        autofocus: bool = False
+        focus: int = 0
+
+        # Synthetic scene
+        object_speed: int = 8               # pixels per frame, 0 disables the object
+        object_size: float = 0.1            # relative to frame height
+        lighting_amplitude: float = 0.0     # relative luma gain amplitude (0.0 - 1.0)
+        lighting_period: int = 120          # frames
+
+    def __init__(self, config: Config = None):
+        super().__init__()
+
+        self.config = ReplayCapture.Config()
+        self.frame = None
+
+        self._frames = None     # Indexable frame source (memmap)
+        self._images = None     # Image paths of directory sources
+        self._image_cache = collections.OrderedDict()   # index -> converted frame
+        self._video = None      # cv2.VideoCapture for video sources
+        self._background = None
+        self._index = 0
+        self._next_time = None
+
+        if config is not None:
+            self.set_config(config)
+
+    def __call__(self, config: Config):
+        if not isinstance(config, ReplayCapture.Config):
+            raise TypeError(f'config [{type(config)}] not instance of ReplayCapture.Config')
+        else:
+            self.set_config(config)
+            return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self, config: Config):
+        self.set_config(config)
+
+    def stop(self):
+        if self._video is not None:
+            self._video.release()
+
+        self._frames = None
+        self._images = None
+        self._image_cache.clear()
+        self._video = None
+        self._background = None
+        self.frame = None
+        self.config = ReplayCapture.Config()
+
+    def on_exit(self):
+        self.stop()
+
+    # Controls are accepted and remembered, so the GUI and Camera work as usual
+    def get_autofocus(self):
+        return self.config.autofocus
+
+    def set_autofocus(self, autofocus: bool):
+        self.config.autofocus = autofocus
+        return True
+
+    def get_focus(self):
+        return self.config.focus if not self.config.autofocus else None
+
+    def set_focus(self, focus):
+        self.config.focus = focus
+        return True
+
+    def set_config(self, config: Config):
+        """
+            Opens the replay source. Returns False if the source can't be opened.
+        """
+        self.logger.debug(f'set config [{config}]')
+
+        if config.source is None:
+            raise RuntimeError('Config source not set')
+
+        self.stop()
+        self.config = dataclasses.replace(config, fourcc=(config.fourcc or 'UYVY').upper())
+
+        try:
+            if config.source == ReplayCapture.SYNTHETIC:
+                self._open_synthetic()
+            elif os.path.isdir(config.source):
+                self._open_images()
+            elif os.path.splitext(config.source)[1].lower() in ReplayCapture.RAW_EXTENSIONS:
+                self._open_raw()
+            else:
+                self._open_video()
+        except (OSError, ValueError) as exc:
+            self.logger.error(f'Opening replay source {config.source} failure: {exc}')
+            self.stop()
+            return False
+
+        if self.config.fps is None:
+            self.config.fps = 30
+
+        self._index = -1
+        self._next_time = None
+
+        self.logger.info(f'Successfully opened replay source {config.source} [{self.config}]')
+
+        return True
+
+    def _open_raw(self):
+        if self.config.frame_width is None or self.config.frame_height is None:
+            raise ValueError('frame_width and frame_height are required for raw dumps')
+
+        frame_size = self.config.frame_width * self.config.frame_height * 2
+        frame_count = os.path.getsize(self.config.source) // frame_size
+        if frame_count == 0:
+            raise ValueError('raw dump contains no complete frame')
+
+        self._frames = numpy.memmap(
+            self.config.source,
+            dtype=numpy.uint8,
+            mode='r',
+            shape=(frame_count, self.config.frame_height, self.config.frame_width, 2),
+        )
+
+    def _open_images(self):
+        # Only listed here; images are decoded when their frame is retrieved
+        self._images = sorted(
+            os.path.join(self.config.source, name)
+            for name in os.listdir(self.config.source)
+            if os.path.splitext(name)[1].lower() in ReplayCapture.IMAGE_EXTENSIONS
+        )
+        if not self._images:
+            raise ValueError('image directory contains no images')
+
+    def _image_frame(self, index):
+        """
+            Returns the converted frame of the image at index (None if it
+            can't be decoded), keeping the last few in a cache.
+        """
+        if index in self._image_cache:
+            self._image_cache.move_to_end(index)
+            return self._image_cache[index]
+
+        image = cv2.imread(self._images[index])
+        if image is None:
+            self.logger.warning(f'Image {self._images[index]} can\'t be decoded')
+            return None
+
+        frame = self._image_cache[index] = self._to_raw(image)
+        while len(self._image_cache) > ReplayCapture.IMAGE_CACHE_SIZE:
+            self._image_cache.popitem(last=False)
+
+        return frame
+
+    def _open_video(self):
+        self._video = cv2.VideoCapture(self.config.source)
+        if not self._video.isOpened():
+            raise ValueError('video file can\'t be opened')
+
+        if self.config.fps is None:
+            self.config.fps = self._video.get(cv2.CAP_PROP_FPS) or None
+
+    def _open_synthetic(self):
+        width = self.config.frame_width or 1920
+        height = self.config.frame_height or 1080
+        self.config.frame_width, self.config.frame_height = width, height
+
+        # Static, textured background: gradient + fixed noise + grid
+        x = numpy.linspace(0, 255, width, dtype=numpy.float32)
+        y = numpy.linspace(0, 255, height, dtype=numpy.float32)[:, numpy.newaxis]
+        noise = numpy.random.default_rng(0).integers(0, 32, (height, width), numpy.uint8)
+
+        background = numpy.empty((height, width, 3), numpy.uint8)
+        background[:, :, 0] = (x * 0.5 + y * 0.25).astype(numpy.uint8)
+        background[:, :, 1] = (y * 0.5 + 64).astype(numpy.uint8)
+        background[:, :, 2] = cv2.add((255 - x * 0.5 - y * 0.25).astype(numpy.uint8), noise)
+        background[::height // 16 or 1, :, :] = 0
+        background[:, ::width // 16 or 1, :] = 0
+
+        self._background = self._to_raw(background)
+
+    def _to_raw(self, image):
+        """
+            Resizes (if needed) and packs a BGR image into the configured fourcc.
+        """
+        height, width = image.shape[:2]
+
+        if self.config.frame_width is None or self.config.frame_height is None:
+            self.config.frame_width, self.config.frame_height = width - width % 2, height
+
+        if (width, height) != (self.config.frame_width, self.config.frame_height):
+            image = cv2.resize(image, (self.config.frame_width, self.config.frame_height))
+
+        return image_processing.bgr_to_yuv422(image, self.config.fourcc)
+
+    def _synthetic_frame(self, index):
+        frame = self._background.copy()
+        height, width = frame.shape[:2]
+        y_index = 1 if self.config.fourcc == 'UYVY' else 0
+
+        if self.config.lighting_amplitude:
+            phase = 2 * math.pi * index / self.config.lighting_period
+            gain = 1. + self.config.lighting_amplitude * math.sin(phase)
+            lut = numpy.clip(numpy.arange(256) * gain, 16, 235).astype(numpy.uint8)
+            frame[:, :, y_index] = lut[frame[:, :, y_index]]
+
+        if self.config.object_speed:
+            size = max(2, int(height * self.config.object_size)) & ~1
+            travel = width - size
+            position = (index * self.config.object_speed) % (2 * travel)
+            x = (position if position < travel else 2 * travel - position) & ~1
+            y = (height - size) // 2
+
+            # Bright, neutral coloured square
+            frame[y:y + size, x:x + size, y_index] = 235
+            frame[y:y + size, x:x + size, 1 - y_index] = 128
+
+        return frame
+
+    def _advance(self):
+        """
+            Moves to the next frame without producing its pixels.
+            Returns False if the source is exhausted.
+        """
+        self._index += 1
+
+        if self._video is not None:
+            if self._video.grab():
+                return True
+            if not self.config.loop:
+                return False
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return self._video.grab()
+
+        frames = self._frames if self._frames is not None else self._images
+        if frames is not None and self._index >= len(frames):
+            if not self.config.loop:
+                return False
+            self._index = 0
+
+        return True
+
+    def _current_frame(self):
+        if self._background is not None:
+            return self._synthetic_frame(self._index)
+
+        if self._video is not None:
+            success, image = self._video.retrieve()
+            return self._to_raw(image) if success else None
+
+        if self._images is not None:
+            return self._image_frame(self._index)
+
+        return self._frames[self._index]
+
+    def _wait_realtime(self):
+        if not self.config.realtime or not self.config.fps:
+            return
+
+        now = time.monotonic()
+        if self._next_time is None or self._next_time < now - 1.:
+            self._next_time = now
+
+        delay = self._next_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+        self._next_time += 1. / self.config.fps
+
+    def _check_opened(self):
+        if self._frames is None and self._images is None and self._video is None and self._background is None:
+            raise RuntimeError(f'Replay source {self.config.source} not opened')
+
+    def get_frame(self):
+        """
+            Returns the next replayed frame.
+            Raises RuntimeError if the source is not opened or exhausted.
+        """
+        self.grab()
+        return self.retrieve()
+
+    def grab(self):
+        """
+            Moves to the next frame (paced by fps if realtime) without
+            producing its pixels.
+        """
+        self._check_opened()
+        self._wait_realtime()
+
+        if not self._advance():
+            raise RuntimeError(f'Replay source {self.config.source} exhausted')
+
+        self.frame = None
+
+    def retrieve(self):
+        """
+            Returns the last grabbed frame.
+        """
+        self._check_opened()
+
+        if self.frame is None:
+            self.frame = self._current_frame()
+
+        if self.frame is None:
+            raise RuntimeError(f'Replay source {self.config.source} retrieve failed')
+
+        return self.frame
@@ -0,0 +1,484 @@
+"""
+    Native V4L2 streaming capture using memory-mapped driver buffers.
+
+    Implements the subset of the cv2.VideoCapture interface used by RawCapture
+    (open, isOpened, release, read, grab, retrieve, get, set, getBackendName)
+    on top of VIDIOC_REQBUFS/QBUF/DQBUF streaming I/O, so the number of driver
+    buffers is under our control and dequeued frames are returned as zero-copy
+    NumPy views of the mmap'd buffers.
+
+    A dequeued buffer stays owned by userspace until the next grab()/read(),
+    so a returned frame is only valid until then. Copy it if you need to keep it.
+"""
+
+import ctypes
+import fcntl
+import mmap
+import os
+import select
+
+import cv2
+import numpy
+
+
+# Manually converted from C headers (linux/videodev2.h)
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _ioc(direction, number, size):
+    return (direction << 30) | (size << 16) | (ord('V') << 8) | number
+
+
+class _v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ('width', ctypes.c_uint32),
+        ('height', ctypes.c_uint32),
+        ('pixelformat', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('bytesperline', ctypes.c_uint32),
+        ('sizeimage', ctypes.c_uint32),
+        ('colorspace', ctypes.c_uint32),
+        ('priv', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('ycbcr_enc', ctypes.c_uint32),
+        ('quantization', ctypes.c_uint32),
+        ('xfer_func', ctypes.c_uint32),
+    ]
+
+
+class _v4l2_format_union(ctypes.Union):
+    _fields_ = [
+        ('pix', _v4l2_pix_format),
+        ('raw_data', ctypes.c_uint8 * 200),
+        # Forces pointer alignment of the union, as in the kernel struct
+        ('_align', ctypes.c_void_p),
+    ]
+
+
+class _v4l2_format(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('fmt', _v4l2_format_union),
+    ]
+
+
+class _v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ('count', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('capabilities', ctypes.c_uint32),
+        ('flags', ctypes.c_uint8),
+        ('reserved', ctypes.c_uint8 * 3),
+    ]
+
+
+class _timeval(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_long),
+        ('tv_usec', ctypes.c_long),
+    ]
+
+
+class _v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('frames', ctypes.c_uint8),
+        ('seconds', ctypes.c_uint8),
+        ('minutes', ctypes.c_uint8),
+        ('hours', ctypes.c_uint8),
+        ('userbits', ctypes.c_uint8 * 4),
+    ]
+
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [
+        ('offset', ctypes.c_uint32),
+        ('userptr', ctypes.c_ulong),
+        ('planes', ctypes.c_void_p),
+        ('fd', ctypes.c_int32),
+    ]
+
+
+class _v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ('index', ctypes.c_uint32),
+        ('type', ctypes.c_uint32),
+        ('bytesused', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('field', ctypes.c_uint32),
+        ('timestamp', _timeval),
+        ('timecode', _v4l2_timecode),
+        ('sequence', ctypes.c_uint32),
+        ('memory', ctypes.c_uint32),
+        ('m', _v4l2_buffer_m),
+        ('length', ctypes.c_uint32),
+        ('reserved2', ctypes.c_uint32),
+        ('request_fd', ctypes.c_int32),
+    ]
+
+
+class _v4l2_control(ctypes.Structure):
+    _fields_ = [
+        ('id', ctypes.c_uint32),
+        ('value', ctypes.c_int32),
+    ]
+
+
+class _v4l2_fract(ctypes.Structure):
+    _fields_ = [
+        ('numerator', ctypes.c_uint32),
+        ('denominator', ctypes.c_uint32),
+    ]
+
+
+class _v4l2_captureparm(ctypes.Structure):
+    _fields_ = [
+        ('capability', ctypes.c_uint32),
+        ('capturemode', ctypes.c_uint32),
+        ('timeperframe', _v4l2_fract),
+        ('extendedmode', ctypes.c_uint32),
+        ('readbuffers', ctypes.c_uint32),
+        ('reserved', ctypes.c_uint32 * 4),
+    ]
+
+
+class _v4l2_streamparm_union(ctypes.Union):
+    _fields_ = [
+        ('capture', _v4l2_captureparm),
+        ('raw_data', ctypes.c_uint8 * 200),
+    ]
+
+
+class _v4l2_streamparm(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('parm', _v4l2_streamparm_union),
+    ]
+
+
+VIDIOC_G_FMT = _ioc(_IOC_READ | _IOC_WRITE, 4, ctypes.sizeof(_v4l2_format))
+VIDIOC_S_FMT = _ioc(_IOC_READ | _IOC_WRITE, 5, ctypes.sizeof(_v4l2_format))
+VIDIOC_REQBUFS = _ioc(_IOC_READ | _IOC_WRITE, 8, ctypes.sizeof(_v4l2_requestbuffers))
+VIDIOC_QUERYBUF = _ioc(_IOC_READ | _IOC_WRITE, 9, ctypes.sizeof(_v4l2_buffer))
+VIDIOC_QBUF = _ioc(_IOC_READ | _IOC_WRITE, 15, ctypes.sizeof(_v4l2_buffer))
+VIDIOC_DQBUF = _ioc(_IOC_READ | _IOC_WRITE, 17, ctypes.sizeof(_v4l2_buffer))
+VIDIOC_STREAMON = _ioc(_IOC_WRITE, 18, ctypes.sizeof(ctypes.c_int))
+VIDIOC_STREAMOFF = _ioc(_IOC_WRITE, 19, ctypes.sizeof(ctypes.c_int))
+VIDIOC_G_PARM = _ioc(_IOC_READ | _IOC_WRITE, 21, ctypes.sizeof(_v4l2_streamparm))
+VIDIOC_S_PARM = _ioc(_IOC_READ | _IOC_WRITE, 22, ctypes.sizeof(_v4l2_streamparm))
+VIDIOC_G_CTRL = _ioc(_IOC_READ | _IOC_WRITE, 27, ctypes.sizeof(_v4l2_control))
+VIDIOC_S_CTRL = _ioc(_IOC_READ | _IOC_WRITE, 28, ctypes.sizeof(_v4l2_control))
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_ANY = 0
+
+V4L2_CID_CAMERA_CLASS_BASE = 0x009a0900
+V4L2_CID_FOCUS_ABSOLUTE = V4L2_CID_CAMERA_CLASS_BASE + 10
+V4L2_CID_FOCUS_AUTO = V4L2_CID_CAMERA_CLASS_BASE + 12
+
+
+class V4L2Capture:
+    """
+        Minimal cv2.VideoCapture look-alike backed by V4L2 mmap streaming.
+    """
+
+    BACKEND_NAME = 'V4L2_MMAP'
+    DEFAULT_BUFFER_COUNT = 4
+
+    def __init__(self, buffer_count: int = None, timeout: float = 2.0):
+        """
+        :param buffer_count: Number of driver buffers requested with VIDIOC_REQBUFS.
+        :param timeout: Seconds to wait for a frame before grab() fails.
+        """
+        self.buffer_count = buffer_count or V4L2Capture.DEFAULT_BUFFER_COUNT
+        self.timeout = timeout
+
+        self.fd = None
+        self._own_fd = False
+
+        self._buffers = []      # [mmap.mmap]
+        self._streaming = False
+        self._format = None     # _v4l2_pix_format of the negotiated format
+        self._held = None       # _v4l2_buffer dequeued by the last grab()
+
+    # Opening / closing
+    def open(self, filename=None, fd: int = None) -> bool:
+        """
+            Opens the device node 'filename', or wraps an already open file
+            descriptor 'fd' (which is not closed on release()).
+        """
+        self.release()
+
+        try:
+            if fd is None:
+                self.fd = os.open(filename, os.O_RDWR | os.O_NONBLOCK)
+                self._own_fd = True
+            else:
+                self.fd = fd
+                self._own_fd = False
+
+            self._format = self._get_format()
+
+        except OSError:
+            self.release()
+            return False
+
+        return True
+
+    def isOpened(self) -> bool:
+        return self.fd is not None
+
+    def release(self):
+        if self.fd is None:
+            return
+
+        try:
+            self._stop_streaming()
+        except OSError:
+            pass
+
+        if self._own_fd:
+            os.close(self.fd)
+
+        self.fd = None
+        self._own_fd = False
+        self._format = None
+
+    def getBackendName(self) -> str:
+        return V4L2Capture.BACKEND_NAME
+
+    # Frame reading
+    def grab(self) -> bool:
+        """
+            Returns the previously held buffer to the driver and dequeues the
+            next filled one.
+        """
+        if self.fd is None:
+            return False
+
+        try:
+            if not self._streaming:
+                self._start_streaming()
+
+            if self._held is not None:
+                self._queue(self._held.index)
+                self._held = None
+
+            readable, _, _ = select.select([self.fd], [], [], self.timeout)
+            if not readable:
+                return False
+
+            buffer = _v4l2_buffer()
+            buffer.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+            buffer.memory = V4L2_MEMORY_MMAP
+            fcntl.ioctl(self.fd, VIDIOC_DQBUF, buffer)
+
+        except OSError:
+            return False
+
+        self._held = buffer
+        return True
+
+    def retrieve(self, image=None):
+        """
+            Returns (success, frame) where frame is a zero-copy (height, width, 2)
+            view of the buffer dequeued by the last grab(). 'image' is ignored.
+        """
+        if self._held is None:
+            return False, None
+
+        pix = self._format
+        view = numpy.ndarray(
+            shape=(pix.height, pix.width, 2),
+            dtype=numpy.uint8,
+            # frombuffer() holds a buffer export so the mapping can't be
+            # closed under the view; ndarray(buffer=mmap) alone does not
+            buffer=numpy.frombuffer(self._buffers[self._held.index], dtype=numpy.uint8),
+            strides=(pix.bytesperline, 2, 1),
+        )
+
+        return True, view
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+
+        return self.retrieve(image)
+
+    # Properties
+    def get(self, prop_id):
+        if self.fd is None:
+            return 0.
+
+        try:
+            if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+                return float(self._format.width)
+            if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+                return float(self._format.height)
+            if prop_id == cv2.CAP_PROP_FOURCC:
+                return float(self._format.pixelformat)
+            if prop_id == cv2.CAP_PROP_FPS:
+                timeperframe = self._get_parm().parm.capture.timeperframe
+                return timeperframe.denominator / timeperframe.numerator if timeperframe.numerator else 0.
+            if prop_id == cv2.CAP_PROP_BUFFERSIZE:
+                return float(self.buffer_count)
+            if prop_id == cv2.CAP_PROP_CONVERT_RGB:
+                return 0.
+            if prop_id == cv2.CAP_PROP_AUTOFOCUS:
+                return float(self._get_control(V4L2_CID_FOCUS_AUTO))
+            if prop_id == cv2.CAP_PROP_FOCUS:
+                return float(self._get_control(V4L2_CID_FOCUS_ABSOLUTE))
+        except OSError:
+            pass
+
+        return 0.
+
+    def set(self, prop_id, value) -> bool:
+        if self.fd is None:
+            return False
+
+        try:
+            if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+                return self._set_format(width=int(value))
+            if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+                return self._set_format(height=int(value))
+            if prop_id == cv2.CAP_PROP_FOURCC:
+                return self._set_format(pixelformat=int(value))
+            if prop_id == cv2.CAP_PROP_FPS:
+                return self._set_fps(value)
+            if prop_id == cv2.CAP_PROP_BUFFERSIZE:
+                self._stop_streaming()
+                self.buffer_count = int(value)
+                return True
+            if prop_id == cv2.CAP_PROP_CONVERT_RGB:
+                # Frames are always returned raw
+                return not value
+            if prop_id == cv2.CAP_PROP_AUTOFOCUS:
+                self._set_control(V4L2_CID_FOCUS_AUTO, int(bool(value)))
+                return True
+            if prop_id == cv2.CAP_PROP_FOCUS:
+                self._set_control(V4L2_CID_FOCUS_ABSOLUTE, int(value))
+                return True
+        except OSError:
+            pass
+
+        return False
+
+    # Internals
+    def _get_format(self) -> _v4l2_pix_format:
+        fmt = _v4l2_format()
+        fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fcntl.ioctl(self.fd, VIDIOC_G_FMT, fmt)
+        return fmt.fmt.pix
+
+    def _set_format(self, **kwargs) -> bool:
+        """
+            Changes format fields; buffers are reallocated on the next grab().
+            Returns False if the driver adjusted any of the requested values.
+        """
+        self._stop_streaming()
+
+        fmt = _v4l2_format()
+        fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fmt.fmt.pix = self._format
+        fmt.fmt.pix.field = V4L2_FIELD_ANY
+        fmt.fmt.pix.bytesperline = 0
+        fmt.fmt.pix.sizeimage = 0
+        for key, value in kwargs.items():
+            setattr(fmt.fmt.pix, key, value)
+
+        fcntl.ioctl(self.fd, VIDIOC_S_FMT, fmt)
+        self._format = self._get_format()
+
+        return all(getattr(self._format, key) == value for key, value in kwargs.items())
+
+    def _get_parm(self) -> _v4l2_streamparm:
+        parm = _v4l2_streamparm()
+        parm.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        fcntl.ioctl(self.fd, VIDIOC_G_PARM, parm)
+        return parm
+
+    def _set_fps(self, fps) -> bool:
+        parm = self._get_parm()
+        parm.parm.capture.timeperframe.numerator = 1000
+        parm.parm.capture.timeperframe.denominator = int(fps * 1000)
+        fcntl.ioctl(self.fd, VIDIOC_S_PARM, parm)
+        return True
+
+    def _get_control(self, control_id) -> int:
+        control = _v4l2_control(id=control_id)
+        fcntl.ioctl(self.fd, VIDIOC_G_CTRL, control)
+        return control.value
+
+    def _set_control(self, control_id, value):
+        control = _v4l2_control(id=control_id, value=value)
+        fcntl.ioctl(self.fd, VIDIOC_S_CTRL, control)
+
+    def _request_buffers(self, count) -> int:
+        request = _v4l2_requestbuffers()
+        request.count = count
+        request.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        request.memory = V4L2_MEMORY_MMAP
+        fcntl.ioctl(self.fd, VIDIOC_REQBUFS, request)
+        return request.count
+
+    def _queue(self, index):
+        buffer = _v4l2_buffer()
+        buffer.index = index
+        buffer.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buffer.memory = V4L2_MEMORY_MMAP
+        fcntl.ioctl(self.fd, VIDIOC_QBUF, buffer)
+
+    def _start_streaming(self):
+        count = self._request_buffers(self.buffer_count)
+
+        for index in range(count):
+            buffer = _v4l2_buffer()
+            buffer.index = index
+            buffer.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
+            buffer.memory = V4L2_MEMORY_MMAP
+            fcntl.ioctl(self.fd, VIDIOC_QUERYBUF, buffer)
+
+            self._buffers.append(mmap.mmap(
+                self.fd,
+                buffer.length,
+                flags=mmap.MAP_SHARED,
+                prot=mmap.PROT_READ | mmap.PROT_WRITE,
+                offset=buffer.m.offset,
+            ))
+
+            self._queue(index)
+
+        fcntl.ioctl(self.fd, VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        self._streaming = True
+
+    def _stop_streaming(self):
+        if self._streaming:
+            fcntl.ioctl(self.fd, VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            self._streaming = False
+
+        self._held = None
+
+        if not self._buffers:
+            return
+
+        for buffer in self._buffers:
+            try:
+                buffer.close()
+            except BufferError:
+                # A frame view is still alive somewhere - the mapping is
+                # released together with the last reference to it.
+                pass
+        self._buffers.clear()
+
+        try:
+            self._request_buffers(0)
+        except OSError:
+            # EBUSY if a mapping outlived close() above and the driver can't
+            # orphan buffers (V4L2_BUF_CAP_SUPPORTS_ORPHANED_BUFS): they are
+            # freed by the next VIDIOC_REQBUFS or when the device is closed
+            pass
@@ -0,0 +1,99 @@
+"""
+    Streaming top-k frame selection by sharpness.
+
+    While a window (e.g. a contiguous run of GOOD states) lasts, frames are
+    offered with their sharpness score; only the k best are kept, and their
+    frames are only fetched when they make it into the top k. When the window
+    ends, the best frames are returned, sharpest first.
+
+    Scores are computed on a downsampled luma image (of the roi), which is
+    all that the Laplacian variance needs to rank near-identical frames.
+"""
+
+import heapq
+import itertools
+from typing import Callable, List
+
+import cv2
+
+from pxl_camera.util import image_processing
+from pxl_camera.util.frame import Frame
+
+
+class BestFrameSelector:
+
+    def __init__(self, k: int = 1, scale: float = 0.25):
+        """
+        :param k: Number of frames selected per window.
+        :param scale: Scale of the luma image the sharpness is computed on.
+        """
+        self.k = k
+        self.scale = scale
+
+        self.windows = 0
+        self.offered = 0
+        self.selected = 0
+
+        self._heap = []     # (score, tie breaker, Frame), worst on top
+        self._counter = itertools.count()
+        self._active = False
+
+    def is_active(self) -> bool:
+        return self._active
+
+    def score(self, luma, size: tuple = None) -> float:
+        """
+            Returns the sharpness of a single channel image, computed at
+            'scale'. 'size' is its known (width, height, channels).
+        """
+        if self.scale != 1.0:
+            width, height, _ = image_processing.scaled_size(size or image_processing.image_size(luma), self.scale)
+            luma = cv2.resize(luma, (width, height), interpolation=cv2.INTER_AREA)
+
+        return image_processing.sharpness(luma)
+
+    def offer(self, score: float, get_frame: Callable[[], Frame]) -> bool:
+        """
+            Offers a frame of the current window. get_frame() is called only
+            if the frame makes it into the top k. Returns True if it did.
+        """
+        self._active = True
+        self.offered += 1
+
+        if len(self._heap) >= self.k and score <= self._heap[0][0]:
+            return False
+
+        frame = get_frame()
+        if frame is None:
+            return False
+
+        entry = score, next(self._counter), frame
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heapreplace(self._heap, entry)
+
+        return True
+
+    def end_window(self) -> List[Frame]:
+        """
+            Ends the current window and returns its best frames, sharpest
+            first.
+        """
+        best = [frame for _, _, frame in sorted(self._heap, reverse=True)]
+
+        if self._active:
+            self.windows += 1
+            self.selected += len(best)
+
+        self._heap = []
+        self._active = False
+
+        return best
+
+    def get_stats(self) -> dict:
+        return {
+            'windows': self.windows,
+            'offered': self.offered,
+            'selected': self.selected,
+        }
@@ -0,0 +1,261 @@
+"""
+    Detector chains: configurable comparisons of two images.
+
+    A chain is a list of stages, evaluated in order on a Comparison of two
+    images until one of them decides. A stage returns True (the images are
+    equal), False (they differ) or None (undecided, ask the next stage).
+    If no stage decides, the chain's default applies.
+
+    Order stages cheapest first, so that most frames are decided early:
+
+      - AbsDiff:        share of pixels that differ by more than a pixel
+                        threshold; decides "different" above a threshold
+      - GridDiff:       means of the absolute diff over a grid of cells;
+                        catches small, local changes the global share misses
+      - SharpnessGate:  decides "different" if the first image is blurry
+                        (e.g. motion blur while the scene still looks equal)
+      - any callable taking a Comparison and returning True/False/None
+
+    Intermediates (the absolute diff, its integral image or grid means) are
+    computed once per comparison and shared by all stages. DetectorChain.get_stats()
+    reports time and decisions per stage.
+
+    The default chain (AbsDiff, then GridDiff) is the processor's original
+    two round comparison.
+
+    Chains of AbsDiff and GridDiff stages only can also be evaluated on a
+    max-pooled absolute diff (Comparison.pooled()), whose factors and grid
+    means bound the real ones from above: if the chain decides "equal" on
+    those, it would on the real diff too (DetectorChain.bound_equal()).
+"""
+
+import dataclasses
+import time
+from typing import Callable, List, Union
+
+import cv2
+import numpy
+
+from pxl_camera.util import image_processing
+from pxl_camera.util.region_stats import RegionStats
+
+
+class Comparison:
+    """
+        Two same sized images being compared, with lazily computed
+        intermediates shared by the stages of a chain.
+    """
+
+    def __init__(self, image_a, image_b, size: tuple, abs_diff: Callable[[int], tuple], pool: int = 1):
+        """
+        :param size: Known (width, height, channels) of the images.
+        :param abs_diff: abs_diff(pixel_threshold) returns (absolute diff,
+                         share of pixels above pixel_threshold * 255).
+        :param pool: Block size the absolute diff is max-pooled by, see pooled().
+        """
+        self.image_a = image_a
+        self.image_b = image_b
+        self.size = size
+        self.pool = pool
+
+        self._abs_diff = abs_diff
+        self._diffs = {}
+        self._region_stats = {}
+        self._grids = {}
+
+    @staticmethod
+    def pooled(diff, pool: int, size: tuple, pooled_size: tuple) -> 'Comparison':
+        """
+            Returns a comparison of two images of 'size' by their absolute
+            diff max-pooled over pool x pool blocks (image_processing.max_pool()).
+            Its diff factors and grid means are upper bounds of the real
+            ones; the images themselves aren't available.
+        """
+        width, height, channels = size
+
+        def abs_diff(pixel_threshold: int) -> tuple:
+            count, _ = image_processing.count_above(diff, pixel_threshold, pooled_size)
+            return diff, min(255., 255. * count * pool ** 2 / (width * height * channels))
+
+        return Comparison(None, None, size, abs_diff, pool)
+
+    def get_abs_diff(self, pixel_threshold: int = 100) -> tuple:
+        """
+            Returns (absolute diff image, diff factor), where the diff factor
+            is 255 * the share of pixels differing by more than pixel_threshold.
+        """
+        if pixel_threshold not in self._diffs:
+            self._diffs[pixel_threshold] = self._abs_diff(pixel_threshold)
+        return self._diffs[pixel_threshold]
+
+    def get_factor(self) -> Union[None, float]:
+        """
+            Returns the diff factor of the first absolute diff computed,
+            None if no stage needed one.
+        """
+        return next(iter(self._diffs.values()))[1] if self._diffs else None
+
+    def get_region_stats(self, pixel_threshold: int = 100) -> RegionStats:
+        """
+            Returns RegionStats of the absolute diff.
+        """
+        if pixel_threshold not in self._region_stats:
+            self._region_stats[pixel_threshold] = RegionStats(self.get_abs_diff(pixel_threshold)[0])
+        return self._region_stats[pixel_threshold]
+
+    def get_grid_means(self, rows: int, cols: int, pixel_threshold: int = 100):
+        """
+            Returns the rows x cols cell means of the absolute diff: from its
+            RegionStats on the host, reduced on the device for UMat diffs
+            (only the means are downloaded).
+        """
+        key = rows, cols, pixel_threshold
+        if key not in self._grids:
+            abs_diff, _ = self.get_abs_diff(pixel_threshold)
+            if self.pool > 1:
+                self._grids[key] = self.get_region_stats(pixel_threshold).pooled_grid_means(
+                    rows, cols, self.size[0], self.size[1], self.pool,
+                )
+            elif isinstance(abs_diff, numpy.ndarray):
+                self._grids[key] = self.get_region_stats(pixel_threshold).grid_means(rows, cols)
+            else:
+                self._grids[key] = image_processing.grid_means(abs_diff, rows, cols, self.size)
+        return self._grids[key]
+
+
+@dataclasses.dataclass
+class AbsDiff:
+    pixel_threshold: int = 100  # Pixel difference that counts as changed
+    threshold: float = 0.5      # Diff factor above which the images differ
+    name: str = 'abs_diff'
+
+    def __call__(self, comparison: Comparison) -> Union[None, bool]:
+        _, factor = comparison.get_abs_diff(self.pixel_threshold)
+        return False if factor >= self.threshold else None
+
+
+@dataclasses.dataclass
+class GridDiff:
+    rows: int = 10
+    cols: int = 5
+    cell_threshold: float = 10.     # Mean absolute diff of a changed cell
+    grid_threshold: int = 1         # Number of changed cells of different images
+    pixel_threshold: int = 100      # Shares the diff of AbsDiff of the same threshold
+    name: str = 'grid_diff'
+
+    def __call__(self, comparison: Comparison) -> Union[None, bool]:
+        grid = comparison.get_grid_means(self.rows, self.cols, self.pixel_threshold)
+        return image_processing.grid_diff_factor(grid, self.cell_threshold) < self.grid_threshold
+
+
+@dataclasses.dataclass
+class SharpnessGate:
+    min_sharpness: float = 50.  # Laplacian variance below which the first image is blurry
+    scale: float = 0.25         # Scale the sharpness is computed at
+    name: str = 'sharpness_gate'
+
+    def __call__(self, comparison: Comparison) -> Union[None, bool]:
+        image = comparison.image_a
+        size = comparison.size or image_processing.image_size(image)
+
+        if self.scale != 1.0:
+            width, height, _ = image_processing.scaled_size(size, self.scale)
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        if size[2] != 1:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        return False if image_processing.sharpness(image) < self.min_sharpness else None
+
+
+DEFAULT_STAGES = (AbsDiff(), GridDiff())
+
+# Stages whose results on upper bounds of the diff bound their results on the diff
+BOUND_STAGES = (AbsDiff, GridDiff)
+
+
+class DetectorChain:
+
+    def __init__(self, stages: list = DEFAULT_STAGES, default: bool = True):
+        """
+        :param stages: Stages (see above), cheapest first.
+        :param default: Result if no stage decides.
+        """
+        self.stages = list(stages)
+        self.default = default
+
+        self.undecided = 0
+        self._stats = [{'evaluations': 0, 'equal': 0, 'different': 0, 'time': 0.} for _ in self.stages]
+
+    @staticmethod
+    def stage_name(stage) -> str:
+        return getattr(stage, 'name', None) or getattr(stage, '__name__', type(stage).__name__)
+
+    def find(self, stage_type: type):
+        """
+            Returns the first stage of the given type, or None.
+        """
+        return next((stage for stage in self.stages if isinstance(stage, stage_type)), None)
+
+    def can_bound(self) -> bool:
+        return all(isinstance(stage, BOUND_STAGES) for stage in self.stages)
+
+    def bound_equal(self, comparison: Comparison) -> bool:
+        """
+            Returns True if the chain is sure to consider the images equal,
+            given a comparison that bounds theirs from above (see
+            Comparison.pooled()). False means it may or may not.
+            Not counted in get_stats().
+        """
+        if not self.can_bound():
+            return False
+
+        for stage in self.stages:
+            # AbsDiff only decides "different", GridDiff counts changed cells:
+            # "equal" or "undecided" on the bounds holds for the real diff
+            result = stage(comparison)
+            if result is not None:
+                return result
+
+        return self.default
+
+    def evaluate(self, comparison: Comparison) -> bool:
+        """
+            Returns True if the compared images are to be considered equal.
+        """
+        for stage, stats in zip(self.stages, self._stats):
+            start = time.perf_counter()
+            result = stage(comparison)
+
+            stats['evaluations'] += 1
+            stats['time'] += time.perf_counter() - start
+
+            if result is not None:
+                stats['equal' if result else 'different'] += 1
+                return result
+
+        self.undecided += 1
+        return self.default
+
+    def get_stats(self) -> List[dict]:
+        """
+            Returns per stage statistics, in chain order:
+              - name:         stage name
+              - evaluations:  number of times the stage was evaluated
+              - equal:        number of times it decided "equal"
+              - different:    number of times it decided "different"
+              - pass_rate:    share of evaluations passed to the next stage
+              - avg_time:     average evaluation time in seconds
+        """
+        return [
+            {
+                'name': self.stage_name(stage),
+                'evaluations': stats['evaluations'],
+                'equal': stats['equal'],
+                'different': stats['different'],
+                'pass_rate': 1. - (stats['equal'] + stats['different']) / stats['evaluations']
+                if stats['evaluations'] else 0.,
+                'avg_time': stats['time'] / stats['evaluations'] if stats['evaluations'] else 0.,
+            }
+            for stage, stats in zip(self.stages, self._stats)
+        ]
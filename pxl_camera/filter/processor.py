@@ -1,14 +1,44 @@
 """
     Class for preprocessing frames and calculating whether or not the frames
     are good for further processing by models and stuff.
+
+    In luma mode (default) frames are compared on the Y plane taken straight
+    from the raw capture buffer (FrameMuxer.get_gray_frame()), which skips
+    both the YUV->BGR and the BGR->GRAY conversion.
+
+    With a stream set (see FrameMuxer.add_stream()), frames of that stream
+    are processed instead, e.g. a downscaled grayscale analysis stream.
+
+    Frames are compared by detector chains (set_detectors()): by default a
+    fast abs-diff round, then a grid diff round. See get_detector_stats().
+
+    In pyramid mode (set_pyramid()) frames are compared on heavily
+    downsampled levels first: clearly different frames are decided there,
+    all others escalate to higher resolutions. See get_pyramid_stats().
+
+    The worker is always handed the newest captured frame; frames captured
+    while it was busy are skipped. With a target rate (set_target_rate())
+    the next frame is handed over no sooner than 1 / rate seconds after the
+    previous one, instead of analysing an unchanged scene as fast as the
+    worker can. See get_schedule_stats().
 """
+import dataclasses
+import datetime
 import enum
+import functools
+import threading
+import time
 
 import cv2
+import numpy
 from pxl_actor.actor import Actor
 
+from pxl_camera.filter.best_frame import BestFrameSelector
+from pxl_camera.filter.detector import AbsDiff, Comparison, DetectorChain
+from pxl_camera.filter.worker_pool import WorkerPool
 from pxl_camera.util.frame import Frame
-from pxl_camera.util import image_processing
+from pxl_camera.util import frame_pool, image_processing
+from pxl_camera.util.events import Subscribers
 
 
 class Processor(Actor):
@@ -23,79 +53,380 @@ class Processor(Actor):
         NO_MOVE = enum.auto()   # Move frame not available; frame is not base
         NONE = enum.auto()      # No information available
 
-    class _Worker(Actor):
+    @dataclasses.dataclass(frozen=True)
+    class Event:
+        """
+            State change, see subscribe()
+        """
+        state: 'Processor.State'
+        previous: 'Processor.State'
+        seq: int                        # Sequence number of the decided frame
+        timestamp: datetime.datetime    # Capture time of the decided frame
+        factors: dict                   # Diff factors of the 'move' and 'base' checks made
+        name: str = None                # Processor name (e.g. camera serial)
+
+    class _Analyzer:
         """
-            Worker for detecting movement and base image
+            Detects movement and base image. Not an actor: it runs on the
+            processor's own worker actor, or on a shared WorkerPool. The
+            lock serializes analyses and setting changes.
         """
 
         # TODO: Take timestamps into account?
 
-        def __init__(self):
-            super(Processor._Worker, self).__init__()
+        def __init__(self, logger):
+            self.logger = logger
+            self._lock = threading.Lock()
 
             self.diff_frame = None
+            self.diff_size = None   # (width, height, channels) of diff_frame, if known
+
+            # Comparisons of the movement and base checks, see set_detectors()
+            self.move_chain = DetectorChain()
+            self.base_chain = DetectorChain()
+            self._factor = None     # Diff factor of the last equal(), if one was computed
+
+            # Thresholded diff images are only produced if someone wants them
+            self.keep_diff = True
+
+            # Preallocated, reused intermediate images (by name)
+            self._buffers = {}
+
+            # Coarse-to-fine mode, see set_pyramid()
+            self.pyramid = None
+            self.pyramid_margin = None
+            self.pyramid_stats = {}
+
+        def set_keep_diff(self, keep_diff: bool):
+            with self._lock:
+                self.keep_diff = keep_diff
+                if not keep_diff:
+                    self.diff_frame = None
+
+        def _buffer(self, name: str, like, shape: tuple = None):
+            """
+                Returns a reusable numpy buffer for 'like' (or of 'shape'),
+                or None for UMat images (let OpenCV allocate those).
+            """
+            if not isinstance(like, numpy.ndarray):
+                return None
+
+            shape = shape or like.shape
+            buffer = self._buffers.get(name, None)
+
+            if buffer is None or buffer.shape != shape or buffer.dtype != like.dtype:
+                buffer = self._buffers[name] = numpy.empty(shape, like.dtype)
+
+            return buffer
+
+        def _resize(self, name: str, image, scale: float, size: tuple = None):
+            """
+                Returns (resized image, its size). 'size' is the known size
+                of the image (read from numpy images, downloaded from UMat
+                images if not given).
+            """
+            size = image_processing.scaled_size(size or image_processing.image_size(image), scale)
+            width, height, _ = size
+
+            # Unnamed resizes get a new image (e.g. to be cached on a frame)
+            buffer = None
+            if name is not None and isinstance(image, numpy.ndarray):
+                buffer = self._buffer(name, image, (height, width) + image.shape[2:])
 
-        def equal(self, frame_a: cv2.UMat, frame_b: cv2.UMat, threshold: float = 0.5, roi: tuple = None):
+            return cv2.resize(image, (width, height), buffer, interpolation=cv2.INTER_AREA), size
+
+        def _level(self, name: str, image, scale: float, size: tuple = None, source: tuple = None):
             """
-                Returns True if frame_a and frame_b are to be considered equal.
+                Same as _resize(), but cached on the frame the image was
+                derived from, if 'source' (frame, key) is given: a frame's
+                levels are computed once, whether it is the current, last or
+                base frame.
             """
-            # TODO: Create two workers, one for absdiff and one for grid?
+            if source is None:
+                return self._resize(name, image, scale, size)
+
+            frame, key = source
+            size = size or image_processing.image_size(image)
+            level = frame.get_derived(key + ('level', scale), lambda: self._resize(None, image, scale, size)[0])
 
-            # GRID_ROWS = 10
-            # GRID_COLS = 5
-            # CELL_THRESHOLD = 10.
+            return level, image_processing.scaled_size(size, scale)
+
+        def set_pyramid(self, levels: tuple = None, margin: float = 0.5):
+            """
+                Enables coarse-to-fine comparison on the given increasing
+                scales (e.g. (0.125, 0.25, 1.0)), or disables it if None.
+
+                A coarse level decides "equal" if the chain does on the
+                full resolution diff max-pooled to the level (see
+                DetectorChain.bound_equal()), which bounds the real factors
+                and grid means from above. It decides "different" if the
+                diff factor of the (averaged) level is above threshold *
+                (1 + margin). Otherwise the next (finer) level is evaluated.
+                The full resolution level always decides.
+
+                The averaged levels can't decide "equal": downsampling
+                averages small, local differences away. Max-pooling keeps
+                them, so static scenes still exit on a coarse level; chains
+                with stages other than AbsDiff and GridDiff only exit on
+                "different".
+            """
+            with self._lock:
+                self.pyramid = tuple(sorted(levels)) if levels else None
+                self.pyramid_margin = margin
+                self.pyramid_stats = {
+                    scale: {'evaluations': 0, 'decisions': 0, 'time': 0.}
+                    for scale in self.pyramid or ()
+                }
+
+        def get_pyramid_stats(self):
+            with self._lock:
+                return {scale: dict(stats) for scale, stats in self.pyramid_stats.items()}
+
+        def set_detectors(self, move: list = None, base: list = None):
+            """
+                Sets the stages of the movement and/or base detector chains
+                (see pxl_camera.filter.detector). Resets their statistics.
+            """
+            with self._lock:
+                if move is not None:
+                    self.move_chain = DetectorChain(move)
+                if base is not None:
+                    self.base_chain = DetectorChain(base)
+
+        def get_detector_stats(self):
+            with self._lock:
+                return {'move': self.move_chain.get_stats(), 'base': self.base_chain.get_stats()}
+
+        def equal(self, frame_a: cv2.UMat, frame_b: cv2.UMat, chain: DetectorChain, roi: tuple = None,
+                  size: tuple = None, sources: tuple = (None, None)):
+            """
+                Returns True if frame_a and frame_b are to be considered equal
+                by the detector chain. 'size' is the known (width, height,
+                channels) of the images; with it UMat images are never
+                downloaded just to be measured. 'sources' are the (frame, key)
+                pairs the images were derived from (see _source()), to cache
+                their pyramid levels on.
+
+                Pyramid levels compare with the chain's AbsDiff thresholds;
+                chains without an AbsDiff stage skip the pyramid.
+            """
+            stage = chain.find(AbsDiff)
+            self._factor = None
+
+            if not self.pyramid or stage is None:
+                return self._equal(frame_a, frame_b, chain, roi, size)
+
+            if roi:
+                frame_a = image_processing.crop(frame_a, roi, size=size)
+                frame_b = image_processing.crop(frame_b, roi, size=size)
+                size = image_processing.crop_size(size, roi) if size else None
+                sources = None, None
+
+            source_a, source_b = sources
+
+            high = stage.threshold * (1. + self.pyramid_margin)
+            bound = chain.can_bound()
+            diff = None     # Full resolution diff, max-pooled by the coarse levels
+
+            for scale in self.pyramid:
+                stats = self.pyramid_stats[scale]
+                start = time.perf_counter()
+
+                if scale >= 1.:
+                    result = self._equal(frame_a, frame_b, chain, size=size)
+                else:
+                    result = None
+
+                    # Static scenes exit here, before any level is resized
+                    if bound:
+                        if diff is None:
+                            diff = image_processing.abs_diff(frame_a, frame_b, dst=self._buffer('bound', frame_a))
+                        result = True if self._bound_equal(chain, diff, scale, size) else None
+
+                    if result is None:
+                        level_a, level_size = self._level(f'level_a_{scale}', frame_a, scale, size, source_a)
+                        level_b, _ = self._level(f'level_b_{scale}', frame_b, scale, size, source_b)
+                        _, factor = self._abs_diff(
+                            level_a, level_b, name=f'diff_{scale}', size=level_size,
+                            pixel_threshold=stage.pixel_threshold,
+                        )
+                        result = False if factor > high else None
+                        self._factor = factor
+
+                stats['evaluations'] += 1
+                stats['time'] += time.perf_counter() - start
+
+                if result is not None:
+                    stats['decisions'] += 1
+                    return result
+
+            # Only reached if the pyramid has no full resolution level
+            return self._equal(frame_a, frame_b, chain, size=size)
+
+        def _bound_equal(self, chain: DetectorChain, diff, scale: float, size: tuple = None) -> bool:
+            """
+                Returns True if the chain is sure to decide "equal" on the
+                full resolution diff, judging by its max-pooled level.
+            """
+            pool = max(1, round(1. / scale))
+            size = size or image_processing.image_size(diff)
 
-            # ABS_THRESHOLD = 0.5
-            # GRID_THRESHOLD = 1
+            pooled, pooled_size = image_processing.max_pool(
+                diff, pool, size, dst=self._buffer('bound_dilated', diff),
+            )
+            return chain.bound_equal(Comparison.pooled(pooled, pool, size, pooled_size))
 
-            # First round - fast processing
-            abs_diff = image_processing.abs_diff(image_a=frame_a, image_b=frame_b, roi=roi)
-            abs_diff = cv2.threshold(src=abs_diff, thresh=100, maxval=255, type=cv2.THRESH_BINARY)[1]
-            # cv2.medianBlur(src=abs_diff, ksize=5, dst=abs_diff)
-            self.diff_frame = abs_diff
+        def _abs_diff(self, frame_a, frame_b, roi: tuple = None, name: str = 'diff', size: tuple = None,
+                      pixel_threshold: int = 100):
+            """
+                Returns (abs_diff, abs_diff_factor) and keeps the diff
+                thresholded at pixel_threshold if wanted. 'abs_diff' is a
+                reused buffer, valid until the next call with the same name.
+            """
+            if roi:
+                frame_a = image_processing.crop(frame_a, roi, size=size)
+                frame_b = image_processing.crop(frame_b, roi, size=size)
+                size = image_processing.crop_size(size, roi) if size else None
+
+            count, total, abs_diff = image_processing.diff_count(
+                frame_a, frame_b, thresh=pixel_threshold, dst=self._buffer(name, frame_a), size=size,
+                binary_dst=self._buffer(name + '_binary', frame_a),
+            )
+
+            if self.keep_diff:
+                # Handed over to the processor, so a pooled buffer instead of a reused one
+                dst = None
+                if isinstance(abs_diff, numpy.ndarray):
+                    dst = frame_pool.get_pool().acquire(abs_diff.shape, abs_diff.dtype)
+
+                # The diff frame is optional, so it's skipped if the pool is exhausted
+                self.diff_frame = None
+                if dst is not None or not isinstance(abs_diff, numpy.ndarray):
+                    self.diff_frame = cv2.threshold(
+                        src=abs_diff, thresh=pixel_threshold, maxval=255, type=cv2.THRESH_BINARY, dst=dst,
+                    )[1]
+                self.diff_size = size
+                # cv2.medianBlur(src=self.diff_frame, ksize=5, dst=self.diff_frame)
+
+            return abs_diff, 255. * count / total if total else 0.
+
+        def _equal(self, frame_a, frame_b, chain: DetectorChain, roi: tuple = None, size: tuple = None):
+            """
+                Full resolution comparison by the detector chain.
+            """
+            if roi:
+                frame_a = image_processing.crop(frame_a, roi, size=size)
+                frame_b = image_processing.crop(frame_b, roi, size=size)
+                size = image_processing.crop_size(size, roi) if size else None
 
-            abs_diff_factor = image_processing.abs_diff_factor(abs_diff)
+            comparison = Comparison(
+                frame_a, frame_b, size,
+                lambda pixel_threshold: self._abs_diff(frame_a, frame_b, size=size, pixel_threshold=pixel_threshold),
+            )
 
-            #self.logger.debug(f'Absolute diff: {abs_diff_factor}, Threshold: {threshold}')
+            result = chain.evaluate(comparison)
+            self._factor = comparison.get_factor()
 
-            return abs_diff_factor < threshold
+            return result
 
-            # TODO: Reimplement this?
-            # if abs_diff > ABS_THRESHOLD:
-            #     return False
-            #
-            # Second round - slow processing
-            # grid_diff = image_processing.grid_diff_factor(
-            #     image_a=frame_a, image_b=frame_b,
-            #     rows=GRID_ROWS, cols=GRID_COLS,
-            #     threshold=CELL_THRESHOLD,
-            #     roi=roi,
-            # )
-            #
-            # self.logger.debug(f'Grid diff: {grid_diff}, Threshold: {GRID_THRESHOLD}')
-            #
-            # return grid_diff < GRID_THRESHOLD
+        @staticmethod
+        def _gray(frame: Frame):
+            if frame.channels == 1:
+                return frame.frame
+            return cv2.cvtColor(frame.frame, cv2.COLOR_RGB2GRAY)
 
-        def process_frame(self, frame: Frame, last_frame: Frame, base_frame: Frame, processor, roi: tuple):
+        @staticmethod
+        def _key(frame: Frame, roi: tuple, gray: bool = False) -> tuple:
+            """
+                Returns the Frame.get_derived() key of the image _crop()
+                returns for these arguments.
+            """
+            roi = None if roi is None or frame.roi == roi else roi
+            return 'image', roi, gray and frame.channels != 1
+
+        @staticmethod
+        def _source(frame: Frame, roi: tuple, gray: bool = False) -> tuple:
+            return frame, Processor._Analyzer._key(frame, roi, gray)
+
+        @staticmethod
+        def _crop(frame: Frame, roi: tuple, gray: bool = False):
+            """
+                Returns (image, size): (grayscale) image of the frame cropped
+                to roi, aligned the same way as FrameMuxer crops raw frames,
+                and its size computed from the frame metadata. Both the
+                grayscale and the cropped image are cached on the frame.
+            """
+            _, roi, gray = Processor._Analyzer._key(frame, roi, gray)
+
+            image = frame.frame
+            size = frame.width, frame.height, 1 if gray else frame.channels
+
+            if gray:
+                image = frame.get_derived(('image', None, True), lambda: Processor._Analyzer._gray(frame))
+
+            if roi is None:
+                return image, size
+
+            cropped = frame.get_derived(
+                ('image', roi, gray), lambda: image_processing.crop(image, roi, align=2, size=size),
+            )
+            return cropped, image_processing.crop_size(size, roi, align=2)
+
+        @staticmethod
+        def _fit(image, size: tuple, reference_size: tuple):
+            """
+                Resizes image to the reference size (e.g. full resolution
+                base frame to a downscaled stream frame).
+            """
+            if size[:2] == reference_size[:2]:
+                return image
+
+            return cv2.resize(image, reference_size[:2], interpolation=cv2.INTER_AREA)
+
+        def analyze(self, frame: Frame, last_frame: Frame, base_frame: Frame, roi: tuple):
+            """
+                Returns (state, (diff frame, its size), diff factors) of the
+                frame. Diff factors are those of the 'move' and 'base' checks
+                that were made.
+            """
+            with self._lock:
+                return self._analyze(frame, last_frame, base_frame, roi)
+
+        def _analyze(self, frame: Frame, last_frame: Frame, base_frame: Frame, roi: tuple):
             if frame is None or frame.frame is None:
-                processor.set_state(Processor.State.NONE, _requeue_worker=True)
-                return
+                return Processor.State.NONE, None, {}
 
             move = None
             base = None
+            factors = {}
+
+            # Frames cropped by the muxer already are compared as they are
+            roi = frame.roi if frame.roi is not None else roi
 
-            if last_frame is not None:
+            if last_frame is not None and last_frame.roi in (None, roi):
                 self.logger.debug(f'Searching for movement')
-                move = not self.equal(frame.frame, last_frame.frame, 0.5, roi)
+                image, size = self._crop(frame, roi)
+                last_image, _ = self._crop(last_frame, roi)
+                sources = self._source(frame, roi), self._source(last_frame, roi)
+                move = not self.equal(image, last_image, self.move_chain, size=size, sources=sources)
+                factors['move'] = self._factor
                 self.logger.debug(f'Movement: {move}')
 
             if not move and base_frame is not None:
                 self.logger.debug(f'Searching for base')
                 # TODO: Add closing to equal() for base detection...
-                base = self.equal(
-                    cv2.cvtColor(frame.frame, cv2.COLOR_RGB2GRAY),
-                    cv2.cvtColor(base_frame.frame, cv2.COLOR_RGB2GRAY),
-                    0.5, roi)
+                frame_image, size = self._crop(frame, roi, gray=True)
+                base_image, base_size = self._crop(base_frame, roi, gray=True)
+
+                base_source = self._source(base_frame, roi, gray=True)
+                if base_size[:2] != size[:2]:
+                    # The base frame outlives many frames, so its fitted image is cached too
+                    base_source = base_frame, base_source[1] + ('fit', size[:2])
+                    base_image = base_frame.get_derived(base_source[1], lambda: self._fit(base_image, base_size, size))
+
+                sources = self._source(frame, roi, gray=True), base_source
+                base = self.equal(frame_image, base_image, self.base_chain, size=size, sources=sources)
+                factors['base'] = self._factor
                 self.logger.debug(f'Base: {base}')
 
             # Evaluation
@@ -112,23 +443,80 @@ class Processor(Actor):
             else:
                 state = Processor.State.NONE
 
-            processor.set_diff_frame(self.diff_frame)
-            processor.set_state(state, _requeue_worker=True)
+            return state, (self.diff_frame, self.diff_size), factors
 
-    def __init__(self, muxer_actor: Actor = None):
+    class _Worker(Actor):
+        """
+            Worker actor of a processor without a WorkerPool
+        """
+
+        def process_frame(self, analyzer, frame: Frame, last_frame: Frame, base_frame: Frame, processor, roi: tuple):
+            Processor._process_frame(analyzer, frame, last_frame, base_frame, processor, roi)
+
+    @staticmethod
+    def _process_frame(analyzer: _Analyzer, frame: Frame, last_frame: Frame, base_frame: Frame, processor,
+                       roi: tuple):
+        """
+            Analyzes the frame and reports the result back to the processor
+            (without waiting for it, so a pooled worker is free right away).
+            Always reports back, as the processor hands over the next frame
+            only then.
+        """
+        try:
+            state, diff, factors = analyzer.analyze(frame, last_frame, base_frame, roi)
+        except Exception:
+            analyzer.logger.exception(f'Analysis of frame {frame.seq if frame is not None else None} failed')
+            state, diff, factors = Processor.State.NONE, None, {}
+
+        if diff is not None:
+            processor.set_diff_frame(*diff, no_wait=True)
+        processor.set_state(state, factors, _requeue_worker=True, no_wait=True)
+
+    def __init__(self, muxer_actor: Actor = None, luma: bool = True, stream: str = None,
+                 worker_pool: WorkerPool = None, name: str = None):
+        """
+        :param worker_pool: Analyses run on this shared pool instead of a
+                            worker actor of our own (opt.)
+        :param name: Name of the processor in the pool and its events
+                     (e.g. camera serial).
+        """
         super(Processor, self).__init__()
 
+        self.name = name
+        self.luma = luma
+        self.stream = stream
+
         self.frame = None
         self.base_frame = None
+        self.base_luma = None
         self.last_frame = None
         self.diff_frame = None
         self.roi = None
         self.started = True
 
         self.state = Processor.State.NONE
+        self.factors = {}
+
+        # State change events, see subscribe()
+        self.subscribers = Subscribers()
 
         self._muxer = None
-        self._worker = Processor._Worker()
+        self._subscribed = False
+        self._analyzer = Processor._Analyzer(self.logger)
+        self._worker = None     # Created on demand, only without a pool
+        self._pool = worker_pool
+        self._pool_key = name if name is not None else f'processor-{id(self)}'
+
+        # Scheduling, see set_target_rate()
+        self.target_rate = None
+        self.schedule_stats = self._new_schedule_stats()
+        self._last_ping = None      # time.monotonic() of the last frame handed to the worker
+        self._generation = 0        # Invalidates pending delayed pings on start()/stop()
+        self._timer = None
+
+        # (sink, states, stream, selector), see add_sink()
+        self.sinks = []
+        self._sink_frames = {}      # Sink frames of the processed frame's seq, by stream
 
         if muxer_actor is not None:
             self.start(muxer_actor, no_wait=True)
@@ -148,36 +536,189 @@ class Processor(Actor):
 
     def start(self, muxer_actor: Actor):
         self._muxer = muxer_actor
+        self._muxer.set_roi(self.roi, no_wait=True)
         self.started = True
 
+        self._cancel_schedule()
+        self.schedule_stats = self._new_schedule_stats()
+
+        if self.stream is not None:
+            self._muxer.subscribe(self.stream)
+            self._subscribed = True
+
         self._ping_worker()
 
     def stop(self):
+        # Windows in progress end here
+        self._end_windows()
+        self._cancel_schedule()
+
+        if self._subscribed:
+            self._muxer.unsubscribe(self.stream, no_wait=True)
+            self._subscribed = False
+
         self.frame = None
         self.base_frame = None
+        self.base_luma = None
         self.last_frame = None
         self.started = False
         self._muxer = None
+        self._sink_frames = {}
 
         self.state = Processor.State.NONE
 
     def _ping_worker(self):
-        # Take new frame
+        self._last_ping = time.monotonic()
+
+        # Take the newest frame, skipping the ones captured in the meantime
         self.last_frame = self.frame
-        self.frame = self._muxer.get_frame()
+        after_seq = self.last_frame.seq if self.last_frame is not None else None
+
+        # Sink frames come from the same grabbed frame, in the same call
+        self.frame, self._sink_frames = self._muxer.get_frames(
+            self.stream, gray=self.luma, after_seq=after_seq, timeout=1., roi=True, newest=True,
+            sinks=tuple(dict.fromkeys(stream for _, _, stream, _ in self.sinks)),
+        )
+
+        if self.frame is not None and self.frame.seq is not None and after_seq is not None:
+            self.schedule_stats['skipped'] += self.frame.seq - after_seq - 1
+
+        # Base is compared on luma whenever the frames are single channel
+        luma = self.frame is not None and self.frame.channels == 1
 
         self.logger.debug(f'Sending new frame to worker')
 
         # We ping the worker, then worker pings us through set_state(), then we ping him again there, etc.
-        self._worker.process_frame(
+        task = dict(
+            analyzer=self._analyzer,
             frame=self.frame,
             last_frame=self.last_frame,
-            base_frame=self.base_frame,
+            base_frame=self.base_luma if luma else self.base_frame,
             processor=self,
             roi=self.roi,
-            no_wait=True,
         )
 
+        if self._pool is not None:
+            self._pool.submit(self._pool_key, functools.partial(Processor._process_frame, **task))
+            return
+
+        if self._worker is None:
+            self._worker = Processor._Worker()
+        self._worker.process_frame(**task, no_wait=True)
+
+    def get_worker_pool(self):
+        return self._pool
+
+    def set_worker_pool(self, worker_pool: WorkerPool = None, name: str = None):
+        """
+            Runs the analyses on a shared WorkerPool (None for a worker actor
+            of our own). Takes effect with the next frame.
+        """
+        self._pool = worker_pool
+        if name is not None:
+            self.name = self._pool_key = name
+
+    def _schedule_worker(self):
+        """
+            Pings the worker right away, or after a delay if the target
+            rate doesn't allow the next analysis yet. The delay runs on a
+            timer thread, so the processor keeps serving calls meanwhile.
+        """
+        delay = 0.
+        if self.target_rate and self._last_ping is not None:
+            delay = self._last_ping + 1. / self.target_rate - time.monotonic()
+
+        if delay <= 0.:
+            self._ping_worker()
+            return
+
+        self.schedule_stats['delayed'] += 1
+        self._timer = threading.Timer(
+            delay, self.enqueue, args=('_scheduled_ping',), kwargs={'kwargs': {'generation': self._generation}},
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _scheduled_ping(self, generation: int):
+        if self.started and generation == self._generation:
+            self._timer = None
+            self._ping_worker()
+
+    def _cancel_schedule(self):
+        self._generation += 1
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @staticmethod
+    def _new_schedule_stats():
+        return {
+            'analyzed': 0,
+            'skipped': 0,
+            'delayed': 0,
+            'sink_missed': 0,
+            'age_last': 0.,
+            'age_total': 0.,
+            'age_max': 0.,
+            'started': time.monotonic(),
+        }
+
+    def _record_decision(self):
+        """
+            Records the age of the decided frame: time from its capture
+            to the worker's decision.
+        """
+        if self.frame is None or self.frame.timestamp is None:
+            return
+
+        age = (datetime.datetime.now() - self.frame.timestamp).total_seconds()
+
+        stats = self.schedule_stats
+        stats['analyzed'] += 1
+        stats['age_last'] = age
+        stats['age_total'] += age
+        stats['age_max'] = max(stats['age_max'], age)
+
+    def get_target_rate(self):
+        return self.target_rate
+
+    def set_target_rate(self, rate: float = None):
+        """
+            Sets the maximum number of analysed frames per second (None for
+            as fast as the worker goes).
+        """
+        self.target_rate = rate
+
+    def get_schedule_stats(self):
+        """
+            Returns statistics of the frame scheduling since start():
+              - analyzed:  number of frames the worker decided on
+              - skipped:   number of captured frames never analysed,
+                           because a newer one was available
+              - delayed:   number of analyses postponed by the target rate
+              - sink_missed: number of frames not passed to sinks, because
+                           their view of the analysed frame couldn't be
+                           converted (e.g. the frame pool was exhausted)
+              - rate:      analysed frames per second
+              - age_last:  age in seconds of the last decided frame
+                           (capture to decision)
+              - age_avg:   average age in seconds of decided frames
+              - age_max:   maximum age in seconds of decided frames
+        """
+        stats = self.schedule_stats
+        elapsed = time.monotonic() - stats['started']
+
+        return {
+            'analyzed': stats['analyzed'],
+            'skipped': stats['skipped'],
+            'delayed': stats['delayed'],
+            'sink_missed': stats['sink_missed'],
+            'rate': stats['analyzed'] / elapsed if elapsed else 0.,
+            'age_last': stats['age_last'],
+            'age_avg': stats['age_total'] / stats['analyzed'] if stats['analyzed'] else 0.,
+            'age_max': stats['age_max'],
+        }
+
     # Note: 'roi' is a tuple of normalized coordinates (x1, y1, x2, y2)
     #       (i.e. x1, y1, x2, y2 are all real numbers between 0.0 and 1.0)
     def get_roi(self):
@@ -186,23 +727,116 @@ class Processor(Actor):
     def set_roi(self, roi: tuple):
         self.roi = roi
 
+        # Muxer converts only the roi region of the frames we request
+        if self._muxer is not None:
+            self._muxer.set_roi(roi, no_wait=True)
+
     def get_base_frame(self):
         return self.base_frame
 
     def set_base_frame(self, base_frame: Frame):
+        # Frames are immutable, so the pixels are shared rather than copied
         self.base_frame = base_frame.copy() if base_frame is not None else None
+        self.base_luma = self._to_luma(self.base_frame)
+
+    @staticmethod
+    def _to_luma(frame: Frame):
+        """
+            Converts frame to the luma representation used in luma mode.
+            Done once per base frame instead of once per processed frame.
+        """
+        if frame is None or frame.channels == 1:
+            return frame
+
+        return Frame(
+            width=frame.width,
+            height=frame.height,
+            channels=1,
+            frame=image_processing.bgr_to_luma(frame.frame),
+            timestamp=frame.timestamp,
+            state=frame.state,
+            seq=frame.seq,
+        )
+
+    def get_stream(self):
+        return self.stream
+
+    def set_stream(self, stream: str):
+        """
+            Sets the name of the muxer stream to process (None for the
+            default full resolution frames). Takes effect on next start().
+        """
+        self.stream = stream
+
+    def set_keep_diff(self, keep_diff: bool):
+        """
+            Disabling diff frames (get_diff_frame()) saves a full size
+            threshold pass and allocation per comparison.
+        """
+        self._analyzer.set_keep_diff(keep_diff)
+
+    def set_pyramid(self, levels: tuple = (0.125, 0.25, 1.0), margin: float = 0.5):
+        """
+            Enables coarse-to-fine comparison (None levels disables it).
+            See Processor._Analyzer.set_pyramid().
+        """
+        self._analyzer.set_pyramid(levels, margin)
+
+    def get_pyramid_stats(self):
+        """
+            Returns per-level statistics of the pyramid mode:
+              - evaluations:      number of times the level was evaluated
+              - decisions:        number of times the level decided
+              - escalation_rate:  share of evaluations passed to a finer level
+              - avg_time:         average evaluation time in seconds
+        """
+        return {
+            scale: {
+                'evaluations': stats['evaluations'],
+                'decisions': stats['decisions'],
+                'escalation_rate': 1. - stats['decisions'] / stats['evaluations'] if stats['evaluations'] else 0.,
+                'avg_time': stats['time'] / stats['evaluations'] if stats['evaluations'] else 0.,
+            }
+            for scale, stats in self._analyzer.get_pyramid_stats().items()
+        }
+
+    def set_detectors(self, move: list = None, base: list = None):
+        """
+            Sets the stages of the movement and/or base detector chains,
+            cheapest first (see pxl_camera.filter.detector), e.g.
+
+                processor.set_detectors(move=[SharpnessGate(), AbsDiff(threshold=1.), GridDiff()])
+        """
+        self._analyzer.set_detectors(move, base)
+
+    def get_detector_stats(self):
+        """
+            Returns per stage statistics of the movement and base detector
+            chains ({'move': [...], 'base': [...]}), see DetectorChain.get_stats().
+        """
+        return self._analyzer.get_detector_stats()
+
+    def get_luma(self):
+        return self.luma
+
+    def set_luma(self, luma: bool):
+        if luma != self.luma:
+            # Don't compare frames of different kinds
+            self.frame = None
+        self.luma = luma
 
     def get_diff_frame(self):
         return self.diff_frame
 
-    def set_diff_frame(self, frame: cv2.UMat):
+    def set_diff_frame(self, frame: cv2.UMat, size: tuple = None):
         if frame is None or self.frame is None:
             return
 
         if isinstance(frame, Frame):
-            frame = frame.frame()
+            size = size or frame.get_size()
+            frame = frame.frame
 
-        width, height, channels = image_processing.image_size(frame)
+        width, height, channels = size or image_processing.image_size(frame)
 
         self.diff_frame = Frame(
             width=width,
@@ -213,11 +847,130 @@ class Processor(Actor):
             state=Processor.State.NONE,
         )
 
+    def add_sink(self, sink, states: tuple = (State.GOOD,), stream: str = None, best: int = None):
+        """
+            Passes frames of the given states to sink.put() (e.g. FrameSink).
+            Sinks get full resolution BGR frames even if processing is done
+            on luma or a downscaled stream, or frames of the given muxer
+            stream (e.g. a downscaled one for FrameHistory).
+
+            With 'best' set, the sink only gets the 'best' sharpest frames
+            of each contiguous window of the given states, when the window
+            ends (see BestFrameSelector). Frames are scored on the processed
+            frame and the sink frame of the same seq is kept.
+
+            Sink frames are fetched along with every processed frame (see
+            FrameMuxer.get_frames()), as the muxer drops their pixels before
+            the state is decided.
+        """
+        selector = BestFrameSelector(best) if best else None
+        self.sinks.append((sink, frozenset(states), stream, selector))
+
+    def remove_sink(self, sink):
+        self.sinks = [entry for entry in self.sinks if entry[0] is not sink]
+
+    def get_best_frame_stats(self):
+        """
+            Returns BestFrameSelector statistics of sinks with 'best' set.
+        """
+        return [selector.get_stats() for _, _, _, selector in self.sinks if selector is not None]
+
+    def _sharpness(self, selector: BestFrameSelector) -> float:
+        """
+            Sharpness of the processed frame, on the luma of the roi
+            (cached on the frame, so selectors of the same scale share it).
+        """
+        image, size = Processor._Analyzer._crop(self.frame, self.roi, gray=True)
+        key = Processor._Analyzer._key(self.frame, self.roi, gray=True) + ('sharpness', selector.scale)
+        return self.frame.get_derived(key, lambda: selector.score(image, size))
+
+    def _feed_sinks(self, state: State):
+        if self.frame is None:
+            return
+
+        frames = {}
+
+        def get_frame(stream):
+            if stream not in frames:
+                frame = self._sink_frames.get(stream, None)
+                frames[stream] = frame.replace(state=state) if frame is not None else None
+            if frames[stream] is None:
+                self.schedule_stats['sink_missed'] += 1
+            return frames[stream]
+
+        for sink, states, stream, selector in self.sinks:
+            if selector is not None:
+                self._feed_best(sink, state in states, stream, selector, get_frame)
+            elif state in states:
+                frame = get_frame(stream)
+                if frame is not None:
+                    sink.put(frame)
+
+    def _feed_best(self, sink, in_window: bool, stream: str, selector: BestFrameSelector, get_frame):
+        if in_window:
+            selector.offer(self._sharpness(selector), lambda: get_frame(stream))
+        elif selector.is_active():
+            self._emit_best(sink, selector)
+
+    @staticmethod
+    def _emit_best(sink, selector: BestFrameSelector):
+        for frame in selector.end_window():
+            sink.put(frame)
+
+    def _end_windows(self):
+        for sink, _, _, selector in self.sinks:
+            if selector is not None and selector.is_active():
+                self._emit_best(sink, selector)
+
     def get_state(self):
         return self.state
 
-    def set_state(self, state: State, _requeue_worker=False):
+    def get_factors(self):
+        """
+            Returns the diff factors of the last decision, see Event.
+        """
+        return self.factors
+
+    def set_state(self, state: State, factors: dict = None, _requeue_worker=False):
         if self.started:
+            previous = self.state
             self.state = state
+            self.factors = factors or {}
+
             if _requeue_worker:
-                self._ping_worker()
+                self._record_decision()
+                self._feed_sinks(state)
+
+            # Sinks (e.g. FrameHistory) already have the frame when subscribers hear of it
+            if state != previous:
+                self._publish(previous)
+
+            if _requeue_worker:
+                self._schedule_worker()
+
+    def subscribe(self, actor: Actor = None, method: str = None, callback=None, states: tuple = None) -> int:
+        """
+            Pushes an Event to actor.method(event=...) (as a message) or
+            callback(event) (on the processor's thread, so it should return
+            quickly) whenever the state changes, to one of 'states' if given.
+            Returns the subscription id, see unsubscribe().
+        """
+        return self.subscribers.add(actor, method, callback, states)
+
+    def unsubscribe(self, subscription: int):
+        self.subscribers.remove(subscription)
+
+    def _publish(self, previous: State):
+        if not len(self.subscribers):
+            return
+
+        frame = self.frame
+        event = Processor.Event(
+            state=self.state,
+            previous=previous,
+            seq=frame.seq if frame is not None else None,
+            timestamp=frame.timestamp if frame is not None else datetime.datetime.now(),
+            factors=dict(self.factors),
+            name=self.name,
+        )
+        self.subscribers.publish(event, self.logger)
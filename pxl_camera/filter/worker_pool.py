@@ -0,0 +1,202 @@
+"""
+    Shared pool of analysis threads for the processors of many cameras.
+
+    Without a pool every Processor runs its analyses on a worker actor of
+    its own, so N cameras mean N analysis threads competing for the CPU.
+    With a pool, processors submit their analyses to a bounded number of
+    threads instead (OpenCV releases the GIL, so they run in parallel).
+
+    Scheduling is fair between processors (keys): the next task is taken
+    from the key that has used the least pool time relative to its
+    priority, so a key of priority 2 gets twice the analysis time of a key
+    of priority 1 while the pool is saturated, and no key starves. Keys
+    don't save up time while they are idle.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+
+    class _Key:
+
+        def __init__(self, priority: float):
+            self.priority = priority
+            self.tasks = collections.deque()   # (submit time, task)
+            self.vtime = 0.     # Pool time used, divided by priority
+
+            self.submitted = 0
+            self.completed = 0
+            self.errors = 0
+            self.busy_time = 0.
+            self.wait_time = 0.
+
+    def __init__(self, workers: int = None):
+        """
+        :param workers: Number of threads (default: number of CPUs).
+        """
+        self.workers = workers or os.cpu_count() or 1
+
+        self._keys: Dict[str, WorkerPool._Key] = dict()
+        self._vtime = 0.    # vtime of the last scheduled key
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        self._threads = [
+            threading.Thread(target=self._work_loop, name=f'WorkerPool-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+            Finishes the running and pending tasks. Submitters (e.g.
+            Processor) schedule their next task only when the last one
+            ran, so dropping it would stall them for good.
+        """
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _key(self, name: str) -> _Key:
+        if name not in self._keys:
+            self._keys[name] = WorkerPool._Key(priority=1.)
+        return self._keys[name]
+
+    def get_priority(self, name: str) -> float:
+        with self._condition:
+            return self._key(name).priority
+
+    def set_priority(self, name: str, priority: float):
+        """
+            Sets the share of pool time of the key, relative to other keys
+            (default 1).
+        """
+        if priority <= 0:
+            raise ValueError(f'Invalid priority [{name}]: {priority}')
+
+        with self._condition:
+            self._key(name).priority = priority
+
+    def remove(self, name: str):
+        """
+            Forgets the key, dropping its pending tasks.
+        """
+        with self._condition:
+            self._keys.pop(name, None)
+
+    def submit(self, name: str, task: Callable[[], None]):
+        """
+            Queues task() to run on the pool on behalf of the key.
+            Starts the pool if needed.
+        """
+        self.start()
+
+        with self._condition:
+            key = self._key(name)
+
+            # Idle keys don't get to catch up on time they didn't use
+            if not key.tasks:
+                key.vtime = max(key.vtime, self._vtime)
+
+            key.tasks.append((time.monotonic(), task))
+            key.submitted += 1
+            self._condition.notify()
+
+    def _next_task(self):
+        """
+            Returns (name, key, submit time, task) of the key that is
+            furthest behind its share, or None. Called with the condition held.
+        """
+        pending = [(name, key) for name, key in self._keys.items() if key.tasks]
+        if not pending:
+            return None
+
+        name, key = min(pending, key=lambda item: item[1].vtime)
+        self._vtime = key.vtime
+
+        return (name, key) + key.tasks.popleft()
+
+    def _work_loop(self):
+        while True:
+            with self._condition:
+                item = self._next_task()
+                while item is None and self._running:
+                    self._condition.wait()
+                    item = self._next_task()
+
+                # Stopped, and nothing left to drain
+                if item is None:
+                    return
+
+            name, key, submitted, task = item
+
+            start = time.monotonic()
+            error = False
+            try:
+                task()
+            except Exception:
+                logger.exception(f'Task of [{name}] failed')
+                error = True
+            elapsed = time.monotonic() - start
+
+            with self._condition:
+                key.vtime += elapsed / key.priority
+                key.completed += 1
+                key.errors += error
+                key.busy_time += elapsed
+                key.wait_time += start - submitted
+
+    def get_stats(self) -> dict:
+        """
+            Returns per key statistics:
+              - priority:   share of pool time, relative to other keys
+              - submitted:  number of submitted tasks
+              - completed:  number of finished tasks
+              - errors:     number of tasks that raised
+              - pending:    number of queued tasks
+              - busy_time:  total run time of its tasks in seconds
+              - avg_wait:   average time in seconds a task waited for a thread
+        """
+        with self._condition:
+            return {
+                name: {
+                    'priority': key.priority,
+                    'submitted': key.submitted,
+                    'completed': key.completed,
+                    'errors': key.errors,
+                    'pending': len(key.tasks),
+                    'busy_time': key.busy_time,
+                    'avg_wait': key.wait_time / key.completed if key.completed else 0.,
+                }
+                for name, key in self._keys.items()
+            }
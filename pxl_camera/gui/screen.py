@@ -211,14 +211,17 @@ class Screen(Actor):
     def update_image(self, frame: Frame):
         """
             Updates screen with RGB encoded frame.
-            Assumes frame has been copied and won't be modified concurrently
-            by another actor.
+            The frame itself is not modified.
         """
         x1, y1, x2, y2 = self.new_roi.get()
-        width, height, channels = image_size(frame.frame)
+        width, height, channels = frame.get_size()
 
+        # Frame pixels are shared and read-only, so draw on a private copy
+        # (the gray->RGB conversion already makes one)
         if channels == 1:
-            frame.frame = cv2.cvtColor(frame.frame, cv2.COLOR_GRAY2RGB, frame.frame)
+            image = cv2.cvtColor(frame.get_image(), cv2.COLOR_GRAY2RGB)
+        else:
+            image = frame.get_image(writable=True)
 
         font_height = height // 32
         thickness = height // 256
@@ -241,7 +244,7 @@ class Screen(Actor):
         pt1 = int(x1 * width), int(y1 * height)
         pt2 = int(x2 * width), int(y2 * height)
 
-        self.image = cv2.rectangle(frame.frame, pt1, pt2, 255, thickness)
+        self.image = cv2.rectangle(image, pt1, pt2, 255, thickness)
 
         # Draw font
         self._put_text_outline(
@@ -0,0 +1,190 @@
+"""
+    Pre-trigger history: a rolling buffer of the last few seconds of frames,
+    flushed when the processor state changes to one of the trigger states
+    (e.g. GOOD or MOVE), so the frames before the event are kept too.
+
+    Frames are fed through put() (attach it as a processor sink for all
+    states, usually on a downscaled stream) and state changes through
+    handle_event() (subscribe it to the processor's events, see
+    Processor.subscribe()). Frames are held either as JPEG bytes
+    (compress=True, encoded on the JPEG encoder's thread pool) or as the
+    (downscaled) frames themselves. get_memory() reports the bytes held.
+
+    On a trigger, a snapshot of the history is flushed on a background
+    thread: written as JPEG files to a new directory per event and/or
+    handed to a callback as a list of frames.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Callable
+
+import cv2
+import numpy
+
+from pxl_camera.util import jpeg_encoder
+from pxl_camera.util.frame import Frame
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameHistory:
+
+    def __init__(
+            self,
+            seconds: float,
+            triggers: tuple = (),
+            directory: str = None,
+            callback: Callable = None,
+            compress: bool = True,
+            quality: int = 80,
+    ):
+        """
+        :param seconds: History length.
+        :param triggers: States (Processor.State) that flush the history
+                         when the state changes to them.
+        :param directory: Flushed events are written to subdirectories of it (opt.)
+        :param callback: Called with (trigger frame, list of history frames)
+                         on a background thread (opt.)
+        :param compress: Hold frames as JPEG bytes instead of pixels.
+        :param quality: JPEG quality of compressed frames.
+        """
+        self.seconds = seconds
+        self.triggers = frozenset(triggers)
+        self.directory = directory
+        self.callback = callback
+        self.compress = compress
+        self.quality = quality
+
+        self.events = 0
+        self.errors = 0
+
+        # (Frame, JPEG future or None), oldest first
+        self._frames = collections.deque()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def set_seconds(self, seconds: float):
+        with self._lock:
+            self.seconds = seconds
+            self._trim()
+
+    def set_output(self, triggers: tuple = None, directory: str = None, callback: Callable = None):
+        if triggers is not None:
+            self.triggers = frozenset(triggers)
+        self.directory = directory
+        self.callback = callback
+
+    def put(self, frame: Frame):
+        """
+            Adds the frame to the history.
+        """
+        future = None
+        if self.compress:
+            future = jpeg_encoder.get_encoder().encode_async(frame, self.quality)
+            frame = frame.replace(frame=None)
+
+        with self._lock:
+            self._frames.append((frame, future))
+            self._trim()
+
+    def handle_event(self, event):
+        """
+            Flushes the history if the state changed to a trigger
+            (event is a Processor.Event). The frame of the event is the
+            trigger frame.
+        """
+        if event.state not in self.triggers:
+            return
+
+        with self._lock:
+            if not self._frames:
+                return
+
+            self.events += 1
+            snapshot = list(self._frames)
+
+        # The decided frame, unless the history stream didn't get it
+        trigger = next((frame for frame, _ in reversed(snapshot) if frame.seq == event.seq), snapshot[-1][0])
+        trigger = trigger.replace(state=event.state)
+
+        self._get_executor().submit(self._flush, trigger, snapshot)
+
+    def _trim(self):
+        if not self._frames:
+            return
+
+        newest = self._frames[-1][0].timestamp
+        while (newest - self._frames[0][0].timestamp).total_seconds() > self.seconds:
+            self._frames.popleft()
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        # Single thread, so events are flushed in order
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='history')
+        return self._executor
+
+    def _flush(self, trigger: Frame, snapshot: list):
+        """
+            Runs on the executor, where nobody waits for the result, so
+            failures are logged and counted here. A failing write doesn't
+            keep the callback from running and vice versa.
+        """
+        if self.directory is not None:
+            try:
+                self._write(trigger, snapshot)
+            except Exception:
+                self.errors += 1
+                logger.exception(f'Writing history of {trigger.get_timestamp()} failed')
+
+        if self.callback is not None:
+            try:
+                self.callback(trigger, [self._decoded(frame, future) for frame, future in snapshot])
+            except Exception:
+                self.errors += 1
+                logger.exception(f'History callback of {trigger.get_timestamp()} failed')
+
+    def _write(self, trigger: Frame, snapshot: list):
+        event_directory = os.path.join(self.directory, f'{trigger.get_timestamp()}_{trigger.state.name}')
+        os.makedirs(event_directory, exist_ok=True)
+
+        for frame, future in snapshot:
+            jpeg = future.result() if future is not None else frame.get_jpeg(self.quality)
+            with open(os.path.join(event_directory, f'{frame.get_timestamp()}.jpeg'), 'wb') as image_file:
+                image_file.write(jpeg)
+
+    @staticmethod
+    def _decoded(frame: Frame, future) -> Frame:
+        if future is None:
+            return frame
+
+        return frame.replace(frame=cv2.imdecode(numpy.frombuffer(future.result(), numpy.uint8), cv2.IMREAD_COLOR))
+
+    def get_memory(self) -> int:
+        """
+            Returns the number of bytes held by the history (frames still
+            being compressed are counted uncompressed).
+        """
+        with self._lock:
+            frames = list(self._frames)
+
+        return sum(
+            len(future.result()) if future is not None and future.done() and not future.exception()
+            else frame.width * frame.height * frame.channels
+            for frame, future in frames
+        )
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            count = len(self._frames)
+
+        return {
+            'frames': count,
+            'memory': self.get_memory(),
+            'events': self.events,
+            'errors': self.errors,
+        }
@@ -0,0 +1,378 @@
+"""
+    Asynchronous frame sink: saves frames as JPEG files without blocking
+    the caller.
+
+    put() starts encoding the frame on the JPEG encoder's thread pool and
+    queues it; a writer thread writes finished frames in batches and
+    fsyncs each batch once (all files, then the directory), instead of
+    once per frame.
+
+    The queue is bounded (frames being encoded or waiting to be written).
+    When it is full, the policy decides:
+      - DROP:  the new frame is dropped
+      - BLOCK: put() waits up to 'block_timeout' seconds, then drops it
+      - SPILL: raw pixels of the frame are dumped to the spill directory
+               by a spill thread (no encoding, a single sequential write)
+               and the frame is encoded and written once the queue has
+               drained. At most 'max_spill' frames are spilled at a time,
+               further frames are dropped.
+
+    Attach a sink to a camera with CameraManager.add_sink() (or
+    Processor.add_sink()) to save the frames of given processor states.
+"""
+
+import collections
+import enum
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy
+
+from pxl_camera.util import jpeg_encoder
+from pxl_camera.util.frame import Frame
+
+
+class FrameSink:
+
+    class Policy(str, enum.Enum):
+        DROP = 'drop'
+        BLOCK = 'block'
+        SPILL = 'spill'
+
+    def __init__(
+            self,
+            directory: str,
+            file_format: str = '{timestamp}.jpeg',
+            queue_size: int = 32,
+            policy: Policy = Policy.DROP,
+            block_timeout: float = None,
+            batch_size: int = 8,
+            batch_interval: float = 0.5,
+            fsync: bool = True,
+            quality: int = None,
+            preset: str = None,
+            spill_directory: str = None,
+            max_spill: int = 1024,
+    ):
+        """
+        :param directory: Output directory (created if missing).
+        :param file_format: File name, formatted with 'timestamp', 'seq' and
+                            'state' of the frame.
+        :param queue_size: Maximum number of frames encoded or waiting.
+        :param policy: Overflow policy, see above.
+        :param block_timeout: Maximum wait of the BLOCK policy (None: forever).
+        :param batch_size: Maximum number of files written per batch.
+        :param batch_interval: Maximum time a frame waits for its batch.
+        :param fsync: Make every batch durable before the next one.
+        :param quality: JPEG quality (opt.)
+        :param preset: JPEG encoder preset (opt.)
+        :param spill_directory: Directory of spilled frames
+                                (default: '.spill' in 'directory').
+        :param max_spill: Maximum number of frames spilled (or waiting for
+                          the spill thread) at a time.
+        """
+        self.directory = directory
+        self.file_format = file_format
+        self.policy = FrameSink.Policy(policy)
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.fsync = fsync
+        self.quality = quality
+        self.preset = preset
+        self.spill_directory = spill_directory or os.path.join(directory, '.spill')
+        self.max_spill = max_spill
+
+        self.accepted = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+        self.batches = 0
+        self.bytes_written = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.blocked_time = 0.
+        self.started_time = None
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(queue_size)   # Bounds frames encoded or queued
+        self._spill_queue = queue.Queue(maxsize=queue_size)    # (file path, Frame) waiting to be spilled
+        self._spill = collections.deque()  # (spill path, file path, Frame without pixels)
+        self._spill_pending = 0     # Frames spilled or waiting to be, up to max_spill
+        self._lock = threading.Lock()
+        self._thread = None
+        self._spill_thread = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._running:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._running = True
+        self.started_time = time.monotonic()
+        self._thread = threading.Thread(target=self._write_loop, name=f'FrameSink[{self.directory}]', daemon=True)
+        self._thread.start()
+
+        if self.policy == FrameSink.Policy.SPILL:
+            self._spill_thread = threading.Thread(
+                target=self._spill_loop, name=f'FrameSink[{self.directory}]-spill', daemon=True,
+            )
+            self._spill_thread.start()
+
+    def stop(self):
+        """
+            Writes all queued and spilled frames, then stops the writer.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+
+        # Spill thread first, the writer writes everything it spilled
+        if self._spill_thread is not None:
+            self._spill_thread.join()
+            self._spill_thread = None
+
+        self._thread.join()
+        self._thread = None
+
+    # Producer side
+    def put(self, frame: Frame) -> bool:
+        """
+            Queues the frame for saving. Returns False if it was dropped.
+        """
+        if not self._running or frame is None or frame.frame is None:
+            return False
+
+        path = self._path(frame)
+
+        if not self._acquire_slot():
+            if self.policy == FrameSink.Policy.SPILL:
+                return self._spill_frame(frame, path)
+
+            self._count('dropped')
+            return False
+
+        # Encoding starts right away, in parallel with other queued frames
+        self._queue.put((path, jpeg_encoder.get_encoder().encode_async(frame, self.quality, self.preset), True))
+
+        with self._lock:
+            self.accepted += 1
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+
+        return True
+
+    def _acquire_slot(self) -> bool:
+        if self.policy != FrameSink.Policy.BLOCK:
+            return self._slots.acquire(blocking=False)
+
+        start = time.monotonic()
+        try:
+            return self._slots.acquire(timeout=self.block_timeout)
+        finally:
+            self._count('blocked_time', time.monotonic() - start)
+
+    def _path(self, frame: Frame) -> str:
+        name = self.file_format.format(
+            timestamp=frame.get_timestamp(),
+            seq=frame.seq,
+            state=frame.state.name if frame.state is not None else 'NONE',
+        )
+        return os.path.join(self.directory, name)
+
+    def _spill_frame(self, frame: Frame, path: str) -> bool:
+        """
+            Hands the frame to the spill thread. Drops it if 'max_spill'
+            frames are spilled already, or the spill thread is behind.
+        """
+        with self._lock:
+            if self._spill_pending >= self.max_spill:
+                self.dropped += 1
+                return False
+            self._spill_pending += 1
+
+        try:
+            self._spill_queue.put_nowait((path, frame))
+        except queue.Full:
+            with self._lock:
+                self._spill_pending -= 1
+                self.dropped += 1
+            return False
+
+        self._count('accepted')
+        return True
+
+    def _spill_loop(self):
+        while self._running or not self._spill_queue.empty():
+            try:
+                path, frame = self._spill_queue.get(timeout=self.batch_interval)
+            except queue.Empty:
+                continue
+
+            self._save_spill(path, frame)
+
+    def _save_spill(self, path: str, frame: Frame):
+        spill_path = os.path.join(self.spill_directory, f'{uuid.uuid4().hex}.npy')
+
+        try:
+            os.makedirs(self.spill_directory, exist_ok=True)
+            numpy.save(spill_path, frame.get_image(), allow_pickle=False)
+        except OSError:
+            self._count('errors')
+            self._count('_spill_pending', -1)
+            return
+
+        self._spill.append((spill_path, path, frame.replace(frame=None)))
+        self._count('spilled')
+
+    def _unspill(self):
+        """
+            Returns the oldest spilled frame as a queue item, or None.
+        """
+        try:
+            spill_path, path, frame = self._spill.popleft()
+        except IndexError:
+            return None
+
+        try:
+            frame = frame.replace(frame=numpy.load(spill_path))
+            os.remove(spill_path)
+        except OSError:
+            self._count('errors')
+            return None
+        finally:
+            self._count('_spill_pending', -1)
+
+        return path, jpeg_encoder.get_encoder().encode_async(frame, self.quality, self.preset), False
+
+    def _count(self, name: str, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    # Writer side
+    def _next_batch(self) -> list:
+        batch = []
+
+        try:
+            batch.append(self._queue.get(timeout=self.batch_interval))
+        except queue.Empty:
+            # Spilled frames are written when there is nothing else to do
+            item = self._unspill()
+            return [item] if item is not None else []
+
+        deadline = time.monotonic() + self.batch_interval
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0., deadline - time.monotonic())))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write_loop(self):
+        while self._running or not self._queue.empty() or self._spill_pending:
+            batch = self._next_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch: list):
+        """
+            Writes all files of the batch first and syncs them afterwards,
+            so the disk sees one flush per batch rather than per frame.
+        """
+        files = []
+
+        try:
+            for path, future, slot in batch:
+                try:
+                    self._write_file(path, future, files)
+                finally:
+                    if slot:
+                        self._release_slot()
+
+            if self.fsync:
+                for image_file in files:
+                    image_file.flush()
+                    os.fsync(image_file.fileno())
+        except OSError:
+            self._count('errors')
+        finally:
+            for image_file in files:
+                image_file.close()
+
+        if self.fsync and files:
+            self._fsync_directory()
+
+        self._count('batches')
+
+    def _write_file(self, path: str, future, files: list):
+        """
+            Writes the encoded frame to path, keeping the file open in 'files'.
+        """
+        try:
+            jpeg = future.result()
+            image_file = open(path, 'wb')
+        except Exception:
+            self._count('errors')
+            return
+
+        files.append(image_file)
+
+        try:
+            image_file.write(jpeg)
+        except OSError:
+            self._count('errors')
+            return
+
+        self._count('written')
+        self._count('bytes_written', len(jpeg))
+
+    def _release_slot(self):
+        with self._lock:
+            self.depth -= 1
+        self._slots.release()
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get_stats(self) -> dict:
+        """
+            Returns counters, current/peak queue depth and throughput since
+            start().
+        """
+        elapsed = time.monotonic() - self.started_time if self.started_time is not None else 0.
+
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'spill_pending': self._spill_pending,
+                'errors': self.errors,
+                'batches': self.batches,
+                'queue_depth': self.depth,
+                'max_queue_depth': self.max_depth,
+                'blocked_time': self.blocked_time,
+                'frames_per_second': self.written / elapsed if elapsed else 0.,
+                'bytes_per_second': self.bytes_written / elapsed if elapsed else 0.,
+            }
@@ -0,0 +1,348 @@
+"""
+    Raw multi-camera recorder and its random access reader.
+
+    RawRecorder appends raw capture buffers (UYVY/YUYV, exactly as grabbed)
+    of any number of cameras to segmented container files in a recording
+    directory:
+
+        segment-000000.raw, segment-000001.raw, ...   concatenated raw frames
+        index.bin                                     one INDEX_DTYPE record per frame
+
+    Every start() of a recorder begins a new session of the recording, as
+    FrameMuxer sequence numbers restart with every process; frames are
+    identified by camera, session and seq.
+
+    Frames are copied out of the capture buffer into pooled buffers on the
+    caller's thread and written by a single writer thread with large
+    unbuffered sequential writes. If the writer can't keep up, frames are
+    dropped (and counted) instead of stalling capture.
+
+    RawRecording memory-maps the segments and reads any frame by its index
+    record without touching the rest of the recording.
+
+    Attach a recorder to a camera with CameraManager.start_recording()
+    (or FrameMuxer.set_recorder()).
+"""
+
+import glob
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import cv2
+import numpy
+
+from pxl_camera.util import frame_pool
+from pxl_camera.util.frame import Frame
+
+
+INDEX_DTYPE = numpy.dtype([
+    ('camera', 'S32'),      # Camera name (serial)
+    ('session', '<u4'),     # Recorder session, see RawRecorder.start()
+    ('seq', '<u8'),         # FrameMuxer sequence number
+    ('timestamp', '<f8'),   # POSIX timestamp
+    ('segment', '<u4'),
+    ('offset', '<u8'),      # Byte offset in the segment
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('fourcc', 'S4'),
+])
+
+INDEX_FILE = 'index.bin'
+SEGMENT_FORMAT = 'segment-{:06d}.raw'
+SEGMENT_GLOB = 'segment-*.raw'
+
+
+class RawRecorder:
+
+    def __init__(self, directory: str, segment_size: int = 4 * 2 ** 30, queue_size: int = 16):
+        """
+        :param directory: Recording directory (created if missing). Existing
+                          recordings are appended to.
+        :param segment_size: Maximum size of a segment file in bytes.
+        :param queue_size: Maximum number of frames waiting to be written.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.session = None
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.started_time = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self._segment = None
+        self._segment_file = None
+        self._segment_offset = 0
+        self._index_file = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._running:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Appending starts a new segment and session after the existing ones
+        self._segment = len(glob.glob(os.path.join(self.directory, SEGMENT_GLOB)))
+        self._segment_file = None
+
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        self.session = self._next_session(index_path)
+        self._index_file = open(index_path, 'ab')
+
+        self._running = True
+        self.started_time = time.monotonic()
+        self._thread = threading.Thread(target=self._write_loop, name=f'RawRecorder[{self.directory}]', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+            Writes all queued frames, then closes the recording.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+        self._close_segment()
+
+        self._index_file.close()
+        self._index_file = None
+
+    @staticmethod
+    def _next_session(index_path: str) -> int:
+        if not os.path.exists(index_path):
+            return 0
+
+        index = numpy.fromfile(index_path, INDEX_DTYPE, os.path.getsize(index_path) // INDEX_DTYPE.itemsize)
+        return int(index['session'].max()) + 1 if len(index) else 0
+
+    def put(self, camera: str, seq: int, timestamp: datetime, raw: numpy.ndarray, fourcc: str) -> bool:
+        """
+            Queues a raw frame for recording. The frame is copied, so 'raw'
+            may be reused by the capture right after the call.
+            Returns False if the frame was dropped.
+        """
+        if not self._running:
+            return False
+
+        buffer = frame_pool.get_pool().acquire(raw.shape, raw.dtype)
+        if buffer is None:
+            self._count('dropped')
+            return False
+
+        numpy.copyto(buffer, raw)
+
+        record = numpy.zeros((), INDEX_DTYPE)
+        record['camera'] = str(camera).encode()
+        record['session'] = self.session
+        record['seq'] = seq
+        record['timestamp'] = timestamp.timestamp()
+        record['width'] = raw.shape[1]
+        record['height'] = raw.shape[0]
+        record['fourcc'] = fourcc.encode()
+
+        try:
+            self._queue.put_nowait((record, buffer))
+        except queue.Full:
+            self._count('dropped')
+            return False
+
+        return True
+
+    def _count(self, name: str, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _write_loop(self):
+        while self._running or not self._queue.empty():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Write everything available before flushing the index
+            records = []
+            while item is not None:
+                try:
+                    records.append(self._write_frame(*item))
+                except OSError:
+                    # Continue in a new segment
+                    self._count('errors')
+                    self._close_segment()
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            # Index records are written only after their frames
+            self._index_file.write(b''.join(record.tobytes() for record in records))
+            self._index_file.flush()
+
+    def _write_frame(self, record, buffer: numpy.ndarray):
+        if self._segment_file is None or self._segment_offset + buffer.nbytes > self.segment_size:
+            self._next_segment()
+
+        record['segment'] = self._segment
+        record['offset'] = self._segment_offset
+
+        # Unbuffered: the pooled buffer is written without intermediate copies
+        data = memoryview(buffer).cast('B')
+        while data:
+            data = data[self._segment_file.write(data):]
+
+        self._segment_offset += buffer.nbytes
+
+        self._count('written')
+        self._count('bytes_written', buffer.nbytes)
+
+        return record
+
+    def _close_segment(self):
+        if self._segment_file is None:
+            return
+
+        try:
+            self._segment_file.close()
+        except OSError:
+            self._count('errors')
+
+        self._segment_file = None
+        self._segment += 1
+
+    def _next_segment(self):
+        self._close_segment()
+
+        path = os.path.join(self.directory, SEGMENT_FORMAT.format(self._segment))
+        self._segment_file = open(path, 'wb', buffering=0)
+        self._segment_offset = 0
+
+    def get_stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_time if self.started_time is not None else 0.
+
+        with self._lock:
+            return {
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'queue_depth': self._queue.qsize(),
+                'bytes_written': self.bytes_written,
+                'bytes_per_second': self.bytes_written / elapsed if elapsed else 0.,
+            }
+
+
+class RawRecording:
+    """
+        Random access reader of a RawRecorder recording.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = None
+        self._segments: Dict[int, numpy.memmap] = dict()
+        self._seqs: Dict[tuple, List[int]] = dict()     # (camera, seq) -> positions, oldest session first
+
+        self.refresh()
+
+    def refresh(self):
+        """
+            Reloads the index, e.g. while the recording is still being written.
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+
+        self.index = numpy.fromfile(path, INDEX_DTYPE, count)
+        self._segments.clear()
+        self._seqs = dict()
+        for i, record in enumerate(self.index):
+            self._seqs.setdefault((record['camera'].decode(), int(record['seq'])), []).append(i)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_cameras(self) -> List[str]:
+        return [camera.decode() for camera in numpy.unique(self.index['camera'])]
+
+    def get_sessions(self) -> List[int]:
+        return [int(session) for session in numpy.unique(self.index['session'])]
+
+    def find(self, camera: str, seq: int, session: int = None) -> int:
+        """
+            Returns the position of the camera's frame 'seq' of the session
+            in the index (of the latest session that recorded it if None).
+            Raises KeyError if it is not recorded.
+        """
+        positions = self._seqs[(camera, seq)]
+
+        if session is None:
+            return positions[-1]
+
+        for position in positions:
+            if self.index[position]['session'] == session:
+                return position
+
+        raise KeyError((camera, seq, session))
+
+    def find_time(self, camera: str, timestamp: datetime) -> int:
+        """
+            Returns the position of the camera's frame closest to timestamp.
+        """
+        positions = numpy.flatnonzero(self.index['camera'] == camera.encode())
+        if not len(positions):
+            raise KeyError(camera)
+
+        times = self.index['timestamp'][positions]
+        return int(positions[numpy.argmin(numpy.abs(times - timestamp.timestamp()))])
+
+    def _segment(self, segment: int) -> numpy.memmap:
+        if segment not in self._segments:
+            path = os.path.join(self.directory, SEGMENT_FORMAT.format(segment))
+            self._segments[segment] = numpy.memmap(path, numpy.uint8, 'r')
+        return self._segments[segment]
+
+    def get_raw(self, position: int) -> numpy.ndarray:
+        """
+            Returns the raw (height, width, 2) frame at the index position,
+            memory-mapped (read-only, no copy).
+        """
+        record = self.index[position]
+        width, height = int(record['width']), int(record['height'])
+        offset = int(record['offset'])
+
+        data = self._segment(int(record['segment']))[offset:offset + width * height * 2]
+        return data.reshape(height, width, 2)
+
+    def get_frame(self, position: int) -> Frame:
+        """
+            Returns the frame at the index position converted to BGR.
+        """
+        record = self.index[position]
+        fourcc = record['fourcc'].decode()
+        image = cv2.cvtColor(self.get_raw(position), getattr(cv2, f'COLOR_YUV2BGR_{fourcc}'))
+
+        return Frame(
+            width=image.shape[1],
+            height=image.shape[0],
+            channels=3,
+            frame=image,
+            timestamp=datetime.fromtimestamp(float(record['timestamp'])),
+            seq=int(record['seq']),
+        )
@@ -0,0 +1,59 @@
+"""
+    Event subscriptions.
+
+    Events are pushed to each subscriber either as a message to an actor
+    method (actor.enqueue(method, kwargs={'event': event}), like
+    DeviceDetector events) or by calling a callback on the publisher's
+    thread, which should return quickly.
+"""
+
+import itertools
+import logging
+from typing import Callable, Dict
+
+from pxl_actor.actor import Actor
+
+
+class Subscribers:
+
+    def __init__(self):
+        # subscription id -> (actor, method, callback, states)
+        self._subscriptions: Dict[int, tuple] = dict()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def add(self, actor: Actor = None, method: str = None, callback: Callable = None, states: tuple = None) -> int:
+        """
+            Adds a subscriber: actor and method, or callback. With 'states'
+            set, only events of those states are delivered.
+            Returns the subscription id.
+        """
+        if (actor is None or method is None) and callback is None:
+            raise ValueError('Subscriber needs an actor and method, or a callback')
+
+        subscription = next(self._ids)
+        self._subscriptions[subscription] = (actor, method, callback, frozenset(states) if states else None)
+        return subscription
+
+    def remove(self, subscription: int):
+        self._subscriptions.pop(subscription, None)
+
+    def publish(self, event, logger: logging.Logger = None):
+        """
+            Delivers the event (with a 'state' attribute) to all subscribers
+            of its state. Failing callbacks don't affect the others.
+        """
+        for actor, method, callback, states in list(self._subscriptions.values()):
+            if states is not None and event.state not in states:
+                continue
+
+            try:
+                if actor is not None:
+                    actor.enqueue(method, kwargs={'event': event})
+                else:
+                    callback(event)
+            except Exception as exc:
+                if logger is not None:
+                    logger.warning(f'Event subscriber failed: {exc}')
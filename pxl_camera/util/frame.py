@@ -1,23 +1,95 @@
-from dataclasses import dataclass
+"""
+    Immutable frame: image plus its metadata.
+
+    Frames are shared by reference between the muxer cache, the processor,
+    the GUI and user code, so neither the frame nor its pixels may be
+    modified. numpy images are stored as read-only views; UMat images can't
+    be protected, but the same rule applies to them.
+
+    Use replace() to derive a frame with different metadata (the pixel
+    buffer is shared) and get_image(writable=True) / copy_image() to get
+    pixels you are allowed to modify.
+
+    Representations derived from the image (grayscale, roi crops,
+    downsampled levels, ...) can be cached on the frame with get_derived(),
+    so each is computed once for the lifetime of the frame, however many
+    times and by whoever it is asked for.
+"""
+
+import collections
+import concurrent.futures
+import threading
 from datetime import datetime
-from typing import Any
+from typing import Any, Callable
 
-import cv2
+import numpy
+
+from pxl_camera.util import image_processing, jpeg_encoder
+
+
+_derived_lock = threading.Lock()
 
 
-@dataclass
 class Frame:
-    width: int = None
-    height: int = None
-    channels: int = None
-    frame: Any = None
-    timestamp: datetime = None
-    state: Any = None
 
-    fmt: str = '%F_%H-%M-%S-%f'
+    _FIELDS = ('width', 'height', 'channels', 'frame', 'timestamp', 'state', 'seq', 'roi', 'fmt')
+
+    # Weak references let caches (e.g. the JPEG encoder) live as long as the frame
+    __slots__ = _FIELDS + ('_derived', '__weakref__')
+
+    # Maximum number of derived representations kept per frame
+    MAX_DERIVED = 16
+
+    def __init__(
+            self,
+            width: int = None,
+            height: int = None,
+            channels: int = None,
+            frame: Any = None,
+            timestamp: datetime = None,
+            state: Any = None,
+            seq: int = None,
+            roi: tuple = None,      # Normalized roi the frame is cropped to, if any
+            fmt: str = '%F_%H-%M-%S-%f',
+    ):
+        if isinstance(frame, numpy.ndarray) and frame.flags.writeable:
+            # A view, so the creator's own array stays as it was
+            frame = frame.view()
+            frame.flags.writeable = False
+
+        for name, value in zip(Frame._FIELDS, (width, height, channels, frame, timestamp, state, seq, roi, fmt)):
+            object.__setattr__(self, name, value)
+
+        # key -> derived representation, least recently used first
+        object.__setattr__(self, '_derived', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Frame is immutable, use replace() [{name}]')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'Frame is immutable [{name}]')
+
+    def __reduce__(self):
+        return Frame, tuple(getattr(self, name) for name in Frame._FIELDS)
+
+    def __repr__(self):
+        return (f'Frame(width={self.width}, height={self.height}, channels={self.channels}, '
+                f'timestamp={self.timestamp}, state={self.state}, seq={self.seq}, roi={self.roi})')
+
+    def replace(self, **changes):
+        """
+            Returns a new Frame with the given fields changed, sharing the
+            pixel buffer unless 'frame' is among the changes.
+        """
+        fields = {name: getattr(self, name) for name in Frame._FIELDS}
+        fields.update(changes)
+        return Frame(**fields)
 
     def set_format(self, fmt: str):
-        self.fmt = fmt
+        """
+            Returns a new Frame with the given timestamp format.
+        """
+        return self.replace(fmt=fmt)
 
     def get_format(self):
         return self.fmt
@@ -26,17 +98,87 @@ class Frame:
         if self.timestamp is not None:
             return self.timestamp.strftime(self.fmt)
 
-    def get_jpeg(self, quality=95):
-        return cv2.imencode('.jpg', self.frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tostring()
+    def get_size(self) -> tuple:
+        """
+            Returns (width, height, channels) without touching the image.
+        """
+        return self.width, self.height, self.channels
+
+    def get_image(self, writable: bool = False):
+        """
+            Returns the image as numpy.ndarray (downloaded if it is a UMat).
+            The shared buffer is read-only; writable=True returns a private
+            copy instead (a downloaded UMat image already is one).
+        """
+        image = image_processing.to_host(self.frame)
+
+        if writable and image is self.frame:
+            image = image.copy()
+
+        return image
+
+    def copy_image(self):
+        """
+            Returns a private, writable copy of the image, kept where the
+            image is (numpy or UMat).
+        """
+        return image_processing.copy_image(self.frame)
+
+    def get_jpeg(self, quality: int = None, preset: str = None) -> bytes:
+        """
+            Returns JPEG bytes of the frame (quality 95 by default), cached
+            per quality and preset. See pxl_camera.util.jpeg_encoder.
+        """
+        return jpeg_encoder.get_encoder().encode(self, quality, preset)
+
+    def get_jpeg_async(self, quality: int = None, preset: str = None) -> concurrent.futures.Future:
+        """
+            Same as get_jpeg(), but encoded on the encoder's thread pool.
+            Returns a Future of the JPEG bytes.
+        """
+        return jpeg_encoder.get_encoder().encode_async(self, quality, preset)
+
+    def get_derived(self, key: tuple, compute: Callable[[], Any]):
+        """
+            Returns the representation of the image named by 'key' (e.g.
+            ('gray',) or ('image', roi, True, 'level', 0.25)), computed by
+            compute() the first time it is asked for. The result is shared,
+            so compute() must return a new image (not a reused buffer);
+            numpy images are made read-only. The MAX_DERIVED most recently
+            used representations are kept.
+
+            Frames derived with replace() start with an empty cache.
+        """
+        with _derived_lock:
+            derived = self._derived
+            if derived is not None and key in derived:
+                derived.move_to_end(key)
+                return derived[key]
+
+        # Computed outside of the lock; concurrent callers may both compute it
+        value = compute()
+
+        if isinstance(value, numpy.ndarray) and value.flags.writeable:
+            value = value.view()
+            value.flags.writeable = False
+
+        with _derived_lock:
+            if self._derived is None:
+                object.__setattr__(self, '_derived', collections.OrderedDict())
+
+            self._derived[key] = value
+            self._derived.move_to_end(key)
+
+            while len(self._derived) > Frame.MAX_DERIVED:
+                self._derived.popitem(last=False)
+
+        return value
 
     def get_state(self) -> str:
         return self.state.name
 
     def copy(self):
-        return Frame(
-            width=self.width,
-            height=self.height,
-            channels=self.channels,
-            frame=cv2.UMat(self.frame.get().copy()),
-            timestamp=self.timestamp,
-        )
+        """
+            Returns a Frame without state, sharing the pixel buffer.
+        """
+        return self.replace(state=None)
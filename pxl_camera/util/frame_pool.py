@@ -0,0 +1,197 @@
+"""
+    Pool of reusable image buffers with a global memory budget.
+
+    Buffers are pooled per (shape, dtype) and leased as numpy arrays. Leases
+    are reference counted by Python itself: once the leased array and every
+    view of it (e.g. the read-only view held by a Frame) are gone, the buffer
+    goes back to the pool. No explicit release is needed, so pooled frames
+    can be shared like any other frame.
+
+    The pool is process-wide (get_pool()) and shared by RawCapture,
+    FrameMuxer and Processor; CameraManager configures its budget. Only
+    numpy images are pooled, UMat memory is managed by OpenCV.
+
+    When a new buffer would exceed the budget, idle buffers of other
+    resolutions are evicted first (least recently used first). If that is
+    not enough, the policy decides:
+      - DROP_OLDEST: acquire() returns None at once; FrameMuxer then drops
+                     its oldest cached frames and retries, other callers
+                     skip the optional output (e.g. diff frames)
+      - BLOCK:       acquire() waits up to 'timeout' seconds for leased
+                     buffers to be released, then returns None
+"""
+
+import collections
+import enum
+import threading
+import time
+import weakref
+from typing import Union
+
+import numpy
+
+
+class FramePool:
+
+    class Policy(str, enum.Enum):
+        DROP_OLDEST = 'drop_oldest'
+        BLOCK = 'block'
+
+    class _Lease:
+        """
+            Owner of a leased buffer. All arrays created from a lease refer
+            to this object, so it lives exactly as long as any of them.
+        """
+        def __init__(self, buffer: numpy.ndarray):
+            self.buffer = buffer
+            self.__array_interface__ = buffer.__array_interface__
+
+    def __init__(self, max_bytes: int = None, policy: Policy = Policy.DROP_OLDEST, timeout: float = 1.0):
+        self.max_bytes = max_bytes
+        self.policy = FramePool.Policy(policy)
+        self.timeout = timeout
+
+        self.bytes_total = 0    # Owned by the pool, idle or leased
+        self.bytes_leased = 0
+
+        self.allocations = 0
+        self.reuses = 0
+        self.evictions = 0
+        self.exhausted = 0
+        self.waits = 0
+
+        # (shape, dtype) -> idle buffers, least recently released first
+        self._idle = collections.OrderedDict()
+
+        # Reentrant, since releases may happen in any thread at any time
+        self._condition = threading.Condition(threading.RLock())
+
+    def configure(self, max_bytes: int = None, policy: Policy = None, timeout: float = None):
+        """
+            Sets the memory budget (None for unlimited), policy and timeout.
+        """
+        with self._condition:
+            self.max_bytes = max_bytes
+            if policy is not None:
+                self.policy = FramePool.Policy(policy)
+            if timeout is not None:
+                self.timeout = timeout
+
+            self._trim()
+            self._condition.notify_all()
+
+    def acquire(self, shape: tuple, dtype=numpy.uint8) -> Union[None, numpy.ndarray]:
+        """
+            Returns a leased (uninitialized) array of the given shape and
+            dtype, or None if the budget is exhausted (see the policies).
+        """
+        key = tuple(shape), numpy.dtype(dtype)
+        nbytes = int(numpy.prod(key[0])) * key[1].itemsize
+        deadline = None
+
+        with self._condition:
+            while True:
+                buffers = self._idle.get(key, None)
+
+                if buffers:
+                    buffer = buffers.pop()
+                    if not buffers:
+                        del self._idle[key]
+                    self.reuses += 1
+                    break
+
+                if self._evict(nbytes):
+                    buffer = numpy.empty(key[0], key[1])
+                    self.bytes_total += nbytes
+                    self.allocations += 1
+                    break
+
+                if self.policy == FramePool.Policy.DROP_OLDEST:
+                    self.exhausted += 1
+                    return None
+
+                if deadline is None:
+                    self.waits += 1
+                    deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    self.exhausted += 1
+                    return None
+
+                self._condition.wait(remaining)
+
+            self.bytes_leased += nbytes
+
+        lease = FramePool._Lease(buffer)
+        weakref.finalize(lease, self._release, key, buffer)
+
+        return numpy.asarray(lease)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.max_bytes is None or self.bytes_total + nbytes <= self.max_bytes
+
+    def _evict(self, nbytes: int) -> bool:
+        """
+            Evicts idle buffers until 'nbytes' more fit in the budget.
+            Returns False (evicting nothing) if they can't fit at all.
+        """
+        if self._fits(nbytes):
+            return True
+
+        if self.bytes_leased + nbytes > self.max_bytes:
+            return False
+
+        self._trim(nbytes)
+        return True
+
+    def _trim(self, nbytes: int = 0):
+        """
+            Evicts least recently used idle buffers while over the budget.
+        """
+        while not self._fits(nbytes) and self._idle:
+            key, buffers = next(iter(self._idle.items()))
+            self.bytes_total -= buffers.pop().nbytes
+            self.evictions += 1
+            if not buffers:
+                del self._idle[key]
+
+    def _release(self, key: tuple, buffer: numpy.ndarray):
+        with self._condition:
+            self.bytes_leased -= buffer.nbytes
+
+            if self._fits(0):
+                self._idle.setdefault(key, []).append(buffer)
+                self._idle.move_to_end(key)
+            else:
+                # Budget was lowered meanwhile
+                self.bytes_total -= buffer.nbytes
+                self.evictions += 1
+
+            self._condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """
+            Returns pool statistics; 'reuses' is the number of allocations
+            avoided.
+        """
+        with self._condition:
+            return {
+                'max_bytes': self.max_bytes,
+                'policy': self.policy.value,
+                'bytes_total': self.bytes_total,
+                'bytes_leased': self.bytes_leased,
+                'allocations': self.allocations,
+                'reuses': self.reuses,
+                'evictions': self.evictions,
+                'exhausted': self.exhausted,
+                'waits': self.waits,
+                'idle': {f'{shape}/{dtype}': len(buffers) for (shape, dtype), buffers in self._idle.items()},
+            }
+
+
+_pool = FramePool()
+
+
+def get_pool() -> FramePool:
+    return _pool
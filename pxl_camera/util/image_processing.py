@@ -1,28 +1,208 @@
 """
     Various image processing utilities used for image filtering.
+
+    Images are either numpy.ndarray or cv2.UMat, depending on the execution
+    mode (set_mode()):
+      - NUMPY: plain numpy images, OpenCL disabled (default; on CPU-only
+               OpenCL implementations UMat transfers cost more than the
+               processing itself)
+      - UMAT:  images live in cv2.UMat and OpenCV may run them on OpenCL
+
+    Functions work on both. Reading UMat pixels or dimensions requires a
+    transfer to host memory, so functions that need the image size take an
+    optional 'size' (width, height, channels) which callers should pass from
+    Frame metadata instead.
 """
-from functools import reduce, lru_cache
+import enum
 
 import cv2
 import numpy
 
 
-def image_size(image):
+class Mode(str, enum.Enum):
+    NUMPY = 'numpy'
+    UMAT = 'umat'
+
+
+_mode = Mode.NUMPY
+
+
+def get_mode() -> Mode:
+    return _mode
+
+
+def set_mode(mode: Mode):
+    """
+        Sets the execution mode for the whole process.
+    """
+    global _mode
+    _mode = Mode(mode)
+    cv2.ocl.setUseOpenCL(_mode == Mode.UMAT)
+
+
+def to_device(image):
+    """
+        Returns image in the representation of the current execution mode
+        (uploads or downloads it if needed).
+    """
+    if image is None:
+        return None
+
+    if _mode == Mode.UMAT:
+        return image if isinstance(image, cv2.UMat) else cv2.UMat(image)
+
+    return to_host(image)
+
+
+def to_host(image):
+    """
+        Returns image as numpy.ndarray, downloading UMat images.
+        Meant for API boundaries (display, encoding, user code).
+    """
     if isinstance(image, cv2.UMat):
-        height = len(image.get())
-        width = len(image.get()[0])
-        channels = len(image.get()[0][0]) if not isinstance(image.get()[0][0], numpy.uint8) else 1
-    elif isinstance(image, numpy.ndarray):
-        height = len(image)
-        width = len(image[0])
-        channels = len(image[0][0])
-    else:
+        return image.get()
+
+    return image
+
+
+def copy_image(image):
+    """
+        Returns a copy of image that stays where the image is (no transfer).
+    """
+    if isinstance(image, cv2.UMat):
+        return cv2.copyMakeBorder(image, 0, 0, 0, 0, cv2.BORDER_CONSTANT)
+
+    return image.copy()
+
+
+def image_size(image):
+    """
+        Returns (width, height, channels) of the image.
+        For UMat images this is a download; pass known sizes where possible.
+    """
+    image = to_host(image)
+
+    if not isinstance(image, numpy.ndarray):
         raise TypeError(f'Unknown image type: {type(image)}')
 
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+
     return width, height, channels
 
 
-def crop(image: cv2.UMat, roi: tuple):
+def crop_size(size: tuple, roi: tuple, align: int = 1):
+    """
+        Returns (width, height, channels) of an image of 'size' after crop().
+    """
+    width, height, channels = size
+    x1, y1, x2, y2 = roi_bounds(width, height, roi, align)
+
+    return x2 - x1, y2 - y1, channels
+
+
+def scaled_size(size: tuple, scale: float):
+    """
+        Returns (width, height, channels) of an image of 'size' resized by scale.
+    """
+    width, height, channels = size
+
+    return max(1, round(width * scale)), max(1, round(height * scale)), channels
+
+
+# BGR -> limited range BT.601 YUV (the inverse of COLOR_YUV2BGR_UYVY)
+_BGR_TO_YUV = numpy.array([
+    [0.098, 0.504, 0.257, 16.],
+    [0.439, -0.291, -0.148, 128.],
+    [-0.071, -0.368, 0.439, 128.],
+], numpy.float32)
+
+
+def bgr_to_yuv422(image, fourcc: str = 'UYVY'):
+    """
+        Packs a BGR image into a raw (height, width, 2) YUV 4:2:2 buffer, as
+        captured by RawCapture.
+    :param image: numpy.ndarray BGR image with even width.
+    :param fourcc: 'UYVY' or 'YUYV'.
+    :return: numpy.ndarray of shape (height, width, 2)
+    """
+    height, width = image.shape[:2]
+    yuv = cv2.transform(image, _BGR_TO_YUV)
+
+    # Horizontal chroma subsampling (average of each pixel pair)
+    chroma = ((yuv[:, 0::2, 1:].astype(numpy.uint16) + yuv[:, 1::2, 1:]) >> 1).astype(numpy.uint8)
+
+    y_index, c_index = (1, 0) if fourcc.upper() == 'UYVY' else (0, 1)
+
+    raw = numpy.empty((height, width, 2), numpy.uint8)
+    raw[:, :, y_index] = yuv[:, :, 0]
+    raw[:, 0::2, c_index] = chroma[:, :, 0]
+    raw[:, 1::2, c_index] = chroma[:, :, 1]
+
+    return raw
+
+
+# Index of the Y byte inside a (height, width, 2) YUV 4:2:2 buffer
+LUMA_CHANNEL = {
+    'UYVY': 1,
+    'YUYV': 0,
+    'YUY2': 0,
+    'YVYU': 0,
+}
+
+
+def yuv422_luma(raw, fourcc: str, copy: bool = True, dst=None):
+    """
+        Returns the grayscale (Y plane) image of a raw YUV 4:2:2 frame
+        without any colour conversion.
+    :param raw: (height, width, 2) raw frame, numpy.ndarray or cv2.UMat.
+    :param fourcc: Fourcc of the raw frame.
+    :param copy: If False, a numpy raw frame gives a zero-copy strided view,
+                 which is only valid as long as the raw buffer is.
+    :param dst: Preallocated output image to copy the Y plane to (opt.)
+    :return: Single channel image of the same type as 'raw'.
+    """
+    channel = LUMA_CHANNEL[fourcc.upper()]
+
+    if isinstance(raw, cv2.UMat):
+        return cv2.extractChannel(raw, channel, dst)
+
+    luma = raw[:, :, channel]
+
+    if dst is not None:
+        numpy.copyto(dst, luma)
+        return dst
+
+    return numpy.ascontiguousarray(luma) if copy else luma
+
+
+def bgr_to_luma(image):
+    """
+        Returns the Y plane of a BGR image, as it would be captured in a raw
+        YUV 4:2:2 frame (which is not the same as COLOR_BGR2GRAY).
+    """
+    return cv2.transform(image, _BGR_TO_YUV[:1])
+
+
+def roi_bounds(width: int, height: int, roi: tuple, align: int = 1):
+    """
+        Converts normalized roi (x1, y1, x2, y2) to pixel bounds
+        (x1, y1, x2, y2) of an image of the given size.
+    :param align: Horizontal alignment of the bounds in pixels (e.g. 2 for
+                  YUV 4:2:2 macropixels).
+    """
+    x1, y1, x2, y2 = roi
+    x1, x2 = int(max(0, min(x1 * width, x2 * width))), int(min(width, max(x1 * width, x2 * width)))
+    y1, y2 = int(max(0, min(y1 * height, y2 * height))), int(min(height, max(y1 * height, y2 * height)))
+
+    if align > 1:
+        x1 -= x1 % align
+        x2 = min(x2 + (-x2 % align), width - width % align)
+
+    return x1, y1, x2, y2
+
+
+def crop(image: cv2.UMat, roi: tuple, align: int = 1, size: tuple = None):
     """
         Returns given image cropped to the unit-based coordinates
         (x1, y1, x2, y2 are real numbers between 0 and 1).
@@ -30,13 +210,19 @@ def crop(image: cv2.UMat, roi: tuple):
     :param roi: tuple containing normalized coordinates (x1, y1, x2, y2)
                 where x1,y1 is the upper-left corner and x2,y2 is bottom-right
                 corner (opt.)
+    :param align: Horizontal alignment of the crop, see roi_bounds().
+    :param size: Known (width, height, channels) of the image (opt.)
     :return: cv.UMat object of the cropped image
     """
-    width, height, _ = image_size(image)
+    if isinstance(image, numpy.ndarray):
+        height, width = image.shape[:2]
+    else:
+        width, height, _ = size or image_size(image)
 
-    x1, y1, x2, y2 = roi
-    x1, x2 = int(max(0, min(x1 * width, x2 * width))), int(min(width, max(x1 * width, x2 * width)))
-    y1, y2 = int(max(0, min(y1 * height, y2 * height))), int(min(height, max(y1 * height, y2 * height)))
+    x1, y1, x2, y2 = roi_bounds(width, height, roi, align)
+
+    if isinstance(image, numpy.ndarray):
+        return image[y1:y2, x1:x2]
 
     return cv2.UMat(image, [y1, y2], [x1, x2])
 
@@ -48,15 +234,18 @@ def sharpness(image: cv2.UMat):
     :param image: cv2.UMat object containing RGB frame.
     :return: int denoting sharpness (larger value = sharper)
     """
+    mean, stddev = cv2.meanStdDev(cv2.Laplacian(image, cv2.CV_64F))
+    mean, stddev = to_host(mean).ravel(), to_host(stddev).ravel()
 
-    return cv2.Laplacian(image, cv2.CV_64FC3).get().var()
+    # Variance over all channels, from the per-channel moments
+    return float(numpy.mean(stddev ** 2 + mean ** 2) - numpy.mean(mean) ** 2)
 
 
 def make_smoother(image: cv2.UMat):
     return cv2.medianBlur(src=image, ksize=5, dst=image)
 
 
-def abs_diff(image_a: cv2.UMat, image_b: cv2.UMat, roi: tuple = None):
+def abs_diff(image_a: cv2.UMat, image_b: cv2.UMat, roi: tuple = None, dst=None, size: tuple = None):
     """
         Calculates absolute difference between two RGB frames.
     :param image_a: Image A.
@@ -64,74 +253,147 @@ def abs_diff(image_a: cv2.UMat, image_b: cv2.UMat, roi: tuple = None):
     :param roi: tuple containing normalized coordinates (x1, y1, x2, y2)
                 where x1,y1 is the upper-left corner and x2,y2 is bottom-right
                 corner (opt.)
+    :param dst: Preallocated output image of the (cropped) input size (opt.)
+    :param size: Known (width, height, channels) of the images (opt.)
     :return: Per-channel absolute difference between A and B.
     """
 
     if roi:
-        image_a = crop(image_a, roi)
-        image_b = crop(image_b, roi)
+        image_a = crop(image_a, roi, size=size)
+        image_b = crop(image_b, roi, size=size)
 
-    return cv2.absdiff(image_a, image_b)
+    return cv2.absdiff(image_a, image_b, dst=dst)
 
 
-def abs_diff_factor(image_diff: cv2.UMat):
+def count_above(image, thresh: int, size: tuple = None, dst=None):
     """
-        Takes input from abs_diff and returns a single integer denoting the "diff" factor.
+        Returns (count, total): number of values (over all channels) higher
+        than thresh, and the number of all values.
+
+        The thresholded image goes to 'dst' (a preallocated buffer of the
+        image size, opt.); numpy images are counted with countNonZero.
+        For UMat images pass the known size to avoid a download.
     """
-    width, height, channels = image_size(image_diff)
+    if isinstance(image, cv2.UMat):
+        width, height, channels = size or image_size(image)
+        binary = cv2.threshold(src=image, thresh=thresh, maxval=1, type=cv2.THRESH_BINARY, dst=dst)[1]
+        return int(sum(cv2.sumElems(binary))), width * height * channels
 
-    return sum(cv2.sumElems(image_diff)) / (width * height * channels)
+    binary = cv2.threshold(src=image, thresh=thresh, maxval=1, type=cv2.THRESH_BINARY, dst=dst)[1]
 
+    # countNonZero takes single channel images only, channels are folded into the rows
+    return cv2.countNonZero(binary.reshape(binary.shape[0], -1)), binary.size
 
-@lru_cache()
-def _get_mask(_row, _col, _rows, _cols, _row_size, _col_size):
-    block_shape = (_row_size, _col_size)
-    grid_blocks = [
-        [numpy.zeros(block_shape, numpy.uint8) for _ in range(_cols)]
-        for __ in range(_rows)
-    ]
-    grid_blocks[_row][_col] = numpy.ones(block_shape, numpy.uint8)
-    return numpy.block(grid_blocks)
 
+def diff_count(image_a, image_b, thresh: int, roi: tuple = None, dst=None, size: tuple = None,
+               binary_dst=None):
+    """
+        Fused abs_diff + threshold + count. Returns (count, total, diff) where
+        'count' is the number of values of |A - B| higher than thresh and
+        'diff' is the absolute difference image (written to 'dst' if given).
+        'binary_dst' is a preallocated buffer for the thresholded diff (opt.)
 
-# TODO: GET THIS BELOW 100ms
-def grid_diff(image_a: cv2.UMat, image_b: cv2.UMat, rows: int, cols: int, roi: tuple = None):
+        255 * count / total equals abs_diff_factor() of the thresholded diff.
+    """
+    diff = abs_diff(image_a, image_b, roi, dst, size)
+
+    if size is not None and roi:
+        size = crop_size(size, roi)
+
+    count, total = count_above(diff, thresh, size, binary_dst)
+
+    return count, total, diff
+
+
+def max_pool(image, pool: int, size: tuple = None, dst=None):
+    """
+        Returns (pooled image, its size): the maximum of every pool x pool
+        block, so that pool² times the number of pooled values above a
+        threshold is at least the number of such values of the image.
+        Partial blocks at the right and bottom are padded with zeros.
+
+        'size' is the known (width, height, channels) of the image, 'dst'
+        an optional buffer of the (padded) image size for the dilation.
+    """
+    width, height, channels = size or image_size(image)
+    pad_x, pad_y = -width % pool, -height % pool
+
+    if pad_x or pad_y:
+        image = cv2.copyMakeBorder(image, 0, pad_y, 0, pad_x, cv2.BORDER_CONSTANT, value=0)
+        dst = None
+
+    # Block maxima land on the top left pixel of each block, nearest resize picks exactly those
+    image = cv2.dilate(image, numpy.ones((pool, pool), numpy.uint8), dst=dst, anchor=(0, 0))
+    pooled_size = (width + pad_x) // pool, (height + pad_y) // pool, channels
+
+    return cv2.resize(image, pooled_size[:2], interpolation=cv2.INTER_NEAREST), pooled_size
+
+
+def abs_diff_factor(image_diff: cv2.UMat, size: tuple = None):
+    """
+        Takes input from abs_diff and returns a single integer denoting the "diff" factor.
     """
-        Calculates a rows x cols matrix containing positive real values
-        signifying absolute differences between grid cells when images are
-        divided into rows x cols grid.
+    width, height, channels = size or image_size(image_diff)
+
+    return sum(cv2.sumElems(image_diff)) / (width * height * channels)
+
+
+def grid_means(image, rows: int, cols: int, size: tuple = None):
     """
+        Returns a rows x cols numpy.ndarray of mean values (over all channels)
+        of the grid cells when image is divided into rows x cols grid.
+        Remainder pixels that don't fill a whole cell are ignored.
 
-    # TODO: avoid cropping
-    if roi is not None:
-        image_a = crop(image_a, roi)
-        image_b = crop(image_b, roi)
+        All cells are reduced in a single pass over the image. UMat images
+        are reduced on the device and only the rows x cols means are
+        downloaded ('size' is their known (width, height, channels)).
+    """
+    if not isinstance(image, numpy.ndarray):
+        return _grid_means_device(image, rows, cols, size)
+
+    height, width = image.shape[:2]
+    row_size = height // rows
+    col_size = width // cols
 
-    image_diff = abs_diff(image_a, image_b)
+    cells = image[:rows * row_size, :cols * col_size].reshape(rows, row_size, cols, col_size, -1)
+    sums = cells.sum(axis=(1, 3, 4), dtype=numpy.uint64)
 
-    width, height, channels = image_size(image_a)
-    row_size = int(height / rows)
-    col_size = int(width / cols)
+    return sums / (row_size * col_size * cells.shape[-1])
 
-    grid = [[0. for _ in range(cols)] for __ in range(rows)]
 
-    for row in range(rows):
-        for col in range(cols):
-            mask = _get_mask(row, col, rows, cols, row_size, col_size)
-            cell_diff = cv2.mean(image_diff, mask)
+def _grid_means_device(image: cv2.UMat, rows: int, cols: int, size: tuple = None):
+    """
+        grid_means() of a UMat image: an INTER_AREA resize of the whole cells
+        to cols x rows is exactly the cell means.
+    """
+    width, height, channels = size or image_size(image)
+    row_size = height // rows
+    col_size = width // cols
 
-            grid[row][col] = cell_diff
+    if not row_size or not col_size:
+        return numpy.zeros((rows, cols))
 
-    return grid
+    cells = cv2.UMat(image, [0, rows * row_size], [0, cols * col_size])
+    cells = cv2.multiply(cells, 1., dtype=cv2.CV_32F)   # No rounding of the means
+    means = cv2.resize(cells, (cols, rows), interpolation=cv2.INTER_AREA).get()
+
+    return means.reshape(rows, cols, -1).mean(axis=2, dtype=numpy.float64)
+
+
+def grid_diff(image_a: cv2.UMat, image_b: cv2.UMat, rows: int, cols: int, roi: tuple = None):
+    """
+        Calculates a rows x cols matrix (numpy.ndarray) containing positive
+        real values signifying absolute differences between grid cells when
+        images are divided into rows x cols grid.
+    """
+    return grid_means(abs_diff(image_a, image_b, roi), rows, cols)
 
 
 def grid_diff_factor(grid, threshold: float):
     """
-        Takes input from grid_diff (integer matrix that contains cell_diffs)
-        and returns the percentage of cells in diff grid that are higher than
+        Takes input from grid_diff (matrix that contains cell diffs) and
+        returns the number of cells in diff grid that are higher than
         threshold.
-
-        Return value is a real number between 0 and 1.
     """
 
-    return sum(map(lambda s: 1 if s[0] > threshold else 0, reduce(lambda x, y: x + y, grid)))
+    return int(numpy.count_nonzero(numpy.asarray(grid) > threshold))
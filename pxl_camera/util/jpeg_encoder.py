@@ -0,0 +1,163 @@
+"""
+    JPEG encoding service.
+
+    Frames are encoded on a thread pool (cv2.imencode releases the GIL, so
+    several frames are encoded in parallel) and the encoded bytes are cached
+    per frame and (quality, scale), so asking for the same JPEG twice costs
+    nothing. The cache holds frames weakly: entries disappear together with
+    their frames.
+
+    Presets name common (quality, scale) combinations, e.g. 'preview' is a
+    half resolution, quality 80 JPEG.
+
+    A process-wide encoder is available through get_encoder(); it is used by
+    Frame.get_jpeg() and Frame.get_jpeg_async().
+"""
+
+import concurrent.futures
+import dataclasses
+import os
+import threading
+import weakref
+from typing import Dict
+
+import cv2
+
+from pxl_camera.util import image_processing
+
+
+class JpegEncoder:
+
+    @dataclasses.dataclass(frozen=True)
+    class Preset:
+        quality: int = 95
+        scale: float = 1.0  # Relative to the frame size
+
+    PRESETS: Dict[str, Preset] = {
+        'full': Preset(quality=95, scale=1.0),
+        'archive': Preset(quality=90, scale=1.0),
+        'preview': Preset(quality=80, scale=0.5),
+        'thumbnail': Preset(quality=70, scale=0.25),
+    }
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.presets = dict(JpegEncoder.PRESETS)
+
+        self.hits = 0
+        self.misses = 0
+
+        # frame -> {(quality, scale): Future}
+        self._cache = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='jpeg')
+            return self._executor
+
+    def add_preset(self, name: str, preset: Preset):
+        self.presets[name] = preset
+
+    def _options(self, quality: int = None, preset: str = None) -> tuple:
+        """
+            Returns (quality, scale) of the request.
+        """
+        base = self.presets[preset] if preset is not None else JpegEncoder.Preset()
+        return quality if quality is not None else base.quality, base.scale
+
+    @staticmethod
+    def _encode(frame, quality: int, scale: float) -> bytes:
+        image = frame.frame
+
+        if scale != 1.0:
+            width, height, _ = image_processing.scaled_size(frame.get_size(), scale)
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        success, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not success:
+            raise RuntimeError(f'JPEG encoding of frame {frame.seq} failed')
+
+        return image_processing.to_host(jpeg).tobytes()
+
+    def _lookup(self, frame, key: tuple) -> tuple:
+        """
+            Returns (future, created): the cached future of the key, or a new
+            one registered so that concurrent requests share it.
+        """
+        with self._lock:
+            futures = self._cache.setdefault(frame, {})
+            future = futures.get(key, None)
+
+            if future is not None:
+                self.hits += 1
+                return future, False
+
+            self.misses += 1
+            future = futures[key] = concurrent.futures.Future()
+
+        return future, True
+
+    def _forget(self, frame, key: tuple):
+        with self._lock:
+            self._cache.get(frame, {}).pop(key, None)
+
+    def _run(self, frame, key: tuple, future: concurrent.futures.Future):
+        if not future.set_running_or_notify_cancel():
+            self._forget(frame, key)
+            return
+
+        try:
+            future.set_result(self._encode(frame, *key))
+        except Exception as exc:
+            # Failures are not cached
+            self._forget(frame, key)
+            future.set_exception(exc)
+
+    def encode_async(self, frame, quality: int = None, preset: str = None) -> concurrent.futures.Future:
+        """
+            Returns a Future of the JPEG bytes of the frame, encoded on the
+            thread pool (or taken from the cache).
+        """
+        key = self._options(quality, preset)
+
+        future, created = self._lookup(frame, key)
+        if created:
+            self._get_executor().submit(self._run, frame, key, future)
+
+        return future
+
+    def encode(self, frame, quality: int = None, preset: str = None) -> bytes:
+        """
+            Returns the JPEG bytes of the frame, encoded on the caller's
+            thread unless it is cached or already being encoded.
+        """
+        key = self._options(quality, preset)
+
+        future, created = self._lookup(frame, key)
+        if created:
+            self._run(frame, key, future)
+
+        return future.result()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'frames': len(self._cache),
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_encoder = JpegEncoder()
+
+
+def get_encoder() -> JpegEncoder:
+    return _encoder
@@ -0,0 +1,148 @@
+"""
+    Integral image based region statistics.
+
+    Builds integral images (sum and optionally sum of squares) of a diff or
+    luma frame once, then answers mean/variance of any rectangle, normalized
+    roi or grid of cells in constant time per region, without touching the
+    pixels again.
+"""
+
+import cv2
+import numpy
+
+from pxl_camera.util import image_processing
+
+
+class RegionStats:
+
+    def __init__(self, image, squares: bool = False):
+        """
+        :param image: Single or multi channel image (numpy.ndarray or cv2.UMat).
+                      Channels are pooled, i.e. statistics are over all values.
+        :param squares: Also build the sum of squares table (needed for variance).
+        """
+        image = image_processing.to_host(image)
+
+        self.height, self.width = image.shape[:2]
+        self.channels = image.shape[2] if image.ndim == 3 else 1
+
+        # 32 bit sums are enough unless a (large) image could overflow them
+        max_sum = float(self.width) * self.height * numpy.iinfo(numpy.uint8).max
+        sdepth = cv2.CV_32S if image.dtype == numpy.uint8 and max_sum < 2 ** 31 else cv2.CV_64F
+
+        if squares:
+            self.sum, self.sqsum = cv2.integral2(image, sdepth=sdepth, sqdepth=cv2.CV_64F)
+        else:
+            self.sum, self.sqsum = cv2.integral(image, sdepth=sdepth), None
+
+        # Pool channels
+        if self.sum.ndim == 3:
+            self.sum = self.sum.sum(axis=2, dtype=numpy.float64)
+            if self.sqsum is not None:
+                self.sqsum = self.sqsum.sum(axis=2)
+
+    @staticmethod
+    def _rect_sum(table, x1: int, y1: int, x2: int, y2: int):
+        return float(table[y2, x2]) - float(table[y1, x2]) - float(table[y2, x1]) + float(table[y1, x1])
+
+    @staticmethod
+    def _cell_sums(table, ys, xs):
+        corners = table[numpy.ix_(ys, xs)].astype(numpy.float64)
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+    def _count(self, x1: int, y1: int, x2: int, y2: int):
+        return max(0, x2 - x1) * max(0, y2 - y1) * self.channels
+
+    # Pixel rectangles (x2, y2 exclusive)
+    def mean(self, x1: int, y1: int, x2: int, y2: int) -> float:
+        count = self._count(x1, y1, x2, y2)
+        return self._rect_sum(self.sum, x1, y1, x2, y2) / count if count else 0.
+
+    def variance(self, x1: int, y1: int, x2: int, y2: int) -> float:
+        if self.sqsum is None:
+            raise RuntimeError('RegionStats built without squares')
+
+        count = self._count(x1, y1, x2, y2)
+        if not count:
+            return 0.
+
+        mean = self._rect_sum(self.sum, x1, y1, x2, y2) / count
+        return max(0., self._rect_sum(self.sqsum, x1, y1, x2, y2) / count - mean ** 2)
+
+    # Normalized roi (x1, y1, x2, y2 are real numbers between 0 and 1)
+    def roi_mean(self, roi: tuple = None) -> float:
+        return self.mean(*self._roi_bounds(roi))
+
+    def roi_variance(self, roi: tuple = None) -> float:
+        return self.variance(*self._roi_bounds(roi))
+
+    def _roi_bounds(self, roi: tuple = None):
+        if roi is None:
+            return 0, 0, self.width, self.height
+
+        return image_processing.roi_bounds(self.width, self.height, roi)
+
+    # Grids
+    def _grid_edges(self, rows: int, cols: int, roi: tuple = None):
+        """
+            Returns cell edges; remainder pixels that don't fill a whole cell
+            are ignored (same as image_processing.grid_means()).
+        """
+        x1, y1, x2, y2 = self._roi_bounds(roi)
+        row_size = (y2 - y1) // rows
+        col_size = (x2 - x1) // cols
+
+        ys = y1 + numpy.arange(rows + 1) * row_size
+        xs = x1 + numpy.arange(cols + 1) * col_size
+
+        return ys, xs, row_size * col_size * self.channels
+
+    def grid_means(self, rows: int, cols: int, roi: tuple = None):
+        """
+            Returns rows x cols numpy.ndarray of cell means.
+        """
+        ys, xs, count = self._grid_edges(rows, cols, roi)
+        if not count:
+            return numpy.zeros((rows, cols))
+
+        return self._cell_sums(self.sum, ys, xs) / count
+
+    def pooled_grid_means(self, rows: int, cols: int, width: int, height: int, pool: int):
+        """
+            Returns rows x cols upper bounds of the grid_means() of a width x
+            height image, from the stats of its max_pool()ed version
+            (image_processing.max_pool()): every cell is bounded by the
+            blocks it overlaps.
+        """
+        row_size = height // rows
+        col_size = width // cols
+        count = row_size * col_size * self.channels
+        if not count:
+            return numpy.zeros((rows, cols))
+
+        ys = numpy.arange(rows + 1) * row_size
+        xs = numpy.arange(cols + 1) * col_size
+        y1, y2 = ys[:-1] // pool, -(-ys[1:] // pool)
+        x1, x2 = xs[:-1] // pool, -(-xs[1:] // pool)
+
+        table = self.sum
+        sums = (
+            table[numpy.ix_(y2, x2)].astype(numpy.float64) - table[numpy.ix_(y1, x2)]
+            - table[numpy.ix_(y2, x1)] + table[numpy.ix_(y1, x1)]
+        )
+
+        return sums * pool ** 2 / count
+
+    def grid_variances(self, rows: int, cols: int, roi: tuple = None):
+        """
+            Returns rows x cols numpy.ndarray of cell variances.
+        """
+        if self.sqsum is None:
+            raise RuntimeError('RegionStats built without squares')
+
+        ys, xs, count = self._grid_edges(rows, cols, roi)
+        if not count:
+            return numpy.zeros((rows, cols))
+
+        means = self._cell_sums(self.sum, ys, xs) / count
+        return numpy.maximum(0., self._cell_sums(self.sqsum, ys, xs) / count - means ** 2)
@@ -0,0 +1,58 @@
+import cv2
+import numpy
+
+from pxl_camera.filter.best_frame import BestFrameSelector
+from pxl_camera.util.frame import Frame
+
+
+def frame(seq: int) -> Frame:
+    return Frame(1, 1, 1, numpy.zeros((1, 1), numpy.uint8), seq=seq)
+
+
+def test_keeps_k_best_sharpest_first():
+    selector = BestFrameSelector(k=2)
+
+    for seq, score in enumerate([1., 5., 3., 4., 2.]):
+        selector.offer(score, lambda seq=seq: frame(seq))
+
+    assert [best.seq for best in selector.end_window()] == [1, 3]
+    assert selector.get_stats() == {'windows': 1, 'offered': 5, 'selected': 2}
+    assert not selector.is_active()
+
+
+def test_frames_are_fetched_only_when_selected():
+    selector = BestFrameSelector(k=1)
+    fetched = []
+
+    def get_frame(seq):
+        fetched.append(seq)
+        return frame(seq)
+
+    for seq, score in enumerate([3., 1., 2., 4.]):
+        selector.offer(score, lambda seq=seq: get_frame(seq))
+
+    assert fetched == [0, 3]
+
+
+def test_missing_frame_is_not_kept():
+    selector = BestFrameSelector(k=1)
+
+    assert not selector.offer(1., lambda: None)
+    assert selector.is_active()
+    assert selector.end_window() == []
+
+
+def test_empty_window_is_not_counted():
+    selector = BestFrameSelector()
+
+    assert selector.end_window() == []
+    assert selector.get_stats()['windows'] == 0
+
+
+def test_blurred_image_scores_lower():
+    image = numpy.zeros((64, 64), numpy.uint8)
+    image[::8] = 255
+
+    selector = BestFrameSelector(scale=0.5)
+
+    assert selector.score(cv2.GaussianBlur(image, (0, 0), 3)) < selector.score(image)
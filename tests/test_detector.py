@@ -0,0 +1,126 @@
+import numpy
+import pytest
+
+from pxl_camera.filter.detector import AbsDiff, Comparison, DetectorChain, GridDiff, SharpnessGate
+from pxl_camera.util import image_processing
+
+
+def comparison(image_a, image_b) -> Comparison:
+    size = image_processing.image_size(image_a)
+
+    def abs_diff(pixel_threshold):
+        count, total, diff = image_processing.diff_count(image_a, image_b, pixel_threshold, size=size)
+        return diff, 255. * count / total
+
+    return Comparison(image_a, image_b, size, abs_diff)
+
+
+def pooled(image_a, image_b, pool: int) -> Comparison:
+    size = image_processing.image_size(image_a)
+    diff, pooled_size = image_processing.max_pool(image_processing.abs_diff(image_a, image_b), pool, size)
+    return Comparison.pooled(diff, pool, size, pooled_size)
+
+
+@pytest.fixture
+def image():
+    return numpy.random.default_rng(0).integers(50, 200, (120, 160), numpy.uint8)
+
+
+def test_equal_images(image):
+    chain = DetectorChain()
+
+    assert chain.evaluate(comparison(image, image.copy()))
+
+    stats = chain.get_stats()
+    assert [stage['name'] for stage in stats] == ['abs_diff', 'grid_diff']
+    assert stats[0]['pass_rate'] == 1.
+    assert stats[1]['equal'] == 1
+
+
+def test_global_change_is_decided_by_abs_diff(image):
+    chain = DetectorChain()
+
+    assert not chain.evaluate(comparison(image, 255 - image))
+    assert chain.get_stats()[0]['different'] == 1
+    assert chain.get_stats()[1]['evaluations'] == 0
+
+
+def test_local_change_is_decided_by_grid_diff(image):
+    changed = image.copy()
+    changed[:12, :32] = 0   # Exactly one cell of the 10 x 5 grid
+
+    chain = DetectorChain([AbsDiff(threshold=50.), GridDiff()])
+
+    assert not chain.evaluate(comparison(image, changed))
+    assert chain.get_stats()[1]['different'] == 1
+
+
+def test_undecided_chain_returns_default(image):
+    chain = DetectorChain([AbsDiff()], default=False)
+
+    assert not chain.evaluate(comparison(image, image))
+    assert chain.undecided == 1
+
+
+def test_intermediates_are_shared(image):
+    calls = []
+    base = comparison(image, image)
+
+    def abs_diff(pixel_threshold):
+        calls.append(pixel_threshold)
+        return base.get_abs_diff(pixel_threshold)
+
+    shared = Comparison(image, image, base.size, abs_diff)
+    DetectorChain([AbsDiff(), GridDiff(), AbsDiff()]).evaluate(shared)
+
+    assert calls == [100]
+    assert shared.get_factor() == 0.
+
+
+def test_callable_stage(image):
+    chain = DetectorChain([lambda comparison: False])
+
+    assert not chain.evaluate(comparison(image, image))
+    assert chain.get_stats()[0]['name'] == '<lambda>'
+
+
+def test_sharpness_gate(image):
+    flat = numpy.full_like(image, 128)
+
+    assert SharpnessGate(scale=1.)(comparison(flat, flat)) is False
+    assert SharpnessGate(scale=1.)(comparison(image, image)) is None
+
+
+@pytest.mark.parametrize('pool', [2, 4])
+def test_bound_equal_implies_equal(image, pool):
+    rng = numpy.random.default_rng(pool)
+    chain = DetectorChain()
+    bound = 0
+
+    for _ in range(40):
+        noise = rng.integers(-3, 4, image.shape)
+        changed = numpy.clip(image + noise, 0, 255).astype(numpy.uint8)
+        y, x = rng.integers(0, 110), rng.integers(0, 150)
+        height, width = rng.integers(1, 10, 2)
+        changed[y:y + height, x:x + width] = rng.integers(0, 256)
+
+        if chain.bound_equal(pooled(image, changed, pool)):
+            bound += 1
+            assert chain.evaluate(comparison(image, changed))
+
+    assert bound
+
+
+def test_bound_equal_of_static_scene(image):
+    noise = numpy.random.default_rng(1).integers(-2, 3, image.shape)
+    changed = numpy.clip(image + noise, 0, 255).astype(numpy.uint8)
+
+    assert DetectorChain().bound_equal(pooled(image, changed, 8))
+
+
+def test_bound_needs_bound_stages(image):
+    chain = DetectorChain([AbsDiff(), SharpnessGate()])
+
+    assert not chain.can_bound()
+    assert not chain.bound_equal(pooled(image, image, 4))
+    assert chain.get_stats()[0]['evaluations'] == 0
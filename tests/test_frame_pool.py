@@ -0,0 +1,103 @@
+import gc
+import threading
+
+from pxl_camera.util.frame_pool import FramePool
+from pxl_camera.util.frame import Frame
+
+
+SHAPE = (10, 10, 3)     # 300 bytes
+
+
+def test_released_buffer_is_reused():
+    pool = FramePool()
+
+    buffer = pool.acquire(SHAPE)
+    address = buffer.__array_interface__['data'][0]
+    del buffer
+    gc.collect()
+
+    buffer = pool.acquire(SHAPE)
+    assert buffer.__array_interface__['data'][0] == address
+    assert pool.get_stats()['allocations'] == 1
+    assert pool.get_stats()['reuses'] == 1
+
+
+def test_frame_view_keeps_lease():
+    pool = FramePool()
+
+    buffer = pool.acquire(SHAPE)
+    frame = Frame(10, 10, 3, buffer)
+    del buffer
+    gc.collect()
+
+    assert pool.get_stats()['bytes_leased'] == 300
+
+    del frame
+    gc.collect()
+
+    assert pool.get_stats()['bytes_leased'] == 0
+
+
+def test_drop_oldest_returns_none_when_exhausted():
+    pool = FramePool(max_bytes=600, policy=FramePool.Policy.DROP_OLDEST)
+
+    leased = [pool.acquire(SHAPE), pool.acquire(SHAPE)]
+
+    assert all(buffer is not None for buffer in leased)
+    assert pool.acquire(SHAPE) is None
+    assert pool.get_stats()['exhausted'] == 1
+
+
+def test_idle_buffers_of_other_shapes_are_evicted():
+    pool = FramePool(max_bytes=600)
+
+    buffer = pool.acquire((20, 15))
+    del buffer
+    gc.collect()
+
+    leased = [pool.acquire(SHAPE), pool.acquire(SHAPE)]
+
+    assert all(buffer is not None for buffer in leased)
+    assert pool.get_stats()['evictions'] == 1
+    assert pool.get_stats()['bytes_total'] == 600
+
+
+def test_block_waits_for_release():
+    pool = FramePool(max_bytes=300, policy=FramePool.Policy.BLOCK, timeout=5.)
+    leased = [pool.acquire(SHAPE)]
+
+    def release():
+        leased.clear()
+        gc.collect()
+
+    timer = threading.Timer(0.1, release)
+    timer.start()
+
+    buffer = pool.acquire(SHAPE)
+    timer.join()
+
+    assert buffer is not None
+    assert pool.get_stats()['waits'] == 1
+
+
+def test_block_times_out():
+    pool = FramePool(max_bytes=300, policy=FramePool.Policy.BLOCK, timeout=0.05)
+    leased = pool.acquire(SHAPE)
+
+    assert leased is not None
+    assert pool.acquire(SHAPE) is None
+    assert pool.get_stats()['exhausted'] == 1
+
+
+def test_lowered_budget_drops_released_buffers():
+    pool = FramePool()
+    buffer = pool.acquire(SHAPE)
+
+    pool.configure(max_bytes=0)
+    del buffer
+    gc.collect()
+
+    stats = pool.get_stats()
+    assert stats['bytes_total'] == 0
+    assert stats['idle'] == {}
+    assert pool.acquire((1,)) is None
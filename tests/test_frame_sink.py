@@ -0,0 +1,106 @@
+import datetime
+import threading
+
+import cv2
+import numpy
+import pytest
+
+from pxl_camera.sink.frame_sink import FrameSink
+from pxl_camera.util.frame import Frame
+
+
+def frame(seq: int) -> Frame:
+    image = numpy.full((16, 16, 3), seq, numpy.uint8)
+    return Frame(16, 16, 3, image, datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=seq), seq=seq)
+
+
+@pytest.fixture
+def held_writer(monkeypatch):
+    """
+        Holds the writer thread until the event is set, so the queue fills up.
+    """
+    release = threading.Event()
+    write_batch = FrameSink._write_batch
+
+    def held(self, batch):
+        release.wait(5.)
+        write_batch(self, batch)
+
+    monkeypatch.setattr(FrameSink, '_write_batch', held)
+    return release
+
+
+def written(directory) -> list:
+    return sorted(path.name for path in directory.glob('*.jpeg'))
+
+
+def test_frames_are_written(tmp_path):
+    with FrameSink(str(tmp_path), file_format='{seq}.jpeg') as sink:
+        for seq in range(3):
+            assert sink.put(frame(seq))
+
+    assert written(tmp_path) == ['0.jpeg', '1.jpeg', '2.jpeg']
+    assert cv2.imread(str(tmp_path / '1.jpeg'))[8, 8, 0] == pytest.approx(1, abs=2)
+
+    stats = sink.get_stats()
+    assert stats['accepted'] == stats['written'] == 3
+    assert stats['queue_depth'] == 0
+
+
+def test_put_on_stopped_sink_is_dropped(tmp_path):
+    assert not FrameSink(str(tmp_path)).put(frame(0))
+
+
+def test_drop_policy(tmp_path, held_writer):
+    sink = FrameSink(str(tmp_path), file_format='{seq}.jpeg', queue_size=2, policy=FrameSink.Policy.DROP)
+    sink.start()
+
+    results = [sink.put(frame(seq)) for seq in range(4)]
+    held_writer.set()
+    sink.stop()
+
+    assert results == [True, True, False, False]
+    assert sink.get_stats()['dropped'] == 2
+    assert written(tmp_path) == ['0.jpeg', '1.jpeg']
+
+
+def test_block_policy_times_out(tmp_path, held_writer):
+    sink = FrameSink(str(tmp_path), queue_size=1, policy=FrameSink.Policy.BLOCK, block_timeout=0.05)
+    sink.start()
+
+    assert sink.put(frame(0))
+    assert not sink.put(frame(1))
+    held_writer.set()
+    sink.stop()
+
+    assert sink.get_stats()['blocked_time'] >= 0.05
+
+
+def test_spill_policy_writes_spilled_frames_later(tmp_path, held_writer):
+    sink = FrameSink(str(tmp_path), file_format='{seq}.jpeg', queue_size=2, policy=FrameSink.Policy.SPILL,
+                     batch_interval=0.05)
+    sink.start()
+
+    assert all(sink.put(frame(seq)) for seq in range(4))
+    held_writer.set()
+    sink.stop()
+
+    stats = sink.get_stats()
+    assert stats['spilled'] == 2
+    assert stats['spill_pending'] == 0
+    assert written(tmp_path) == ['0.jpeg', '1.jpeg', '2.jpeg', '3.jpeg']
+    assert not list((tmp_path / '.spill').glob('*.npy'))
+
+
+def test_spill_is_bounded(tmp_path, held_writer):
+    sink = FrameSink(str(tmp_path), queue_size=2, policy=FrameSink.Policy.SPILL, max_spill=1,
+                     batch_interval=0.05)
+    sink.start()
+
+    results = [sink.put(frame(seq)) for seq in range(5)]
+    held_writer.set()
+    sink.stop()
+
+    assert results == [True, True, True, False, False]
+    assert sink.get_stats()['dropped'] == 2
+    assert len(written(tmp_path)) == 3
@@ -0,0 +1,87 @@
+"""
+    ReplayCapture -> FrameMuxer -> Processor -> sinks, without hardware.
+"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pxl_actor')
+
+from pxl_camera.capture.frame_muxer import FrameMuxer
+from pxl_camera.capture.replay_capture import ReplayCapture
+from pxl_camera.filter.processor import Processor
+
+
+ANALYSIS = 'analysis'
+PREVIEW = 'preview'
+
+
+class ListSink:
+
+    def __init__(self):
+        self.frames = []
+        self.lock = threading.Lock()
+
+    def put(self, frame):
+        with self.lock:
+            self.frames.append(frame)
+
+
+@pytest.fixture
+def pipeline():
+    # Unpaced, so frames are grabbed while the processor decides
+    capture = ReplayCapture(ReplayCapture.Config(
+        source=ReplayCapture.SYNTHETIC,
+        frame_width=64,
+        frame_height=48,
+        realtime=False,
+    ))
+    muxer = FrameMuxer()
+    muxer.start(capture_actor=capture)
+    muxer.add_stream(ANALYSIS, FrameMuxer.Stream(colorspace='GRAY', scale=0.5, roi=True))
+    muxer.add_stream(PREVIEW, FrameMuxer.Stream(colorspace='BGR', scale=0.25))
+
+    processor = Processor(stream=ANALYSIS)
+
+    yield capture, muxer, processor
+
+    processor.stop()
+    muxer.stop()
+    capture.stop()
+    for actor in (processor, muxer, capture):
+        actor.kill()
+
+
+def test_sinks_get_frames_of_decided_seq(pipeline):
+    capture, muxer, processor = pipeline
+
+    raw = ListSink()
+    preview = ListSink()
+    processor.add_sink(raw, tuple(Processor.State))
+    processor.add_sink(preview, tuple(Processor.State), PREVIEW)
+
+    events = []
+    processor.subscribe(callback=events.append)
+
+    processor.start(muxer_actor=muxer)
+    time.sleep(1.)
+    processor.stop()
+
+    assert len(raw.frames) > 10
+    assert processor.get_schedule_stats()['sink_missed'] == 0
+
+    # Every decision goes to every sink, with the frame it was made on
+    assert [frame.seq for frame in raw.frames] == [frame.seq for frame in preview.frames]
+    assert [frame.state for frame in raw.frames] == [frame.state for frame in preview.frames]
+
+    seqs = [frame.seq for frame in raw.frames]
+    assert seqs == sorted(set(seqs))
+
+    states = {frame.seq: frame.state for frame in raw.frames}
+    for event in events:
+        if event.seq in states:
+            assert states[event.seq] == event.state
+
+    assert raw.frames[0].width == 64 and raw.frames[0].channels == 3
+    assert preview.frames[0].width == 16
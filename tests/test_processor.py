@@ -0,0 +1,84 @@
+import datetime
+
+import numpy
+import pytest
+
+pytest.importorskip('pxl_actor')
+
+from pxl_camera.filter.best_frame import BestFrameSelector
+from pxl_camera.filter.processor import Processor
+from pxl_camera.util.frame import Frame
+
+
+class FakeProcessor:
+    """
+        Sink feeding state of a Processor, without the actor around it.
+    """
+    _feed_sinks = Processor._feed_sinks
+    _feed_best = Processor._feed_best
+    _emit_best = staticmethod(Processor._emit_best)
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+        self.frame = None
+        self.score = 0.
+        self._sink_frames = {}
+        self.schedule_stats = {'sink_missed': 0}
+
+    def _sharpness(self, selector: BestFrameSelector) -> float:
+        return self.score
+
+    def decide(self, seq: int, score: float, state: Processor.State):
+        # As handed over by FrameMuxer.get_frames(): processed and sink frame of the same seq
+        image = numpy.full((4, 4, 3), seq, numpy.uint8)
+        self.frame = Frame(4, 4, 3, image[..., 0], datetime.datetime.now(), seq=seq)
+        self._sink_frames = {None: Frame(4, 4, 3, image, datetime.datetime.now(), seq=seq)}
+        self.score = score
+        self._feed_sinks(state)
+
+
+class ListSink:
+
+    def __init__(self):
+        self.frames = []
+
+    def put(self, frame: Frame):
+        self.frames.append(frame)
+
+
+def test_best_frames_of_good_window_reach_sink():
+    sink = ListSink()
+    processor = FakeProcessor([(sink, frozenset([Processor.State.GOOD]), None, BestFrameSelector(2))])
+
+    for seq, score in [(1, 10.), (2, 50.), (3, 30.), (4, 40.)]:
+        processor.decide(seq, score, Processor.State.GOOD)
+
+    # Nothing is emitted while the window lasts
+    assert sink.frames == []
+
+    processor.decide(5, 100., Processor.State.MOVE)
+
+    assert [frame.seq for frame in sink.frames] == [2, 4]
+    assert all(frame.state == Processor.State.GOOD for frame in sink.frames)
+    assert all(frame.frame[0, 0, 0] == frame.seq for frame in sink.frames)
+    assert processor.schedule_stats['sink_missed'] == 0
+
+
+def test_plain_sink_gets_frame_of_decided_seq():
+    sink = ListSink()
+    processor = FakeProcessor([(sink, frozenset([Processor.State.GOOD]), None, None)])
+
+    processor.decide(1, 0., Processor.State.MOVE)
+    processor.decide(2, 0., Processor.State.GOOD)
+
+    assert [(frame.seq, frame.state) for frame in sink.frames] == [(2, Processor.State.GOOD)]
+
+
+def test_missing_sink_frame_is_counted():
+    sink = ListSink()
+    processor = FakeProcessor([(sink, frozenset([Processor.State.GOOD]), 'history', None)])
+
+    processor.decide(1, 0., Processor.State.GOOD)
+
+    assert sink.frames == []
+    assert processor.schedule_stats['sink_missed'] == 1
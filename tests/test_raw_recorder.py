@@ -0,0 +1,72 @@
+import datetime
+
+import numpy
+import pytest
+
+from pxl_camera.sink.raw_recorder import RawRecorder, RawRecording, SEGMENT_GLOB
+
+
+def raw_frame(value: int, width: int = 8, height: int = 4) -> numpy.ndarray:
+    return numpy.full((height, width, 2), value, numpy.uint8)
+
+
+def record(directory, frames, segment_size: int = 2 ** 20):
+    """
+        Records (camera, seq, value) frames in one session.
+    """
+    with RawRecorder(str(directory), segment_size=segment_size) as recorder:
+        for camera, seq, value in frames:
+            assert recorder.put(camera, seq, datetime.datetime.now(), raw_frame(value), 'UYVY')
+    return recorder
+
+
+def test_index_round_trip(tmp_path):
+    record(tmp_path, [('a', 1, 10), ('b', 1, 20), ('a', 2, 30)])
+
+    recording = RawRecording(str(tmp_path))
+
+    assert len(recording) == 3
+    assert sorted(recording.get_cameras()) == ['a', 'b']
+
+    position = recording.find('a', 2)
+    assert (recording.get_raw(position) == raw_frame(30)).all()
+    assert recording.get_frame(position).seq == 2
+    assert recording.get_frame(position).get_size() == (8, 4, 3)
+
+
+def test_segments_roll_over(tmp_path):
+    # Two 64 byte frames per segment
+    record(tmp_path, [('a', seq, seq) for seq in range(5)], segment_size=128)
+
+    recording = RawRecording(str(tmp_path))
+
+    assert len(list(tmp_path.glob(SEGMENT_GLOB))) == 3
+    for seq in range(5):
+        assert (recording.get_raw(recording.find('a', seq)) == raw_frame(seq)).all()
+
+
+def test_appended_sessions_keep_their_frames(tmp_path):
+    first = record(tmp_path, [('a', 1, 10), ('a', 2, 20)])
+    # Sequence numbers restart with the next process
+    second = record(tmp_path, [('a', 1, 30)])
+
+    recording = RawRecording(str(tmp_path))
+
+    assert (first.session, second.session) == (0, 1)
+    assert recording.get_sessions() == [0, 1]
+    assert (recording.get_raw(recording.find('a', 1)) == raw_frame(30)).all()
+    assert (recording.get_raw(recording.find('a', 1, session=0)) == raw_frame(10)).all()
+    assert (recording.get_raw(recording.find('a', 2)) == raw_frame(20)).all()
+
+    with pytest.raises(KeyError):
+        recording.find('a', 2, session=1)
+
+
+def test_find_time(tmp_path):
+    record(tmp_path, [('a', 1, 10)])
+    recording = RawRecording(str(tmp_path))
+
+    assert recording.find_time('a', datetime.datetime.now()) == 0
+
+    with pytest.raises(KeyError):
+        recording.find_time('b', datetime.datetime.now())
@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+from pxl_camera.util import image_processing
+from pxl_camera.util.region_stats import RegionStats
+
+
+@pytest.fixture
+def image():
+    return numpy.random.default_rng(0).integers(0, 256, (61, 83, 3), numpy.uint8)
+
+
+def test_rectangle_mean_and_variance(image):
+    stats = RegionStats(image, squares=True)
+    region = image[5:40, 10:70].astype(numpy.float64)
+
+    assert stats.mean(10, 5, 70, 40) == pytest.approx(region.mean())
+    assert stats.variance(10, 5, 70, 40) == pytest.approx(region.var())
+
+
+def test_empty_rectangle(image):
+    stats = RegionStats(image, squares=True)
+
+    assert stats.mean(10, 10, 10, 20) == 0.
+    assert stats.variance(10, 10, 10, 20) == 0.
+
+
+def test_roi_mean(image):
+    stats = RegionStats(image)
+    x1, y1, x2, y2 = image_processing.roi_bounds(83, 61, (0.25, 0.5, 0.75, 1.))
+
+    assert stats.roi_mean((0.25, 0.5, 0.75, 1.)) == pytest.approx(image[y1:y2, x1:x2].mean())
+    assert stats.roi_mean() == pytest.approx(image.mean())
+
+
+def test_grid_means_match_image_processing(image):
+    assert RegionStats(image).grid_means(10, 5) == pytest.approx(image_processing.grid_means(image, 10, 5))
+
+
+def test_grid_variances(image):
+    stats = RegionStats(image, squares=True)
+    cell = image[:6, :16].astype(numpy.float64)
+
+    assert stats.grid_variances(10, 5)[0, 0] == pytest.approx(cell.var())
+
+
+def test_variance_needs_squares(image):
+    with pytest.raises(RuntimeError):
+        RegionStats(image).variance(0, 0, 10, 10)
+
+
+@pytest.mark.parametrize('pool', [2, 4, 8])
+def test_pooled_grid_means_bound_grid_means(image, pool):
+    pooled, _ = image_processing.max_pool(image, pool)
+    bounds = RegionStats(pooled).pooled_grid_means(7, 3, 83, 61, pool)
+
+    assert (image_processing.grid_means(image, 7, 3) <= bounds + 1e-9).all()
@@ -0,0 +1,208 @@
+"""
+    V4L2Capture against a fake device: ioctl(), select() and mmap() of the
+    module are replaced by an in-memory driver, see FakeDevice.
+"""
+import collections
+import errno
+import mmap
+
+import cv2
+import pytest
+
+from pxl_camera.capture import v4l2_capture
+from pxl_camera.capture.v4l2_capture import V4L2Capture
+
+
+FD = 1234
+PAGE = 4096
+UYVY = cv2.VideoWriter_fourcc(*'UYVY')
+
+# Not patched by the fixture - backs the driver buffers
+anonymous_mmap = mmap.mmap
+
+
+class FakeDevice:
+    """
+        Driver of a camera streaming frames filled with their sequence number.
+    """
+
+    def __init__(self, width: int = 8, height: int = 4):
+        self.width = width
+        self.height = height
+        self.pixelformat = UYVY
+        self.controls = {}
+
+        self.maps = []          # Anonymous mmaps standing in for driver buffers
+        self.queued = collections.deque()
+        self.streaming = False
+        self.requested = []     # Counts of VIDIOC_REQBUFS
+        self.sequence = 0
+
+    def ioctl(self, fd, request, arg):
+        assert fd == FD
+
+        if request == v4l2_capture.VIDIOC_G_FMT:
+            arg.fmt.pix.width = self.width
+            arg.fmt.pix.height = self.height
+            arg.fmt.pix.pixelformat = self.pixelformat
+            arg.fmt.pix.bytesperline = self.width * 2
+            arg.fmt.pix.sizeimage = self.width * self.height * 2
+        elif request == v4l2_capture.VIDIOC_S_FMT:
+            if self.maps:
+                raise OSError(errno.EBUSY, 'buffers allocated')
+            # UYVY needs even widths
+            self.width = arg.fmt.pix.width & ~1
+            self.height = arg.fmt.pix.height
+            self.pixelformat = arg.fmt.pix.pixelformat
+        elif request == v4l2_capture.VIDIOC_REQBUFS:
+            self.requested.append(arg.count)
+            if arg.count == 0:
+                if any(not buffer.closed for buffer in self.maps):
+                    raise OSError(errno.EBUSY, 'buffers mapped')
+                self.maps = []
+            else:
+                self.maps = [anonymous_mmap(-1, PAGE) for _ in range(arg.count)]
+        elif request == v4l2_capture.VIDIOC_QUERYBUF:
+            arg.length = self.width * self.height * 2
+            arg.m.offset = arg.index * PAGE
+        elif request == v4l2_capture.VIDIOC_QBUF:
+            assert arg.index not in self.queued
+            self.queued.append(arg.index)
+        elif request == v4l2_capture.VIDIOC_DQBUF:
+            arg.index = self.queued.popleft()
+            arg.sequence = self.sequence
+            self.maps[arg.index][:PAGE] = bytes([self.sequence % 256]) * PAGE
+            self.sequence += 1
+        elif request == v4l2_capture.VIDIOC_STREAMON:
+            self.streaming = True
+        elif request == v4l2_capture.VIDIOC_STREAMOFF:
+            self.streaming = False
+            self.queued.clear()
+        elif request == v4l2_capture.VIDIOC_G_CTRL:
+            arg.value = self.controls.get(arg.id, 0)
+        elif request == v4l2_capture.VIDIOC_S_CTRL:
+            self.controls[arg.id] = arg.value
+        else:
+            raise OSError(errno.ENOTTY, 'unsupported ioctl')
+
+    def select(self, readable, writable, exceptional, timeout=None):
+        return (readable if self.streaming and self.queued else []), [], []
+
+    def mmap(self, fd, length, flags, prot, offset):
+        assert fd == FD and length <= PAGE
+        return self.maps[offset // PAGE]
+
+
+@pytest.fixture
+def device(monkeypatch):
+    device = FakeDevice()
+    monkeypatch.setattr(v4l2_capture.fcntl, 'ioctl', device.ioctl)
+    monkeypatch.setattr(v4l2_capture.select, 'select', device.select)
+    monkeypatch.setattr(v4l2_capture.mmap, 'mmap', device.mmap)
+    return device
+
+
+@pytest.fixture
+def capture(device):
+    capture = V4L2Capture(buffer_count=3, timeout=0.)
+    assert capture.open(fd=FD)
+    yield capture
+    capture.release()
+
+
+def test_open_reads_format(capture):
+    assert capture.isOpened()
+    assert capture.get(cv2.CAP_PROP_FRAME_WIDTH) == 8
+    assert capture.get(cv2.CAP_PROP_FRAME_HEIGHT) == 4
+    assert capture.get(cv2.CAP_PROP_FOURCC) == UYVY
+    assert capture.get(cv2.CAP_PROP_BUFFERSIZE) == 3
+
+
+def test_read_returns_buffer_view(capture, device):
+    for sequence in range(5):
+        success, frame = capture.read()
+        assert success
+        assert frame.shape == (4, 8, 2)
+        assert not frame.flags.owndata
+        assert (frame == sequence).all()
+
+    assert device.requested == [3]
+    assert device.streaming
+
+
+def test_grab_requeues_held_buffer(capture, device):
+    assert capture.grab()
+    assert len(device.queued) == 2
+
+    assert capture.grab()
+    assert len(device.queued) == 2
+    assert sorted(device.queued + collections.deque([capture._held.index])) == [0, 1, 2]
+
+
+def test_grab_timeout(capture, device):
+    assert capture.grab()
+    device.queued.clear()
+
+    # The held buffer is queued again and is the only one the driver has
+    device.streaming = False
+    assert not capture.grab()
+    assert capture.retrieve() == (False, None)
+
+
+def test_set_format_restarts_streaming(capture, device):
+    assert capture.grab()
+
+    assert capture.set(cv2.CAP_PROP_FRAME_WIDTH, 16)
+    assert not device.streaming
+    assert device.requested == [3, 0]
+
+    # Driver rounds UYVY widths to even
+    assert not capture.set(cv2.CAP_PROP_FRAME_WIDTH, 11)
+    assert capture.get(cv2.CAP_PROP_FRAME_WIDTH) == 10
+
+    success, frame = capture.read()
+    assert success
+    assert frame.shape == (4, 10, 2)
+
+
+def test_controls(capture, device):
+    assert capture.set(cv2.CAP_PROP_AUTOFOCUS, True)
+    assert capture.set(cv2.CAP_PROP_FOCUS, 42)
+    assert capture.get(cv2.CAP_PROP_AUTOFOCUS) == 1
+    assert capture.get(cv2.CAP_PROP_FOCUS) == 42
+
+    assert capture.set(cv2.CAP_PROP_CONVERT_RGB, False)
+    assert not capture.set(cv2.CAP_PROP_CONVERT_RGB, True)
+
+
+def test_release_keeps_live_views(capture, device):
+    success, frame = capture.read()
+    assert success
+
+    # The mapping can't be closed and the driver refuses to free the buffers
+    capture.release()
+    assert not capture.isOpened()
+    assert (frame == 0).all()
+    assert device.requested == [3, 0]
+    assert [buffer.closed for buffer in device.maps] == [False, True, True]
+
+
+def test_release_frees_buffers(capture, device):
+    capture.read()
+    capture.release()
+
+    assert device.requested == [3, 0]
+    assert device.maps == []
+    assert not device.streaming
+
+
+def test_unsupported_device(monkeypatch):
+    def ioctl(fd, request, arg):
+        raise OSError(errno.ENOTTY, 'not a video device')
+
+    monkeypatch.setattr(v4l2_capture.fcntl, 'ioctl', ioctl)
+
+    capture = V4L2Capture()
+    assert not capture.open(fd=FD)
+    assert not capture.isOpened()
+    assert not capture.read()[0]
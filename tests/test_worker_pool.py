@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from pxl_camera.filter.worker_pool import WorkerPool
+
+
+def busy(seconds: float):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_tasks_run_and_are_counted():
+    done = threading.Event()
+
+    with WorkerPool(workers=2) as pool:
+        pool.submit('a', lambda: None)
+        pool.submit('a', done.set)
+        assert done.wait(1.)
+
+    stats = pool.get_stats()['a']
+    assert stats['submitted'] == stats['completed'] == 2
+    assert stats['errors'] == 0
+
+
+def test_failing_task_is_logged_and_counted(caplog):
+    def fail():
+        raise ValueError('boom')
+
+    with WorkerPool(workers=1) as pool:
+        pool.submit('a', fail)
+
+    assert pool.get_stats()['a']['errors'] == 1
+    assert 'Task of [a] failed' in caplog.text
+
+
+def test_stop_runs_pending_tasks():
+    ran = []
+
+    pool = WorkerPool(workers=1)
+    pool.submit('a', lambda: busy(0.05))
+    for i in range(5):
+        pool.submit('a', lambda i=i: ran.append(i))
+    pool.stop()
+
+    assert ran == list(range(5))
+
+
+def test_priorities_share_pool_time():
+    """
+        Two saturating keys on one thread: pool time follows the priorities.
+    """
+    pool = WorkerPool(workers=1)
+    pool.set_priority('high', 3.)
+    pool.set_priority('low', 1.)
+
+    # Both keys are queued up while the only thread is held
+    gate = threading.Event()
+    pool.submit('gate', gate.wait)
+    for _ in range(300):
+        pool.submit('high', lambda: busy(0.001))
+        pool.submit('low', lambda: busy(0.001))
+    gate.set()
+
+    time.sleep(0.2)
+    stats = pool.get_stats()
+    pool.stop()
+
+    assert stats['low']['pending'] and stats['high']['pending']
+    assert stats['high']['busy_time'] / stats['low']['busy_time'] == pytest.approx(3., rel=0.3)
+
+
+def test_invalid_priority():
+    with pytest.raises(ValueError):
+        WorkerPool().set_priority('a', 0.)